@@ -0,0 +1,48 @@
+"""
+Filename: bench_checkout_writes.py
+Description: benchmark of the cost of persisting a checkout versus database size, per backend
+
+Usage: python -m benchmarks.bench_checkout_writes [sizes...]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from library.library_db_interface import Library_DB
+
+CHECKOUTS = 200
+
+
+def measure(backend, path, size):
+    """Times write-through checkouts on a database holding the given number of patrons.
+
+    :returns: the mean time per checkout in milliseconds
+    """
+    db = Library_DB(path, backend=backend)
+    db.insert_patrons([{'fname': 'first', 'lname': 'last', 'age': 30, 'memberID': i}
+                       for i in range(1, size + 1)])
+    patron = db.retrieve_patron(1)
+    start = time.perf_counter()
+    for index in range(CHECKOUTS):
+        patron.add_borrowed_book('book %d' % index)
+        db.update_patron(patron)
+    elapsed = time.perf_counter() - start
+    db.close_db()
+    return elapsed / CHECKOUTS * 1e3
+
+
+def main(sizes):
+    print('%10s %10s %16s' % ('patrons', 'backend', 'checkout (ms)'))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            for backend in Library_DB.BACKENDS:
+                path = os.path.join(directory, Library_DB.DEFAULT_FILES[backend])
+                print('%10d %10s %16.3f' % (size, backend, measure(backend, path, size)))
+                for name in os.listdir(directory):
+                    os.remove(os.path.join(directory, name))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000])
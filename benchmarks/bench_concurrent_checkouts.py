@@ -0,0 +1,52 @@
+"""
+Filename: bench_concurrent_checkouts.py
+Description: throughput of concurrent Library checkouts by thread count
+
+Usage: python -m benchmarks.bench_concurrent_checkouts [backend] [threads...]
+"""
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from library.library import Library
+from library.library_db_interface import Library_DB
+
+PATRONS = 1000
+CHECKOUTS = 20000
+
+
+def run(backend, threads):
+    """Borrows and returns books for random patrons from a pool of threads.
+
+    :returns: the number of checkouts per second
+    """
+    db = Library_DB(Library_DB.MEMORY, identity_map=True, backend=backend)
+    library = Library(db)
+    library.register_patrons(('first', 'last', 20, memberID) for memberID in range(PATRONS))
+    patrons = [db.retrieve_patron(memberID) for memberID in range(PATRONS)]
+    per_thread = CHECKOUTS // threads
+
+    def work(thread):
+        for number in range(per_thread):
+            patron = patrons[(thread * per_thread + number) % PATRONS]
+            library.borrow_book('book %d' % number, patron)
+            library.return_borrowed_book('book %d' % number, patron)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(work, range(threads)))
+    elapsed = time.perf_counter() - start
+    db.close_db()
+    return per_thread * threads * 2 / elapsed
+
+
+def main(backend, thread_counts):
+    print('%8s %8s %16s' % ('backend', 'threads', 'checkouts/s'))
+    for threads in thread_counts:
+        print('%8s %8d %16.0f' % (backend, threads, run(backend, threads)))
+
+
+if __name__ == '__main__':
+    backend = sys.argv[1] if len(sys.argv) > 1 else 'sqlite'
+    main(backend, [int(arg) for arg in sys.argv[2:]] or [1, 2, 4, 8])
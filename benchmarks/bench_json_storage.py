@@ -0,0 +1,56 @@
+"""
+Filename: bench_json_storage.py
+Description: benchmark of TinyDB storage read/write cost versus database size
+
+Usage: python -m benchmarks.bench_json_storage [sizes...]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from tinydb.storages import JSONStorage
+
+from library.storage import CompactJSONStorage, CODECS
+
+
+def make_state(size):
+    """Builds a TinyDB database state holding the given number of patrons."""
+    return {'_default': {str(i): {'fname': 'first', 'lname': 'last', 'age': 30, 'memberID': i,
+                                  'borrowed_books': ['redwall', 'mossflower']}
+                         for i in range(1, size + 1)}}
+
+
+def measure(storage, state):
+    """Times a write and a read of the whole database.
+
+    :returns: the write and read times in milliseconds
+    """
+    start = time.perf_counter()
+    storage.write(state)
+    written = time.perf_counter()
+    storage.read()
+    read = time.perf_counter()
+    return (written - start) * 1e3, (read - written) * 1e3
+
+
+def main(sizes):
+    storages = [('JSONStorage', lambda path: JSONStorage(path))]
+    for name in CODECS:
+        storages.append(('compact ' + name, lambda path, name=name: CompactJSONStorage(path, codec=name)))
+    print('%10s %18s %12s %12s %12s' % ('patrons', 'storage', 'write (ms)', 'read (ms)', 'size (kB)'))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            state = make_state(size)
+            for label, factory in storages:
+                path = os.path.join(directory, 'db.json')
+                storage = factory(path)
+                write, read = measure(storage, state)
+                storage.close()
+                print('%10d %18s %12.1f %12.1f %12.0f' % (size, label, write, read, os.path.getsize(path) / 1024))
+                os.remove(path)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000])
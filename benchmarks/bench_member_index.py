@@ -0,0 +1,56 @@
+"""
+Filename: bench_member_index.py
+Description: benchmark of Library_DB memberID lookups, indexed versus Query scans
+
+Usage: python -m benchmarks.bench_member_index [sizes...]
+"""
+
+import sys
+import time
+
+from tinydb import Query
+
+from library.library_db_interface import Library_DB
+
+LOOKUPS = 1000
+SCANS = 5
+
+
+def open_db(size):
+    """Opens a Library_DB holding the given number of patrons in memory.
+
+    :param size: the number of patrons
+    :returns: the Library_DB object
+    """
+    library_db = Library_DB(Library_DB.MEMORY)
+    library_db.insert_patrons(('first', 'last', 30, i) for i in range(size))
+    return library_db
+
+
+def time_per_call(function, args):
+    """Times a function over the given arguments.
+
+    :returns: the mean number of microseconds per call
+    """
+    start = time.perf_counter()
+    for arg in args:
+        function(arg)
+    return (time.perf_counter() - start) / len(args) * 1e6
+
+
+def main(sizes):
+    print('%10s %14s %14s %14s' % ('patrons', 'index (us)', 'update (us)', 'scan (us)'))
+    for size in sizes:
+        library_db = open_db(size)
+        step = max(1, size // LOOKUPS)
+        ids = list(range(0, size, step))[:LOOKUPS]
+        lookup = time_per_call(library_db.retrieve_patron, ids)
+        patrons = [library_db.retrieve_patron(i) for i in ids[:SCANS]]
+        update = time_per_call(library_db.update_patron, patrons)
+        query = Query()
+        scan = time_per_call(lambda i: library_db.db.search(query.memberID == i), ids[-SCANS:])
+        print('%10d %14.1f %14.1f %14.1f' % (size, lookup, update, scan))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000, 1000000])
@@ -0,0 +1,55 @@
+"""
+Filename: bench_patron_construction.py
+Description: benchmark of Patron construction throughput
+
+Usage: python -m benchmarks.bench_patron_construction [records]
+"""
+
+import re
+import sys
+import time
+
+from library.patron import Patron, InvalidNameException
+
+
+def construct_uncompiled(record):
+    """Constructs a Patron validating the names the way Patron.__init__ used to."""
+    if re.search('\\d', record['fname']) or re.search('\\d', record['lname']):
+        raise InvalidNameException("Name should not contain numbers")
+    patron = Patron.__new__(Patron)
+    patron.fname = record['fname']
+    patron.lname = record['lname']
+    patron.age = record['age']
+    patron.memberID = record['memberID']
+    patron.borrowed_books = {}
+    return patron
+
+
+def construct_validated(record):
+    """Constructs a Patron through the validating constructor."""
+    return Patron(record['fname'], record['lname'], record['age'], record['memberID'])
+
+
+def rate(function, records):
+    """Measures how many Patrons per second the function constructs."""
+    start = time.perf_counter()
+    for record in records:
+        function(record)
+    return len(records) / (time.perf_counter() - start)
+
+
+def main(count):
+    records = [{'fname': 'first', 'lname': 'last', 'age': 30, 'memberID': i, 'borrowed_books': []}
+               for i in range(count)]
+    print('%28s %16s' % ('path', 'patrons/s'))
+    print('%28s %16.0f' % ('re.search per call', rate(construct_uncompiled, records)))
+    print('%28s %16.0f' % ('Patron() compiled validator', rate(construct_validated, records)))
+    print('%28s %16.0f' % ('Patron.from_db_record', rate(Patron.from_db_record, records)))
+    start = time.perf_counter()
+    for patron in Patron.from_records(records):
+        pass
+    print('%28s %16.0f' % ('Patron.from_records', count / (time.perf_counter() - start)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,85 @@
+"""
+Filename: bench_patron_memory.py
+Description: benchmark of the memory used per Patron and of borrowed book lookups
+
+Usage: python -m benchmarks.bench_patron_memory [patrons] [books for the lookup]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from library.patron import Patron
+
+LOAN_COUNTS = (0, 1, 3, 10, 50)
+
+
+class DictPatron:
+    """Patron as it was before __slots__: an instance dictionary and a list of books."""
+
+    def __init__(self, fname, lname, age, memberID):
+        self.fname = fname
+        self.lname = lname
+        self.age = age
+        self.memberID = memberID
+        self.borrowed_books = []
+
+    def add_borrowed_book(self, book):
+        book = book.lower()
+        if book in self.borrowed_books:
+            return
+        self.borrowed_books.append(book)
+
+    def has_borrowed_book(self, book):
+        return book.lower() in self.borrowed_books
+
+
+def bytes_per_patron(patron_cls, count, books):
+    """Measures the memory allocated per patron, each borrowing the same books.
+
+    :returns: the mean number of bytes per patron
+    """
+    titles = ['book %d' % i for i in range(books)]
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    patrons = []
+    for memberID in range(count):
+        patron = patron_cls('first', 'last', 30, memberID)
+        for title in titles:
+            patron.add_borrowed_book(title)
+        patrons.append(patron)
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return used / count
+
+
+def lookup_time(patron_cls, books):
+    """Times has_borrowed_book for the last borrowed title.
+
+    :returns: the mean number of microseconds per lookup
+    """
+    patron = patron_cls('first', 'last', 30, 1)
+    for i in range(books):
+        patron.add_borrowed_book('book %d' % i)
+    title = 'book %d' % (books - 1)
+    start = time.perf_counter()
+    for _ in range(10000):
+        patron.has_borrowed_book(title)
+    return (time.perf_counter() - start) / 10000 * 1e6
+
+
+def main(count, books):
+    print('bytes per patron by number of borrowed books')
+    print('%12s' % 'class' + ''.join('%8d' % loans for loans in LOAN_COUNTS))
+    for patron_cls in (DictPatron, Patron):
+        print('%12s' % patron_cls.__name__
+              + ''.join('%8.0f' % bytes_per_patron(patron_cls, count, loans) for loans in LOAN_COUNTS))
+    print()
+    print('%12s %16s' % ('class', 'lookup (us)'))
+    for patron_cls in (DictPatron, Patron):
+        print('%12s %16.2f' % (patron_cls.__name__, lookup_time(patron_cls, books)))
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(args[0] if args else 100000, args[1] if len(args) > 1 else 500)
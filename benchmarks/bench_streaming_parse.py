@@ -0,0 +1,60 @@
+"""
+Filename: bench_streaming_parse.py
+Description: benchmark of peak memory and time to the first doc, buffered versus streaming parsing
+
+Usage: python -m benchmarks.bench_streaming_parse [docs...]
+"""
+
+import json
+import sys
+import time
+import tracemalloc
+
+from library.json_stream import iter_array_items
+
+CHUNK_SIZE = 16384
+
+
+def make_body(count):
+    """Builds a search.json response body holding the given number of docs."""
+    docs = [{'title': 'title %d' % i, 'ebook_count_i': i % 3, 'language': ['eng', 'fre'],
+             'publisher': ['publisher %d' % i] * 5, 'publish_year': list(range(1990, 2010))}
+            for i in range(count)]
+    return json.dumps({'numFound': count, 'start': 0, 'docs': docs}).encode()
+
+
+def chunks(body):
+    for start in range(0, len(body), CHUNK_SIZE):
+        yield body[start:start + CHUNK_SIZE]
+
+
+def measure(parse, body):
+    """Times a parse and traces its peak memory.
+
+    :returns: the time to the first doc and the total time in milliseconds, and the peak in kB
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    docs = parse(body)
+    next(docs)
+    first = time.perf_counter()
+    for _ in docs:
+        pass
+    done = time.perf_counter()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (first - start) * 1e3, (done - start) * 1e3, peak / 1024
+
+
+def main(counts):
+    parsers = [('json.loads', lambda body: iter(json.loads(body)['docs'])),
+               ('streaming', lambda body: iter_array_items(chunks(body), 'docs'))]
+    print('%8s %12s %14s %12s %12s' % ('docs', 'parser', 'first (ms)', 'all (ms)', 'peak (kB)'))
+    for count in counts:
+        body = make_body(count)
+        for label, parse in parsers:
+            print('%8d %12s %14.2f %12.2f %12.0f' % ((count, label) + measure(parse, body)))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [100, 1000, 10000])
@@ -0,0 +1,125 @@
+"""
+Filename: async_ext_api_interface.py
+Description: module used for interacting with a web service from asyncio code
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from library.ext_api_interface import Books_API
+
+class AsyncBooks_API:
+    """Asyncio counterpart of Books_API with concurrent batch lookups.
+
+    Requests go through a Books_API, so the pooled session and response cache are
+    shared with synchronous callers; they run on a dedicated thread pool so the event
+    loop is never blocked.
+    """
+
+    CONCURRENCY = 10
+
+    def __init__(self, api=None, concurrency=None):
+        """Constructor for the AsyncBooks_API class.
+
+        :param api: the Books_API used for the requests, a new one if not given
+        :param concurrency: the maximum number of requests in flight at once
+        """
+        self.concurrency = concurrency or self.CONCURRENCY
+        self._owns_api = api is None
+        self.api = api if api is not None else Books_API(pool_maxsize=self.concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+    def close(self):
+        """Shuts down the worker threads, and closes the Books_API if this object
+        created it; one given to the constructor is left to its owner."""
+        self._executor.shutdown(wait=True)
+        if self._owns_api:
+            self.api.close()
+
+    async def _run(self, method, arg, semaphore=None):
+        """Runs a blocking Books_API method on the thread pool.
+
+        :param method: the Books_API method
+        :param arg: the argument for the method
+        :param semaphore: limits the number of concurrent calls, if given
+        :returns: the result of the method
+        """
+        loop = asyncio.get_running_loop()
+        if semaphore is None:
+            return await loop.run_in_executor(self._executor, method, arg)
+        async with semaphore:
+            return await loop.run_in_executor(self._executor, method, arg)
+
+    async def _run_many(self, method, args):
+        """Runs a blocking Books_API method for many arguments concurrently.
+
+        :param method: the Books_API method
+        :param args: the arguments for the method
+        :returns: the results, in the same order as the arguments
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        return list(await asyncio.gather(*[self._run(method, arg, semaphore) for arg in args]))
+
+    async def is_book_available(self, book):
+        """Determines if a given book is available to borrow.
+
+        :param book: the title of the book
+        :returns: True if available, False if not
+        """
+        return await self._run(self.api.is_book_available, book)
+
+    async def books_by_author(self, author):
+        """Gets all the books written by a given author.
+
+        :param author: the name of the author
+        :returns: the titles of all the books in a list form
+        """
+        return await self._run(self.api.books_by_author, author)
+
+    async def get_book_info(self, book):
+        """Gets the information for a given book.
+
+        :param book: the title of the book
+        :returns: a list of dictionaries with book data
+        """
+        return await self._run(self.api.get_book_info, book)
+
+    async def get_ebooks(self, book):
+        """Gets the ebooks for a given book.
+
+        :param book: the title of the book
+        :returns: data about the ebooks
+        """
+        return await self._run(self.api.get_ebooks, book)
+
+    async def is_book_available_many(self, books):
+        """Determines if each of the given books is available to borrow.
+
+        :param books: the titles of the books
+        :returns: a list of True/False, in the same order as the titles
+        """
+        return await self._run_many(self.api.is_book_available, books)
+
+    async def books_by_author_many(self, authors):
+        """Gets the books written by each of the given authors.
+
+        :param authors: the names of the authors
+        :returns: a list of title lists, in the same order as the authors
+        """
+        return await self._run_many(self.api.books_by_author, authors)
+
+    async def get_book_info_many(self, books):
+        """Gets the information for each of the given books.
+
+        :param books: the titles of the books
+        :returns: a list of book data lists, in the same order as the titles
+        """
+        return await self._run_many(self.api.get_book_info, books)
+
+    async def get_ebooks_many(self, books):
+        """Gets the ebooks for each of the given books.
+
+        :param books: the titles of the books
+        :returns: a list of ebook data lists, in the same order as the titles
+        """
+        return await self._run_many(self.api.get_ebooks, books)
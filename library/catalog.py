@@ -0,0 +1,244 @@
+"""
+Filename: catalog.py
+Description: offline catalog of OpenLibrary works answering Books_API searches locally
+
+Usage: python -m library.catalog catalog.sqlite3 dump.txt.gz [dump.txt.gz ...]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import re
+import sqlite3
+import threading
+
+_YEAR = re.compile(r'\b(\d{4})\b')
+
+
+def _open_dump(path):
+    """Opens an OpenLibrary dump for reading line by line, decompressing .gz files.
+
+    :param path: the path of the dump
+    :returns: a text file object
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def _keys(values, name):
+    """Gets the keys referenced by a list of OpenLibrary references.
+
+    :param values: a list of {name: {'key': key}}, {name: key} or {'key': key} entries
+    :param name: the name of the nested reference, if any
+    :returns: the list of keys
+    """
+    keys = []
+    for value in values or ():
+        if isinstance(value, dict) and name in value:
+            value = value[name]
+        if isinstance(value, dict):
+            value = value.get('key')
+        if isinstance(value, str):
+            keys.append(value)
+    return keys
+
+
+def build_catalog(dump_paths, catalog_path, batch_size=10000):
+    """Builds a catalog from OpenLibrary dumps of works, editions and authors.
+
+    The dumps are the tab separated files published by OpenLibrary, optionally
+    gzipped, with the type, key, revision, modification time and JSON record of one
+    entity per line; one dump holding every type works as well as one per type. They
+    are streamed into staging tables on disk, so memory use does not depend on their
+    size.
+    Each work becomes one book with its authors' names and the languages, publishers
+    and publication years of its editions; editions with an ocaid count as ebooks.
+    Editions not linked to a work are skipped.
+
+    :param dump_paths: the paths of the dumps
+    :param catalog_path: the path of the catalog, replaced if it exists
+    :param batch_size: the number of rows inserted at once
+    :returns: the number of books in the catalog
+    """
+    temp_path = catalog_path + '.tmp'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    conn = sqlite3.connect(temp_path)
+    try:
+        conn.executescript(Catalog.SCHEMA + '''
+            CREATE TABLE authors (key TEXT PRIMARY KEY, name TEXT);
+            CREATE TABLE works (key TEXT PRIMARY KEY, title TEXT, author_keys TEXT);
+            CREATE TABLE editions (work_key TEXT, ebook INTEGER);
+            CREATE TABLE edition_values (work_key TEXT, field TEXT, value);
+        ''')
+        rows = {'authors': [], 'works': [], 'editions': [], 'edition_values': []}
+        statements = {'authors': 'INSERT OR REPLACE INTO authors VALUES (?, ?)',
+                      'works': 'INSERT OR REPLACE INTO works VALUES (?, ?, ?)',
+                      'editions': 'INSERT INTO editions VALUES (?, ?)',
+                      'edition_values': 'INSERT INTO edition_values VALUES (?, ?, ?)'}
+
+        def flush():
+            for table, pending in rows.items():
+                if pending:
+                    conn.executemany(statements[table], pending)
+                    pending.clear()
+
+        count = 0
+        for path in dump_paths:
+            with _open_dump(path) as dump:
+                for line in dump:
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) < 5:
+                        continue
+                    entity_type, key, record = fields[0], fields[1], json.loads(fields[4])
+                    if entity_type == '/type/author':
+                        rows['authors'].append((key, record.get('name')))
+                    elif entity_type == '/type/work' and record.get('title'):
+                        rows['works'].append((key, record['title'],
+                                              json.dumps(_keys(record.get('authors'), 'author'))))
+                    elif entity_type == '/type/edition':
+                        for work_key in _keys(record.get('works'), 'work'):
+                            rows['editions'].append((work_key, 1 if record.get('ocaid') else 0))
+                            for language in _keys(record.get('languages'), 'language'):
+                                rows['edition_values'].append((work_key, 'language', language.rsplit('/', 1)[-1]))
+                            for publisher in record.get('publishers') or ():
+                                rows['edition_values'].append((work_key, 'publisher', publisher))
+                            year = _YEAR.search(record.get('publish_date') or '')
+                            if year:
+                                rows['edition_values'].append((work_key, 'publish_year', int(year.group(1))))
+                    else:
+                        continue
+                    count += 1
+                    if count % batch_size == 0:
+                        flush()
+        flush()
+        conn.executescript('''
+            CREATE INDEX editions_work ON editions (work_key);
+            CREATE INDEX edition_values_work ON edition_values (work_key, field);
+        ''')
+        books = []
+        works = conn.cursor().execute('SELECT key, title, author_keys FROM works ORDER BY key')
+        for key, title, author_keys in works:
+            names = [name for name, in conn.execute(
+                'SELECT name FROM authors WHERE key IN (SELECT value FROM json_each(?)) AND name IS NOT NULL',
+                (author_keys,))]
+            values = {'language': [], 'publisher': [], 'publish_year': []}
+            for field, value in conn.execute('SELECT DISTINCT field, value FROM edition_values '
+                                             'WHERE work_key = ? ORDER BY field, value', (key,)):
+                values[field].append(value)
+            ebooks, = conn.execute('SELECT COALESCE(SUM(ebook), 0) FROM editions WHERE work_key = ?',
+                                   (key,)).fetchone()
+            books.append((key, title, '\n'.join(names), json.dumps(values['language']),
+                          json.dumps(values['publisher']), json.dumps(values['publish_year']), ebooks))
+            if len(books) >= batch_size:
+                conn.executemany(Catalog.INSERT_BOOK, books)
+                books.clear()
+        conn.executemany(Catalog.INSERT_BOOK, books)
+        conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+        conn.executescript('DROP TABLE authors; DROP TABLE works; DROP TABLE editions; DROP TABLE edition_values;')
+        conn.commit()
+        total, = conn.execute('SELECT COUNT(*) FROM books').fetchone()
+        conn.execute('VACUUM')
+    except BaseException:
+        conn.close()
+        os.remove(temp_path)
+        raise
+    conn.close()
+    os.replace(temp_path, catalog_path)
+    return total
+
+
+class Catalog:
+    """Read-only catalog of books built by build_catalog, searched with SQLite FTS5.
+
+    Searches return docs in the format of OpenLibrary's search.json, so Books_API can
+    use the catalog instead of the web service.
+    """
+
+    SCHEMA = '''
+        CREATE TABLE books (id INTEGER PRIMARY KEY, key TEXT UNIQUE, title TEXT, authors TEXT,
+                            languages TEXT, publishers TEXT, publish_years TEXT, ebook_count INTEGER);
+        CREATE VIRTUAL TABLE books_fts USING fts5(title, authors, content='books', content_rowid='id');
+    '''
+    INSERT_BOOK = ('INSERT INTO books (key, title, authors, languages, publishers, publish_years, ebook_count) '
+                   'VALUES (?, ?, ?, ?, ?, ?, ?)')
+    SEARCH = ('SELECT books.key, books.title, books.languages, books.publishers, books.publish_years, '
+              'books.ebook_count FROM books_fts JOIN books ON books.id = books_fts.rowid '
+              'WHERE books_fts MATCH ? ORDER BY books_fts.rank, books.id LIMIT ? OFFSET ?')
+
+    def __init__(self, path):
+        """Constructor for the Catalog class.
+
+        :param path: the path of the catalog
+        :raises FileNotFoundError: if the catalog does not exist
+        """
+        if not os.path.exists(path):
+            raise FileNotFoundError("No catalog at %s" % path)
+        self.path = path
+        self.conn = sqlite3.connect('file:%s?mode=ro' % path, uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def match_expression(param, value):
+        """Builds the FTS5 query for a search, matching every word of the value.
+
+        :param param: 'author' to search the authors, anything else for titles and authors
+        :param value: the value searched for
+        :returns: the FTS5 query, or None if the value has no words
+        """
+        words = ['"%s"' % word.replace('"', '""') for word in value.split()]
+        if not words:
+            return None
+        expression = ' '.join(words)
+        if param == 'author':
+            return 'authors : (%s)' % expression
+        return expression
+
+    def search(self, param, value, limit, offset=0):
+        """Searches the catalog like search.json.
+
+        :param param: the search parameter, 'q' or 'author'
+        :param value: the value searched for
+        :param limit: the maximum number of docs returned
+        :param offset: the number of docs skipped
+        :returns: a list of docs
+        """
+        expression = self.match_expression(param, value)
+        if expression is None:
+            return []
+        with self._lock:
+            rows = self.conn.execute(self.SEARCH, (expression, limit, offset)).fetchall()
+        docs = []
+        for key, title, languages, publishers, publish_years, ebook_count in rows:
+            doc = {'key': key, 'title': title, 'title_suggest': title, 'ebook_count_i': ebook_count}
+            for field, values in (('language', languages), ('publisher', publishers),
+                                  ('publish_year', publish_years)):
+                values = json.loads(values)
+                if values:
+                    doc[field] = values
+            docs.append(doc)
+        return docs
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute('SELECT COUNT(*) FROM books').fetchone()[0]
+
+    def close(self):
+        """Closes the catalog."""
+        with self._lock:
+            self.conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build an offline catalog from OpenLibrary dumps.")
+    parser.add_argument('catalog_path')
+    parser.add_argument('dump_paths', nargs='+')
+    args = parser.parse_args(argv)
+    count = build_catalog(args.dump_paths, args.catalog_path)
+    print("Built a catalog of %d books in %s" % (count, args.catalog_path))
+
+
+if __name__ == '__main__':
+    main()
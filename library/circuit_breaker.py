@@ -0,0 +1,75 @@
+"""
+Filename: circuit_breaker.py
+Description: circuit breaker used to fail fast while the web service is down
+"""
+
+import threading
+import time
+
+
+class CircuitBreaker:
+    """Thread safe circuit breaker guarding calls to an unreliable service.
+
+    The breaker is closed while calls succeed. After failure_threshold consecutive
+    failures it opens, and calls are refused without reaching the service. Once
+    reset_timeout seconds have passed it is half open: a single trial call is let
+    through, closing the breaker if it succeeds and opening it again if it fails.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half open'
+
+    FAILURE_THRESHOLD = 5
+    RESET_TIMEOUT = 30.0
+
+    def __init__(self, failure_threshold=None, reset_timeout=None):
+        """Constructor for the CircuitBreaker class.
+
+        :param failure_threshold: the number of consecutive failures that opens the breaker
+        :param reset_timeout: the number of seconds the breaker stays open before a trial call
+        """
+        self.failure_threshold = failure_threshold or self.FAILURE_THRESHOLD
+        self.reset_timeout = self.RESET_TIMEOUT if reset_timeout is None else reset_timeout
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """The state of the breaker: CLOSED, OPEN or HALF_OPEN."""
+        with self._lock:
+            if self._opened_at is None:
+                return self.CLOSED
+            if self._trial or time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self.OPEN
+
+    def allow_request(self):
+        """Determines if a call may go through, claiming the trial call when half open.
+
+        :returns: True if the call may be made, False if it should fail fast
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        """Records a successful call, closing the breaker."""
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        """Records a failed call, opening the breaker once the threshold is reached."""
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial = False
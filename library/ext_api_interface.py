@@ -3,26 +3,309 @@ Filename: ext_api_interface.py
 Description: module used for interacting with a web service
 """
 
+import threading
+import unicodedata
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlencode
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from library.catalog import Catalog
+from library.circuit_breaker import CircuitBreaker
+from library.json_stream import iter_array_items
+from library.response_cache import ResponseCache, normalize_url
+
+_MISSING = object()
+
+
+def normalize_title(title):
+    """Normalizes a book title so equivalent spellings compare equal.
+
+    The title is NFKC normalized, casefolded, and its whitespace collapsed.
+
+    :param title: the title of the book
+    :returns: the normalized title
+    """
+    return ' '.join(unicodedata.normalize('NFKC', title).casefold().split())
+
 
 class Books_API:
     """Class used for interacting with the OpenLibrary API."""
 
     API_URL = "http://openlibrary.org/search.json"
 
+    POOL_CONNECTIONS = 4
+    POOL_MAXSIZE = 16
+    CONNECT_TIMEOUT = 3.05
+    READ_TIMEOUT = 10
+    MAX_RETRIES = 3
+    BACKOFF_FACTOR = 0.3
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    NEGATIVE_TTL = 30
+    AUTHOR_TTL = 3600
+    PAGE_SIZE = 100
+    MAX_PAGES = 1
+    CHUNK_SIZE = 16384
+
+    def __init__(self, pool_connections=None, pool_maxsize=None, connect_timeout=None,
+                 read_timeout=None, max_retries=None, backoff_factor=None, cache=None,
+                 negative_ttl=None, breaker=None, streaming=False, catalog=None, author_cache=None):
+        """Constructor for the Books_API class.
+
+        The HTTP session is created lazily and shared by every thread using this object,
+        so connections to the API host are kept alive and reused between lookups.
+
+        Failed lookups and lookups without results are cached for negative_ttl seconds
+        only. Threads asking for the same URL while it is being fetched wait for that
+        request instead of making their own, and the circuit breaker makes lookups
+        fail fast while the API keeps failing.
+
+        In streaming mode the docs of a search are parsed from the response as it is
+        read, so memory is bounded by one doc rather than the whole page, and a caller
+        that stops early never reads the rest. Streamed responses are answered from the
+        cache when already there but are not added to it.
+
+        With a catalog, searches are answered from the local Catalog built from an
+        OpenLibrary dump instead of the web service.
+
+        The normalized titles of each author are kept in their own cache, for
+        AUTHOR_TTL seconds by default, and can be fetched ahead with prefetch_authors.
+
+        :param pool_connections: the number of hosts to keep connection pools for
+        :param pool_maxsize: the maximum number of kept-alive connections per host
+        :param connect_timeout: seconds to wait for the connection to be established
+        :param read_timeout: seconds to wait for the server to send a response
+        :param max_retries: the number of retries for transient failures
+        :param backoff_factor: the exponential backoff factor between retries
+        :param cache: the ResponseCache shared by the lookups, an in-memory one if not given,
+                      or False to disable caching
+        :param negative_ttl: the number of seconds failures and empty results stay cached
+        :param breaker: the CircuitBreaker guarding the API, a default one if not given,
+                        or False to disable it
+        :param streaming: True to parse search results incrementally
+        :param catalog: the Catalog, or the path of one, answering the searches locally
+        :param author_cache: the ResponseCache of the authors' titles, an in-memory one with
+                             AUTHOR_TTL if not given, or False to disable it
+        """
+        self.pool_connections = pool_connections or self.POOL_CONNECTIONS
+        self.pool_maxsize = pool_maxsize or self.POOL_MAXSIZE
+        self.timeout = (connect_timeout or self.CONNECT_TIMEOUT, read_timeout or self.READ_TIMEOUT)
+        self.max_retries = self.MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_factor = self.BACKOFF_FACTOR if backoff_factor is None else backoff_factor
+        if cache is None:
+            cache = ResponseCache()
+        self.cache = cache if cache is not False else None
+        if author_cache is None:
+            author_cache = ResponseCache(ttl=self.AUTHOR_TTL)
+        self.author_cache = author_cache if author_cache is not False else None
+        self.negative_ttl = self.NEGATIVE_TTL if negative_ttl is None else negative_ttl
+        if breaker is None:
+            breaker = CircuitBreaker()
+        self.breaker = breaker if breaker is not False else None
+        self.streaming = streaming
+        self.catalog = Catalog(catalog) if isinstance(catalog, str) else catalog
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """The pooled HTTP session, created on first use."""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self.create_session()
+        return self._session
+
+    def create_session(self):
+        """Creates a keep-alive HTTP session with connection pooling and retries.
+
+        :returns: the configured requests.Session
+        """
+        retry = Retry(total=self.max_retries, connect=self.max_retries, read=self.max_retries,
+                      status=self.max_retries, backoff_factor=self.backoff_factor,
+                      status_forcelist=self.RETRY_STATUSES, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update({'Connection': 'keep-alive'})
+        return session
+
+    def close(self):
+        """Closes the HTTP session and its pooled connections, and the catalog."""
+        if self.catalog is not None:
+            self.catalog.close()
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
     def make_request(self, url):
-        """Makes a HTTP request to the given URL.
+        """Makes a HTTP request to the given URL, answering from the cache when possible
+        and sharing the request with other threads asking for the same URL.
         
         :param url: the url used for the HTTP request
-        :returns: the JSON body of the request, None if non 200 status code or ConnectionError
+        :returns: the JSON body of the request, None if non 200 status code, request error or
+                  open circuit breaker
         """
+        key = normalize_url(url)
+        if self.cache is not None:
+            json_data = self.cache.get(key, _MISSING)
+            if json_data is not _MISSING:
+                return json_data
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                leader = False
+            else:
+                leader = True
+                future = self._in_flight[key] = Future()
+        if not leader:
+            return future.result()
         try:
-            response = requests.get(url)
-            if response.status_code != 200:
-                return None
-            return response.json()
-        except requests.ConnectionError:
+            json_data = self.fetch(url)
+            if self.cache is not None:
+                ttl = None if json_data and json_data.get('docs') else self.negative_ttl
+                self.cache.set(key, json_data, ttl)
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(json_data)
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+        return json_data
+
+    def fetch(self, url):
+        """Makes a HTTP request to the given URL, bypassing the cache.
+
+        Request errors, such as connection errors and timeouts, and server errors count
+        as failures of the API for the circuit breaker.
+
+        :param url: the url used for the HTTP request
+        :returns: the JSON body of the request, None if non 200 status code, request error or
+                  open circuit breaker
+        """
+        if self.breaker is not None and not self.breaker.allow_request():
             return None
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException:
+            self.record_outcome(False)
+            return None
+        except BaseException:
+            self.record_outcome(False)
+            raise
+        self.record_outcome(response.status_code not in self.RETRY_STATUSES)
+        if response.status_code != 200:
+            return None
+        return response.json()
+
+    def stream_docs(self, url):
+        """Makes a HTTP request to the given URL and parses the docs as they arrive.
+
+        :param url: the url used for the HTTP request
+        :returns: an iterator of docs, empty if non 200 status code, request error or
+                  open circuit breaker
+        """
+        if self.cache is not None:
+            json_data = self.cache.get(normalize_url(url), _MISSING)
+            if json_data is not _MISSING:
+                if json_data:
+                    yield from json_data['docs']
+                return
+        if self.breaker is not None and not self.breaker.allow_request():
+            return
+        try:
+            response = self.session.get(url, timeout=self.timeout, stream=True)
+        except requests.RequestException:
+            self.record_outcome(False)
+            return
+        except BaseException:
+            self.record_outcome(False)
+            raise
+        try:
+            self.record_outcome(response.status_code not in self.RETRY_STATUSES)
+            if response.status_code != 200:
+                return
+            yield from iter_array_items(response.iter_content(self.CHUNK_SIZE), 'docs')
+        except requests.RequestException:
+            self.record_outcome(False)
+        finally:
+            response.close()
+
+    def record_outcome(self, success):
+        """Reports the outcome of a request to the circuit breaker, if there is one.
+
+        :param success: True if the API answered, False if it failed
+        """
+        if self.breaker is None:
+            return
+        if success:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def search_url(self, param, value, fields, limit=None, page=1):
+        """Builds a search URL asking only for the given fields of each doc, with the
+        value URL-encoded.
+
+        :param param: the search parameter, 'q' or 'author'
+        :param value: the value searched for
+        :param fields: the comma separated doc fields to return
+        :param limit: the number of docs per page, PAGE_SIZE if not given
+        :param page: the page number, starting at 1
+        :returns: the url for the HTTP request
+        """
+        query = [(param, value), ('fields', fields), ('limit', limit or self.PAGE_SIZE), ('page', page)]
+        return "%s?%s" % (self.API_URL, urlencode(query, safe=','))
+
+    def iter_docs(self, param, value, fields, limit=None, max_pages=None):
+        """Iterates over the docs of a search, one page at a time.
+
+        The next page is only requested once the docs of the previous one have been
+        consumed, so a caller that stops early saves the remaining requests. The search
+        ends at a page with fewer than limit docs, a failed request, or max_pages. With
+        a catalog the pages are read from it.
+
+        :param param: the search parameter, 'q' or 'author'
+        :param value: the value searched for
+        :param fields: the comma separated doc fields to return
+        :param limit: the number of docs per page, PAGE_SIZE if not given
+        :param max_pages: the maximum number of pages requested, MAX_PAGES if not given
+        :returns: an iterator of docs
+        """
+        limit = limit or self.PAGE_SIZE
+        max_pages = max_pages or self.MAX_PAGES
+        for page in range(1, max_pages + 1):
+            if self.catalog is not None:
+                docs = self.catalog.search(param, value, limit, (page - 1) * limit)
+                yield from docs
+                if len(docs) < limit:
+                    return
+                continue
+            url = self.search_url(param, value, fields, limit, page)
+            if self.streaming:
+                count = 0
+                for doc in self.stream_docs(url):
+                    count += 1
+                    yield doc
+                if count < limit:
+                    return
+                continue
+            json_data = self.make_request(url)
+            if not json_data:
+                return
+            docs = json_data['docs']
+            yield from docs
+            if len(docs) < limit:
+                return
 
     def is_book_available(self, book):
         """Determines if a given book is available to borrow.
@@ -30,26 +313,27 @@ class Books_API:
         :param book: the title of the book
         :returns: True if available, False if not
         """
-        request_url = "%s?q=%s" % (self.API_URL, book)
-        json_data = self.make_request(request_url)
-        if json_data and len(json_data['docs']) >= 1:
+        for _ in self.iter_docs('q', book, 'key', limit=1, max_pages=1):
             return True
         return False
 
+    def iter_books_by_author(self, author, max_pages=None):
+        """Iterates over the books written by a given author, requesting pages as needed.
+
+        :param author: the name of the author
+        :param max_pages: the maximum number of pages requested, MAX_PAGES if not given
+        :returns: an iterator of titles
+        """
+        for book in self.iter_docs('author', author, 'title_suggest', max_pages=max_pages):
+            yield book['title_suggest']
+
     def books_by_author(self, author):
         """Gets all the books written by a given author.
         
         :param author: the name of the author
         :returns: the titles of all the books in a list form
         """
-        request_url = "%s?author=%s" % (self.API_URL, author)
-        json_data = self.make_request(request_url)
-        if not json_data:
-            return []
-        books = []
-        for book in json_data['docs']:
-            books.append(book['title_suggest'])
-        return books
+        return list(self.iter_books_by_author(author))
 
     def get_book_info(self, book):
         """Gets the information for a given book.
@@ -57,12 +341,8 @@ class Books_API:
         :param book: the title of the book
         :returns: a list of dictionaries with book data
         """
-        request_url = "%s?q=%s" % (self.API_URL, book)
-        json_data = self.make_request(request_url)
-        if not json_data:
-            return []
         books_info = []
-        for book in json_data['docs']:
+        for book in self.iter_docs('q', book, 'title,publisher,publish_year,language'):
             info = {'title': book['title']}
             if 'publisher' in book:
                 info.update({'publisher': book['publisher']})
@@ -73,18 +353,121 @@ class Books_API:
             books_info.append(info)
         return books_info
 
+    def iter_ebooks(self, book, max_pages=None):
+        """Iterates over the ebooks for a given book, requesting pages as needed.
+
+        :param book: the title of the book
+        :param max_pages: the maximum number of pages requested, MAX_PAGES if not given
+        :returns: an iterator of data about the ebooks
+        """
+        for book in self.iter_docs('q', book, 'title,ebook_count_i', max_pages=max_pages):
+            if book['ebook_count_i'] >= 1:
+                yield {'title': book['title'], 'ebook_count': book['ebook_count_i']}
+
     def get_ebooks(self, book):
         """Gets the ebooks for a given book.
         
         :param book: the title of the book
         :returns: data about the ebooks
         """
-        request_url = "%s?q=%s" % (self.API_URL, book)
-        json_data = self.make_request(request_url)
-        if not json_data:
-            return []
-        ebooks = []
-        for book in json_data['docs']:
-            if book['ebook_count_i'] >= 1:
-                ebooks.append({'title': book['title'], 'ebook_count': book['ebook_count_i']})
-        return ebooks
+        return list(self.iter_ebooks(book))
+
+    def title_index(self, cache, key, titles, stop_at=None):
+        """Gets the normalized titles of a search, built once and cached.
+
+        :param cache: the ResponseCache holding the index, or None
+        :param key: the cache key of the index
+        :param titles: a function returning an iterator of the titles
+        :param stop_at: a normalized title; in streaming mode the search stops once it is
+                        found and the partial index is returned without being cached
+        :returns: a dictionary whose keys are the normalized titles
+        """
+        if cache is not None:
+            index = cache.get(key, _MISSING)
+            if index is not _MISSING:
+                return index
+        index = {}
+        for title in titles():
+            title = normalize_title(title)
+            index[title] = None
+            if self.streaming and title == stop_at:
+                return index
+        if cache is not None:
+            cache.set(key, index, None if index else self.negative_ttl)
+        return index
+
+    def ebook_titles(self, book, stop_at=None):
+        """Gets the normalized titles of the ebooks for a given book.
+
+        :param book: the title of the book
+        :param stop_at: a normalized title to stop at in streaming mode
+        :returns: a dictionary whose keys are the normalized titles
+        """
+        return self.title_index(self.cache, 'ebook_titles:' + normalize_title(book),
+                                lambda: (ebook['title'] for ebook in self.iter_ebooks(book)), stop_at)
+
+    def author_titles(self, author, stop_at=None):
+        """Gets the normalized titles of the books written by a given author, from the
+        author cache when possible. With an author cache the whole index is always
+        built, so that later checks for the author are answered from it.
+
+        :param author: the name of the author
+        :param stop_at: a normalized title to stop at in streaming mode, without an
+                        author cache
+        :returns: a dictionary whose keys are the normalized titles
+        """
+        if self.author_cache is not None:
+            stop_at = None
+        return self.title_index(self.author_cache, self.author_key(author),
+                                lambda: self.iter_books_by_author(author), stop_at)
+
+    @staticmethod
+    def author_key(author):
+        """Gets the author cache key of an author.
+
+        :param author: the name of the author
+        :returns: the cache key
+        """
+        return 'author_titles:' + normalize_title(author)
+
+    def prefetch_authors(self, authors):
+        """Fetches the titles of several authors concurrently into the author cache.
+
+        Authors already cached are skipped, and each author is fetched once however
+        often it is given.
+
+        :param authors: an iterable of author names
+        :returns: the number of authors fetched
+        """
+        if self.author_cache is None:
+            return 0
+        pending = {}
+        for author in authors:
+            key = self.author_key(author)
+            if key not in pending and self.author_cache.get(key, _MISSING) is _MISSING:
+                pending[key] = author
+        if not pending:
+            return 0
+        with ThreadPoolExecutor(max_workers=min(self.pool_maxsize, len(pending))) as executor:
+            for _ in executor.map(self.author_titles, pending.values()):
+                pass
+        return len(pending)
+
+    def has_ebook(self, book):
+        """Determines if an ebook has exactly the given title.
+
+        :param book: the title of the book
+        :returns: True if yes, False if not
+        """
+        title = normalize_title(book)
+        return title in self.ebook_titles(book, stop_at=title)
+
+    def has_book_by_author(self, author, book):
+        """Determines if a book with exactly the given title was written by an author.
+
+        :param author: the name of the author
+        :param book: the title of the book
+        :returns: True if yes, False if not
+        """
+        title = normalize_title(book)
+        return title in self.author_titles(author, stop_at=title)
@@ -0,0 +1,277 @@
+"""
+Filename: journal_backend.py
+Description: append-only journal storage engine for the local library database
+"""
+
+import os
+import time
+
+from library.sqlite_backend import PatronDocument
+from library.storage import get_json_codec
+
+
+class JournalPatronTable:
+    """Patron table kept in memory and persisted as an append-only journal, offering
+    the parts of the TinyDB table interface that Library_DB uses.
+
+    Each mutation appends one line to the file: a whole Patron for an insert or a
+    change to its details, or a single title for a borrowed book added or returned,
+    so a checkout costs the same whatever the size of the database. The Patrons are
+    rebuilt by replaying the journal on open. Once the journal holds COMPACT_RATIO
+    records per Patron, and at least COMPACT_MIN_RECORDS, it is folded into a
+    snapshot of one record per Patron; compact() does so on demand.
+
+    Records are buffered until write_cache_size are pending or the oldest is
+    flush_interval seconds old, and on flush() and close(); while suspended they
+    are only written by flush().
+    """
+
+    WRITE_CACHE_SIZE = 1000
+    FLUSH_INTERVAL = 5.0
+    COMPACT_RATIO = 4
+    COMPACT_MIN_RECORDS = 1000
+
+    def __init__(self, path, write_cache_size=None, flush_interval=None, codec='auto'):
+        """Constructor for the JournalPatronTable class.
+
+        :param path: the path of the journal file
+        :param write_cache_size: the number of pending records that triggers a write
+        :param flush_interval: the age in seconds of pending records that triggers a write
+        :param codec: the name of the JSON codec, see get_json_codec
+        """
+        self.path = path
+        self.codec = get_json_codec(codec)
+        self.write_cache_size = write_cache_size or self.WRITE_CACHE_SIZE
+        self.flush_interval = self.FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.suspended = False
+        self._pending = []
+        self._first_write = None
+        self._handle = None
+        self.replay()
+
+    def replay(self):
+        """Rebuilds the Patrons from the journal file, dropping any pending records."""
+        self._docs = {}
+        self._next_id = 1
+        self.records = 0
+        self._pending = []
+        self._first_write = None
+        if self._handle is not None:
+            self._handle.close()
+        with open(self.path, 'ab'):
+            pass
+        self._handle = open(self.path, 'r+b')
+        end = 0
+        for line in self._handle:
+            if not line.endswith(b'\n'):
+                # a record left incomplete by a crash, truncated before the next append
+                break
+            self.apply(self.codec.loads(line))
+            self.records += 1
+            end += len(line)
+        self._torn = self._handle.tell() > end
+        self._handle.seek(end)
+        self.signature = self.file_signature()
+
+    def apply(self, record):
+        """Applies a journal record to the Patrons in memory.
+
+        :param record: a list of the operation, the document ID and its argument
+        """
+        op, doc_id, value = record
+        if op == 'put':
+            self._docs[doc_id] = value
+            self._next_id = max(self._next_id, doc_id + 1)
+        else:
+            doc = self._docs[doc_id]
+            if op == 'borrow':
+                doc['borrowed_books'] = doc.get('borrowed_books', []) + [value]
+            else:
+                doc['borrowed_books'] = [title for title in doc.get('borrowed_books', []) if title != value]
+
+    def append(self, record):
+        """Applies a record and queues it for the journal file.
+
+        :param record: a list of the operation, the document ID and its argument
+        """
+        self.apply(record)
+        self._pending.append(self.codec.dumps(record) + b'\n')
+        if self._first_write is None:
+            self._first_write = time.monotonic()
+
+    def __iter__(self):
+        for doc_id, doc in list(self._docs.items()):
+            yield PatronDocument(doc, doc_id)
+
+    def __len__(self):
+        return len(self._docs)
+
+    def all(self):
+        """Gets every stored Patron.
+
+        :returns: a list of PatronDocuments
+        """
+        return list(self)
+
+    def get(self, doc_id):
+        """Gets a stored Patron by document ID.
+
+        :param doc_id: the document ID
+        :returns: the PatronDocument, or None
+        """
+        doc = self._docs.get(doc_id)
+        if doc is None:
+            return None
+        return PatronDocument(doc, doc_id)
+
+    def insert(self, document):
+        """Stores a new Patron.
+
+        :param document: the Patron's data in the Library_DB format
+        :returns: the new document ID
+        """
+        return self.insert_multiple([document])[0]
+
+    def insert_multiple(self, documents, doc_ids=None):
+        """Stores new Patrons.
+
+        :param documents: the Patrons' data in the Library_DB format
+        :param doc_ids: the document IDs to store them under, new ones if not given
+        :returns: the list of document IDs
+        """
+        ids = []
+        for position, document in enumerate(documents):
+            doc_id = doc_ids[position] if doc_ids else self._next_id
+            self.append(['put', doc_id, dict(document)])
+            ids.append(doc_id)
+        self.written()
+        return ids
+
+    def update(self, fields, doc_ids):
+        """Updates stored Patrons, journaling only the borrowed books added or returned
+        when nothing else changed.
+
+        :param fields: the Patron's data in the Library_DB format
+        :param doc_ids: the document IDs to update
+        :returns: the list of updated document IDs
+        """
+        for doc_id in doc_ids:
+            old = self._docs[doc_id]
+            new = dict(old, **fields)
+            records = self.loan_records(doc_id, old, new)
+            if records is None:
+                self.append(['put', doc_id, new])
+            else:
+                for record in records:
+                    self.append(record)
+        self.written()
+        return list(doc_ids)
+
+    @staticmethod
+    def loan_records(doc_id, old, new):
+        """Describes an update as borrowed books returned and then borrowed.
+
+        :param doc_id: the document ID
+        :param old: the Patron's stored data
+        :param new: the Patron's updated data
+        :returns: the list of records, or None if the update needs a whole Patron
+        """
+        if any(old.get(key) != value for key, value in new.items() if key != 'borrowed_books'):
+            return None
+        old_books = old.get('borrowed_books', [])
+        new_books = new.get('borrowed_books', [])
+        old_titles = set(old_books)
+        new_titles = set(new_books)
+        if len(old_titles) != len(old_books) or len(new_titles) != len(new_books):
+            return None
+        kept = [title for title in old_books if title in new_titles]
+        borrowed = [title for title in new_books if title not in old_titles]
+        if kept + borrowed != new_books:
+            return None
+        return ([['return', doc_id, title] for title in old_books if title not in new_titles]
+                + [['borrow', doc_id, title] for title in borrowed])
+
+    def written(self):
+        """Writes the pending records if a threshold is reached."""
+        if self.suspended or not self._pending:
+            return
+        if (len(self._pending) >= self.write_cache_size
+                or time.monotonic() - self._first_write >= self.flush_interval):
+            self.flush()
+
+    @property
+    def pending_writes(self):
+        """The number of records not yet written to the journal file."""
+        return len(self._pending)
+
+    def flush(self):
+        """Appends the pending records to the journal file, compacting it if it grew
+        too long."""
+        self.write_pending()
+        if self.records > max(self.COMPACT_MIN_RECORDS, self.COMPACT_RATIO * len(self._docs)):
+            self.compact()
+
+    def write_pending(self):
+        """Appends the pending records to the journal file, first cutting off any
+        record left incomplete by a crash."""
+        if not self._pending:
+            return
+        if self._torn:
+            self._handle.truncate()
+            self._torn = False
+        self._handle.write(b''.join(self._pending))
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        self.records += len(self._pending)
+        self._pending = []
+        self._first_write = None
+        self.signature = self.file_signature()
+
+    def compact(self):
+        """Replaces the journal file with a snapshot holding one record per Patron."""
+        self.write_pending()
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as snapshot:
+            snapshot.write(b''.join(self.codec.dumps(['put', doc_id, doc]) + b'\n'
+                                    for doc_id, doc in self._docs.items()))
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        self._handle.close()
+        os.replace(temp_path, self.path)
+        self._handle = open(self.path, 'r+b')
+        self._handle.seek(0, os.SEEK_END)
+        self._torn = False
+        self.records = len(self._docs)
+        self.signature = self.file_signature()
+
+    def discard(self):
+        """Drops the pending records, restoring the Patrons from the journal file."""
+        self.replay()
+
+    def clear_cache(self):
+        """The Patrons in memory always match the journal; present for parity with TinyDB."""
+        pass
+
+    def file_signature(self):
+        """Summarizes the state of the journal file for change detection.
+
+        :returns: a tuple of the modification time, size and inode
+        """
+        stat = os.fstat(self._handle.fileno())
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def changed(self):
+        """Determines if the journal file was modified since it was last read or written.
+
+        :returns: True if it was modified or replaced, False if not
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return True
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino) != self.signature
+
+    def close(self):
+        """Writes the pending records and closes the journal file."""
+        self.flush()
+        self._handle.close()
@@ -0,0 +1,156 @@
+"""
+Filename: json_stream.py
+Description: incremental parsing of the docs array in web service responses
+"""
+
+import codecs
+import json
+import re
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_DECODER = json.JSONDecoder()
+
+
+class ChunkReader:
+    """File-like object reading from an iterable of byte chunks, as ijson expects."""
+
+    def __init__(self, chunks):
+        """Constructor for the ChunkReader class.
+
+        :param chunks: an iterable of bytes
+        """
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def read(self, size=-1):
+        """Reads up to size bytes, or everything left if size is negative.
+
+        :param size: the maximum number of bytes to read
+        :returns: the bytes read, empty at the end of the stream
+        """
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class _ChunkParser:
+    """Cursor over text decoded incrementally from byte chunks, parsing one JSON
+    value at a time and dropping the text already parsed."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._text = ''
+        self._pos = 0
+        self._done = False
+
+    def _read_more(self):
+        """Appends the next chunk to the text.
+
+        :returns: False if the stream is exhausted
+        """
+        if self._done:
+            return False
+        self._text = self._text[self._pos:]
+        self._pos = 0
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._done = True
+            self._text += self._decoder.decode(b'', final=True)
+        else:
+            self._text += self._decoder.decode(chunk)
+        return True
+
+    def peek(self):
+        """Skips whitespace and gets the next character without consuming it.
+
+        :returns: the character, or '' at the end of the stream
+        """
+        while True:
+            self._pos = _WHITESPACE.match(self._text, self._pos).end()
+            if self._pos < len(self._text) or not self._read_more():
+                return self._text[self._pos:self._pos + 1]
+
+    def expect(self, characters):
+        """Consumes the next character, which has to be one of the given ones.
+
+        :param characters: the allowed characters
+        :returns: the character consumed
+        :raises ValueError: if another character or the end of the stream is found
+        """
+        character = self.peek()
+        if not character or character not in characters:
+            raise ValueError("Expected one of %r at offset %d, found %r" % (characters, self._pos, character))
+        self._pos += 1
+        return character
+
+    def value(self):
+        """Parses the next complete JSON value.
+
+        A value ending exactly at the end of the text read so far might continue in
+        the next chunk, so more is read before accepting it.
+
+        :returns: the parsed value
+        :raises ValueError: if the stream ends or the JSON is invalid
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self._text, self._pos)
+            except json.JSONDecodeError:
+                if not self._read_more():
+                    raise
+                continue
+            if end < len(self._text) or not self._read_more():
+                self._pos = end
+                return value
+
+
+def iter_array_items(chunks, key='docs'):
+    """Iterates over the items of an array member of a top-level JSON object, parsing
+    the response one chunk at a time.
+
+    Only the item being parsed and the current chunk are held in memory, and the
+    rest of the response is not parsed if the caller stops early. ijson is used when
+    it is installed, the standard library json parser otherwise.
+
+    :param chunks: an iterable of bytes holding the JSON document
+    :param key: the name of the array member
+    :returns: an iterator of the parsed items
+    :raises ValueError: if the document is not valid JSON
+    """
+    if ijson is not None:
+        return ijson.items(ChunkReader(chunks), key + '.item', use_float=True)
+    return _iter_array_items(chunks, key)
+
+
+def _iter_array_items(chunks, key):
+    parser = _ChunkParser(chunks)
+    parser.expect('{')
+    if parser.peek() == '}':
+        return
+    while True:
+        name = parser.value()
+        parser.expect(':')
+        if name == key and parser.peek() == '[':
+            parser.expect('[')
+            if parser.peek() == ']':
+                return
+            while True:
+                yield parser.value()
+                if parser.expect(',]') == ']':
+                    return
+        parser.value()
+        if parser.expect(',}') == '}':
+            return
@@ -2,18 +2,56 @@
 Filename: library.py
 Description: Library class used for SWEN-352 mocking activity.
 """
+import threading
+from contextlib import ExitStack
+
 from library.patron import Patron
 from library.library_db_interface import Library_DB
 from library.ext_api_interface import Books_API
 
 
 class Library:
-    """Class used to represent a library."""
+    """Class used to represent a library.
+
+    A Library can be shared by a pool of threads. Checkouts for the same memberID are
+    serialized by one of LOCK_STRIPES locks, and Library_DB serializes the writes. A
+    Patron's loans can still be lost if two threads hold different Patron objects for
+    the same memberID, so use a Library_DB with an identity map in that case.
+    """
+
+    LOCK_STRIPES = 64
+    BORROW = 'borrow'
+    RETURN = 'return'
+
+    def __init__(self, db=None, api=None):
+        """Constructor for the Library class.
+
+        :param db: the Library_DB to use, or the path of the database file to open
+        :param api: the Books_API to use, a new one if not given
+        """
+        if db is None or isinstance(db, str):
+            db = Library_DB(db)
+        self.db = db
+        self.api = api if api is not None else Books_API()
+        self._patron_locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
 
-    def __init__(self):
-        """Constructor for the Library class."""
-        self.db = Library_DB()
-        self.api = Books_API()
+    def patron_lock(self, patron):
+        """Gets the lock serializing changes to a Patron's loans.
+
+        :param patron: the Patron object
+        :returns: the lock for the Patron's memberID
+        """
+        return self._patron_locks[hash(patron.get_memberID()) % self.LOCK_STRIPES]
+
+    def patron_locks(self, patrons):
+        """Gets the locks serializing changes to several Patrons' loans, in the order
+        they have to be acquired to avoid deadlocks.
+
+        :param patrons: the Patron objects
+        :returns: the list of distinct locks
+        """
+        stripes = {hash(patron.get_memberID()) % self.LOCK_STRIPES for patron in patrons}
+        return [self._patron_locks[stripe] for stripe in sorted(stripes)]
 
     ############################################################################
     ################################ API METHODS ###############################
@@ -25,12 +63,7 @@ class Library:
         :param book: the title of the book
         :returns: True if yes, False if not
         """
-        ebooks = self.api.get_ebooks(book)
-        book = book.lower()
-        for ebook in ebooks:
-            if book == ebook['title'].lower():
-                return True
-        return False
+        return self.api.has_ebook(book)
 
     def get_ebooks_count(self, book):
         """Gets the number of ebooks for a given book.
@@ -51,11 +84,15 @@ class Library:
         :param book: the name of the book
         :returns: True if the book was written by the author, False if not
         """
-        results = self.api.books_by_author(author)
-        for result in results:
-            if book.lower() == result.lower():
-                return True
-        return False
+        return self.api.has_book_by_author(author, book)
+
+    def prefetch_authors(self, authors):
+        """Fetches the books of several authors ahead of is_book_by_author checks.
+
+        :param authors: an iterable of author names
+        :returns: the number of authors fetched
+        """
+        return self.api.prefetch_authors(authors)
 
     def get_languages_for_book(self, book):
         """Get the available languages for a given book.
@@ -86,6 +123,15 @@ class Library:
         patron = Patron(fname, lname, age, memberID)
         return self.db.insert_patron(patron)
 
+    def register_patrons(self, records):
+        """Registers many Patrons with the library using a single database write.
+
+        :param records: an iterable of Patron objects, (fname, lname, age, memberID)
+                        tuples, CSV rows or dictionaries with those keys
+        :returns: an ImportResult with the new ID or why it was skipped for each record
+        """
+        return self.db.insert_patrons(records)
+
     def is_patron_registered(self, patron):
         """Determines if the Patron is already registered in the database.
         
@@ -98,22 +144,83 @@ class Library:
         return False
 
     def borrow_book(self, book, patron):
-        """Borrows a book for a Patron.
+        """Borrows a book for a Patron, updating the database only if they did not
+        already have it.
         
         :param book: the title of the book
         :param patron: the Patron object
         """
-        patron.add_borrowed_book(book.lower())
-        self.db.update_patron(patron)
+        with self.patron_lock(patron):
+            if patron.add_borrowed_book(book.lower()):
+                self.db.update_patron(patron)
 
     def return_borrowed_book(self, book, patron):
-        """Returns a borrowed book for a Patron.
+        """Returns a borrowed book for a Patron, updating the database only if they
+        had it.
         
         :param book: the title of the book
         :param patron: the Patron object
         """
-        patron.return_borrowed_book(book.lower())
-        self.db.update_patron(patron)
+        with self.patron_lock(patron):
+            if patron.return_borrowed_book(book.lower()):
+                self.db.update_patron(patron)
+
+    def borrow_books(self, books, patron):
+        """Borrows several books for a Patron, updating the database once if any of
+        them was new to them.
+
+        :param books: the titles of the books
+        :param patron: the Patron object
+        """
+        with self.patron_lock(patron):
+            changed = False
+            for book in books:
+                changed = patron.add_borrowed_book(book.lower()) or changed
+            if changed:
+                self.db.update_patron(patron)
+
+    def return_books(self, books, patron):
+        """Returns several borrowed books for a Patron, updating the database once if
+        any of them was borrowed.
+
+        :param books: the titles of the books
+        :param patron: the Patron object
+        """
+        with self.patron_lock(patron):
+            changed = False
+            for book in books:
+                changed = patron.return_borrowed_book(book.lower()) or changed
+            if changed:
+                self.db.update_patron(patron)
+
+    def apply_loans(self, events):
+        """Borrows and returns books for any number of Patrons in a single database
+        batch, updating each Patron whose borrowed books changed once.
+
+        Events for the same memberID are applied to the first Patron object given
+        for it.
+
+        :param events: an iterable of (action, book, patron) tuples, where action is
+                       BORROW or RETURN
+        :returns: the number of Patrons updated
+        :raises ValueError: if an action is unknown, before any book is borrowed or returned
+        """
+        events = list(events)
+        patrons = {}
+        for action, book, patron in events:
+            if action not in (self.BORROW, self.RETURN):
+                raise ValueError("Unknown loan action %r" % (action,))
+            patrons.setdefault(patron.get_memberID(), patron)
+        with ExitStack() as stack:
+            for lock in self.patron_locks(patrons.values()):
+                stack.enter_context(lock)
+            for action, book, patron in events:
+                patron = patrons[patron.get_memberID()]
+                if action == self.BORROW:
+                    patron.add_borrowed_book(book.lower())
+                else:
+                    patron.return_borrowed_book(book.lower())
+            return self.db.update_patrons(patrons.values())
 
     def is_book_borrowed(self, book, patron):
         """Determines if the Patron has borrowed a given book.
@@ -122,5 +229,20 @@ class Library:
         :param patron: the Patron object
         :returns: True if the Patron has borrowed the book, False if not
         """
-        borrowed_books = patron.get_borrowed_books()
-        return book.lower() in borrowed_books
+        return patron.has_borrowed_book(book)
+
+    def get_holders_for_book(self, book):
+        """Gets the Patrons who currently have a given book borrowed.
+
+        :param book: the title of the book
+        :returns: the set of memberIDs of the Patrons holding the book
+        """
+        return self.db.holders_of(book)
+
+    def get_outstanding_count_for_book(self, book):
+        """Gets the number of copies of a given book currently borrowed.
+
+        :param book: the title of the book
+        :returns: the number of Patrons holding the book
+        """
+        return self.db.outstanding_count(book)
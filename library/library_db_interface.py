@@ -3,19 +3,287 @@ Filename: library_db_interface.py
 Description: module used for interacting with the local database
 """
 
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial, wraps
+from itertools import islice
+
+from library.patron import Patron, InvalidNameException
+from library.journal_backend import JournalPatronTable
+from library.sqlite_backend import SQLitePatronTable
+from library.storage import WriteBehindMiddleware, CompactJSONStorage, FileLock
+from tinydb import TinyDB
+from tinydb.storages import MemoryStorage
+
+class ImportResult:
+    """Outcome of a bulk Patron import."""
+
+    DUPLICATE = 'duplicate'
+    INVALID = 'invalid'
+
+    def __init__(self, results, elapsed):
+        """Constructor for the ImportResult class.
+
+        :param results: per-record results, the new ID or DUPLICATE or INVALID
+        :param elapsed: the number of seconds the import took
+        """
+        self.results = results
+        self.elapsed = elapsed
+        self.duplicates = results.count(self.DUPLICATE)
+        self.invalid = results.count(self.INVALID)
+        self.inserted = len(results) - self.duplicates - self.invalid
+
+    @property
+    def throughput(self):
+        """The number of records processed per second."""
+        if not self.elapsed:
+            return float('inf') if self.results else 0.0
+        return len(self.results) / self.elapsed
+
+    def __repr__(self):
+        return '<ImportResult inserted=%d duplicates=%d invalid=%d %.0f records/s>' % (
+            self.inserted, self.duplicates, self.invalid, self.throughput)
+
+
+def synchronized(method):
+    """Decorator running a Library_DB method while holding the database lock, and in
+    process-safe mode a shared file lock, on a database reloaded if it was changed."""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            if not self._process_safe:
+                return method(self, *args, **kwargs)
+            with self.process_lock():
+                return method(self, *args, **kwargs)
+    return wrapper
+
+
+def exclusive(method):
+    """Decorator running a Library_DB method while holding the database lock, and in
+    process-safe mode an exclusive file lock, on a database reloaded if it was changed."""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            if not self._process_safe:
+                return method(self, *args, **kwargs)
+            with self.process_lock(exclusive=True):
+                return method(self, *args, **kwargs)
+    return wrapper
 
-from library.patron import Patron
-from tinydb import TinyDB, Query
 
 class Library_DB:
-    """Class for the local library database."""
+    """Class for the local library database.
+
+    A Library_DB can be shared between threads: the storage and the indexes are
+    only accessed by one thread at a time, and a batch holds the database for its
+    whole duration. In process-safe mode it can also be shared between processes.
+    """
 
     DATABASE_FILE = 'db.json'
+    SQLITE_DATABASE_FILE = 'db.sqlite3'
+    JOURNAL_DATABASE_FILE = 'db.journal'
+    MEMORY = ':memory:'
+    BACKENDS = ('tinydb', 'sqlite', 'journal')
+    DEFAULT_FILES = {'tinydb': DATABASE_FILE, 'sqlite': SQLITE_DATABASE_FILE, 'journal': JOURNAL_DATABASE_FILE}
+
+    def __init__(self, path=None, write_behind=False, write_cache_size=None, flush_interval=None,
+                 identity_map=False, backend='tinydb', storage=None, json_codec='auto',
+                 process_safe=False):
+        """Constructor for the Library_DB object.
+
+        The 'tinydb' backend keeps every Patron in a JSON file, DATABASE_FILE by default,
+        read once and cached by the middleware. It is written as compact JSON with the
+        fastest codec installed unless another TinyDB storage class is given. The
+        'sqlite' backend keeps them in a SQLite file, SQLITE_DATABASE_FILE by default,
+        with the borrowed books in their own table, so writes only touch the Patrons
+        that changed. The 'journal' backend keeps them in memory and appends each
+        change to a journal file, JOURNAL_DATABASE_FILE by default, that is replayed on
+        open and compacted as it grows, so a borrowed or returned book only appends a
+        single small record. With MEMORY as the path the 'tinydb' and 'sqlite' backends
+        keep the Patrons in memory only, without touching the disk.
+
+        In write-behind mode mutations are buffered in memory and the file is written
+        once write_cache_size mutations are buffered, by a timer once the oldest
+        buffered mutation is flush_interval seconds old, or on flush() and close_db().
+        A pending timer keeps the interpreter from exiting until it has flushed.
+        Otherwise every mutation is written immediately.
+
+        With an identity map, retrieve_patron returns the same Patron object for a given
+        memberID, the one last inserted, retrieved or updated, until close_db() or
+        clear_identity_map() is called.
+
+        In process-safe mode several processes can use the same file. With the 'tinydb'
+        and 'journal' backends every access holds an advisory lock on the file path + '.lock', shared
+        for reads and exclusive for writes, and writes are never buffered. Before each
+        access the file's modification time, size and inode are compared with those
+        last seen, and the database is only reloaded, and the identity map cleared,
+        if another process changed it. With the 'sqlite' backend every access runs in
+        a SQLite transaction instead, immediately taking the write lock for writes,
+        and SQLite's data version is checked.
+
+        :param path: the path of the database file, or MEMORY
+        :param write_behind: True to buffer writes
+        :param write_cache_size: the number of buffered mutations that triggers a flush
+        :param flush_interval: the age in seconds of buffered mutations that triggers a flush
+        :param identity_map: True to reuse the Patron objects handed out by this object
+        :param backend: the storage engine, 'tinydb', 'sqlite' or 'journal'
+        :param storage: the TinyDB storage class for the 'tinydb' backend
+        :param json_codec: the JSON codec for the default storage and the journal:
+                           'orjson', 'ujson', 'json' or 'auto'
+        :param process_safe: True to coordinate with other processes using the file
+        """
+        if backend not in self.BACKENDS:
+            raise ValueError("Unknown backend %r" % (backend,))
+        self.backend = backend
+        self.path = path or self.DEFAULT_FILES[backend]
+        if backend == 'journal' and self.path == self.MEMORY:
+            raise ValueError("The journal backend needs a file")
+        self._process_safe = process_safe and self.path != self.MEMORY
+        if self._process_safe and backend == 'tinydb' and storage is not None:
+            raise ValueError("Process-safe mode requires the default storage")
+        self._write_behind = write_behind and not self._process_safe
+        self._write_cache_size = write_cache_size or WriteBehindMiddleware.WRITE_CACHE_SIZE
+        self._flush_interval = WriteBehindMiddleware.FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self._buffered = 0
+        self._first_buffered = None
+        self._flush_timer = None
+        self._storage_cls = storage
+        self._json_codec = json_codec
+        self._lock = threading.RLock()
+        self._file_lock = None
+        if self._process_safe and backend != 'sqlite':
+            self._file_lock = FileLock(self.path + '.lock')
+        self._batch_depth = 0
+        self._undo = None
+        self._saved = []
+        self._identity_map = {} if identity_map else None
+        self.open_storage()
+        self.build_index()
 
-    def __init__(self):
-        """Constructor for the Library_DB object."""
-        self.db = TinyDB(self.DATABASE_FILE)
+    def open_storage(self):
+        """Opens the storage engine selected in the constructor."""
+        if self._write_behind:
+            # the storage engine only writes when told to, see buffered()
+            cache_size, interval = float('inf'), float('inf')
+        else:
+            cache_size, interval = 1, None
+        if self.backend == 'sqlite':
+            self.db = SQLitePatronTable(self.path, cache_size, interval)
+            self._storage = self.db
+        elif self.backend == 'journal':
+            self.db = JournalPatronTable(self.path, cache_size, interval, self._json_codec)
+            self._storage = self.db
+        elif self.path == self.MEMORY:
+            self._storage = WriteBehindMiddleware(MemoryStorage, cache_size, interval)
+            self.db = TinyDB(storage=self._storage)
+        elif self._storage_cls is None:
+            self._storage = WriteBehindMiddleware(CompactJSONStorage, cache_size, interval)
+            self.db = TinyDB(self.path, codec=self._json_codec, storage=self._storage)
+        else:
+            self._storage = WriteBehindMiddleware(self._storage_cls, cache_size, interval)
+            self.db = TinyDB(self.path, storage=self._storage)
 
+    @contextmanager
+    def process_lock(self, exclusive=False):
+        """Context manager coordinating with other processes in process-safe mode.
+
+        The file lock, or with the 'sqlite' backend a transaction, is held while the
+        block runs, and the database is reloaded first if another process changed it.
+
+        :param exclusive: True for a write, False for a read
+        """
+        if not self._process_safe:
+            yield
+        elif self._file_lock is None:
+            with self.db.transaction(immediate=exclusive):
+                self.refresh()
+                yield
+        else:
+            with self._file_lock.hold(exclusive):
+                self.refresh()
+                yield
+
+    def refresh(self):
+        """Reloads the database and its indexes if another process changed it."""
+        if self.backend == 'sqlite':
+            if not self.db.changed():
+                return
+            self.db.mark_seen()
+        elif self.backend == 'journal':
+            if not self.db.changed():
+                return
+            self.db.replay()
+        else:
+            if not self._storage.storage.changed():
+                return
+            self.db.close()
+            self.open_storage()
+        self.build_index()
+        self.clear_identity_map()
+
+    def build_index(self):
+        """Builds the memberID to document ID index and the borrowed book index from
+        the documents in the database."""
+        with self._lock:
+            self._member_index = {}
+            self._loans = {}
+            self._holders = {}
+            for doc in self.db:
+                self._member_index[doc['memberID']] = doc.doc_id
+                self.index_loans(doc['memberID'], doc.get('borrowed_books', ()))
+
+    def index_loans(self, memberID, borrowed_books):
+        """Updates the borrowed book index with the books a Patron now has borrowed.
+
+        :param memberID: the ID for the Patron
+        :param borrowed_books: the titles of the books the Patron has borrowed
+        """
+        old = self._loans.get(memberID, frozenset())
+        new = frozenset(borrowed_books)
+        if old == new:
+            return
+        for book in old - new:
+            holders = self._holders[book]
+            holders.discard(memberID)
+            if not holders:
+                del self._holders[book]
+        for book in new - old:
+            self._holders.setdefault(book, set()).add(memberID)
+        if new:
+            self._loans[memberID] = new
+        else:
+            self._loans.pop(memberID, None)
+
+    @synchronized
+    def holders_of(self, book):
+        """Gets the Patrons who currently have a given book borrowed.
+
+        :param book: the title of the book
+        :returns: the set of memberIDs of the Patrons holding the book
+        """
+        return set(self._holders.get(book.lower(), ()))
+
+    @synchronized
+    def outstanding_count(self, book):
+        """Gets the number of copies of a given book currently borrowed.
+
+        :param book: the title of the book
+        :returns: the number of Patrons holding the book
+        """
+        return len(self._holders.get(book.lower(), ()))
+
+    @synchronized
+    def has_patron(self, memberID):
+        """Determines if a Patron with the given ID is in the database.
+
+        :param memberID: the ID for the Patron
+        :returns: True if they are in the database, False if not
+        """
+        return memberID in self._member_index
+
+    @exclusive
     def insert_patron(self, patron):
         """Inserts a Patron into the database.
         
@@ -24,20 +292,88 @@ class Library_DB:
         """
         if not patron:
             return None
-        if self.retrieve_patron(patron.get_memberID()): # patron already in db
+        if self.has_patron(patron.get_memberID()): # patron already in db
             return None
         data = self.convert_patron_to_db_format(patron)
-        id = self.db.insert(data)
+        try:
+            id = self.db.insert(data)
+        except sqlite3.IntegrityError: # inserted by another process meanwhile
+            return None
+        self.record_undo('remove', doc_ids=[id])
+        self.buffered()
+        self._member_index[patron.get_memberID()] = id
+        self.index_loans(patron.get_memberID(), data['borrowed_books'])
+        self.mark_saved(patron)
+        if self._identity_map is not None:
+            self._identity_map[patron.get_memberID()] = patron
         return id
 
+    @exclusive
+    def insert_patrons(self, records):
+        """Inserts many Patrons into the database with a single write.
+
+        Records may be Patron objects, (fname, lname, age, memberID) tuples or lists such
+        as csv.reader rows, or dictionaries with those keys such as csv.DictReader rows.
+        Values are stored as given. Records whose memberID is already in the database or
+        earlier in the batch are skipped, as are records with an invalid name.
+
+        :param records: an iterable of Patron records
+        :returns: an ImportResult with the new ID, DUPLICATE or INVALID for each record
+        """
+        start = time.perf_counter()
+        results = []
+        batch = []
+        patrons = []
+        positions = []
+        seen = set()
+        for record in records:
+            try:
+                patron = self.convert_record_to_patron(record)
+            except (InvalidNameException, KeyError, TypeError, ValueError):
+                results.append(ImportResult.INVALID)
+                continue
+            memberID = patron.get_memberID()
+            if memberID in seen or self.has_patron(memberID):
+                results.append(ImportResult.DUPLICATE)
+                continue
+            seen.add(memberID)
+            positions.append(len(results))
+            results.append(None)
+            patrons.append(patron)
+            batch.append(self.convert_patron_to_db_format(patron))
+        if batch:
+            ids = self.db.insert_multiple(batch)
+            self.record_undo('remove', doc_ids=list(ids))
+            self.buffered()
+            for position, patron, data, id in zip(positions, patrons, batch, ids):
+                results[position] = id
+                self._member_index[data['memberID']] = id
+                self.index_loans(data['memberID'], data['borrowed_books'])
+                self.mark_saved(patron)
+        return ImportResult(results, time.perf_counter() - start)
+
+    def convert_record_to_patron(self, record):
+        """Converts an import record to a Patron object.
+
+        :param record: a Patron, a (fname, lname, age, memberID) sequence or a dictionary
+        :returns: the Patron object
+        """
+        if isinstance(record, Patron):
+            return record
+        if isinstance(record, dict):
+            return Patron(record['fname'], record['lname'], record['age'], record['memberID'])
+        fname, lname, age, memberID = record
+        return Patron(fname, lname, age, memberID)
+
+    @synchronized
     def get_patron_count(self):
         """Gets the number of Patrons in the database.
         
         :returns: the total number of Patrons in the DB
         """
-        results = self.db.all()
-        return len(results)
+        return len(self._member_index)
 
+    @synchronized
     def get_all_patrons(self):
         """Gets a list of all the Patrons in the database.
         
@@ -46,35 +382,233 @@ class Library_DB:
         results = self.db.all()
         return results
 
+    def iter_patrons(self, batch_size=1000, raw=False):
+        """Lazily iterates over the Patrons in the database.
+
+        Documents are read from the table batch_size at a time and converted as they
+        are yielded, so no list of every Patron is built. The identity map is bypassed.
+
+        :param batch_size: the number of documents read at a time
+        :param raw: True to yield the stored dictionaries instead of Patron objects
+        :returns: an iterator of Patron objects or dictionaries
+        """
+        with self._lock, self.process_lock():
+            docs = iter(self.db)
+        while True:
+            with self._lock:
+                batch = list(islice(docs, batch_size))
+            if not batch:
+                return
+            if raw:
+                yield from batch
+            else:
+                yield from Patron.from_records(batch)
+
+    @exclusive
     def update_patron(self, patron):
-        """Updates a Patron's data in the DB.
+        """Updates a Patron's data in the DB, skipping the write if the stored data
+        already matches.
         
         :param patron: the new Patron object to be updated
         :returns: None if the patron parameter is not the correct object
         """
         if not patron:
             return None
-        query = Query()
+        doc_id = self._member_index.get(patron.get_memberID())
+        if doc_id is None: # patron not in db
+            return None
         data = self.convert_patron_to_db_format(patron)
-        self.db.update(data, query.memberID == patron.get_memberID())
+        stored = self.db.get(doc_id=doc_id)
+        if stored != data:
+            if self._undo is not None:
+                self.record_undo('update', dict(stored), doc_ids=[doc_id])
+            self.db.update(data, doc_ids=[doc_id])
+            self.index_loans(patron.get_memberID(), patron.get_borrowed_books())
+            self.buffered()
+        self.mark_saved(patron)
+        if self._identity_map is not None:
+            self._identity_map[patron.get_memberID()] = patron
+
+    def mark_saved(self, patron):
+        """Marks a Patron as matching the database, remembering its previous state
+        while the write can still be rolled back.
+
+        :param patron: the Patron object just written
+        """
+        if self._batch_depth or self._storage.pending_writes:
+            # a rollback has to mark the Patron unsaved again
+            self._saved.append((patron, patron.saved_version))
+        else:
+            self._saved = []
+        patron.mark_saved()
+
+    def update_patrons(self, patrons):
+        """Writes the Patrons whose borrowed books changed since they were last saved,
+        in a single batch.
+
+        Patrons whose details were changed by assigning their attributes are not
+        detected, and have to be passed to update_patron.
+
+        :param patrons: an iterable of Patron objects
+        :returns: the number of Patrons written
+        """
+        count = 0
+        with self.batch():
+            for patron in patrons:
+                if patron.is_dirty():
+                    self.update_patron(patron)
+                    count += 1
+        return count
+
+    def flush_dirty(self):
+        """Writes the Patrons handed out by the identity map whose borrowed books changed.
 
+        :returns: the number of Patrons written
+        """
+        with self._lock:
+            patrons = list(self._identity_map.values()) if self._identity_map is not None else []
+        return self.update_patrons(patrons)
+
+    @synchronized
     def retrieve_patron(self, memberID):
-        """Gets a Patron from the database.
+        """Gets a Patron from the database, including the books they have borrowed.
         
         :param memberID: the ID for the Patron to retrieve
         :returns: the Patron with the given ID, or None
         """
-        query = Query()
-        # assuming no two people in the db have the same memberID
-        results = self.db.search(query.memberID == memberID)
-        if results:
-            return Patron(results[0]['fname'], results[0]['lname'], results[0]['age'],
-            results[0]['memberID'])
-        return None
+        if self._identity_map is not None and memberID in self._identity_map:
+            return self._identity_map[memberID]
+        doc_id = self._member_index.get(memberID)
+        if doc_id is None:
+            return None
+        result = self.db.get(doc_id=doc_id)
+        if not result:
+            return None
+        patron = Patron.from_db_record(result)
+        if self._identity_map is not None:
+            self._identity_map[memberID] = patron
+        return patron
+
+    def clear_identity_map(self):
+        """Forgets the Patron objects handed out so far, if the identity map is enabled."""
+        with self._lock:
+            if self._identity_map is not None:
+                self._identity_map.clear()
+
+    def buffered(self):
+        """Counts a mutation in write-behind mode, flushing once write_cache_size are
+        buffered or the oldest is flush_interval seconds old, and otherwise starting a
+        timer to flush them when they are. Batches are flushed when they exit."""
+        if not self._write_behind or self._batch_depth:
+            return
+        self._buffered += 1
+        if self._first_buffered is None:
+            self._first_buffered = time.monotonic()
+        age = time.monotonic() - self._first_buffered
+        if self._buffered >= self._write_cache_size or age >= self._flush_interval:
+            self.flush()
+        elif self._flush_timer is None:
+            self._flush_timer = threading.Timer(self._flush_interval - age, self.flush_when_due)
+            self._flush_timer.start()
+
+    def flush_when_due(self):
+        """Flushes the buffered mutations from the timer thread, unless they were
+        flushed or discarded in the meantime."""
+        with self._lock:
+            if self._flush_timer is threading.current_thread():
+                self.flush()
+
+    def reset_buffered(self):
+        """Forgets the buffered mutations once they are written or discarded."""
+        self._buffered = 0
+        self._first_buffered = None
+        self._saved = []
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+    @exclusive
+    def flush(self):
+        """Writes any buffered mutations to the database file."""
+        self._storage.flush()
+        self.reset_buffered()
+
+    @exclusive
+    def compact(self):
+        """Folds the journal of the 'journal' backend into a snapshot; the other
+        backends have nothing to compact."""
+        if self.backend == 'journal':
+            self.db.compact()
+
+    def record_undo(self, method, *args, **kwargs):
+        """Remembers how to revert a mutation if the current batch is rolled back.
+
+        :param method: the name of the table method reverting the mutation
+        :param args: the positional arguments for the method
+        :param kwargs: the keyword arguments for the method
+        """
+        if self._undo is not None:
+            self._undo.append(partial(getattr(self.db, method), *args, **kwargs))
+
+    @exclusive
+    def rollback(self):
+        """Reverts the mutations made since the current batch started, and marks the
+        Patrons saved since then as changed again."""
+        if self._undo is not None:
+            for undo in reversed(self._undo):
+                undo()
+            self._undo = []
+        for patron, saved_version in reversed(self._saved):
+            patron.saved_version = saved_version
+        self.reset_buffered()
+        self._storage.discard()
+        self.db.clear_cache()
+        self.build_index()
+        self.clear_identity_map()
+
+    @contextmanager
+    def batch(self):
+        """Context manager applying the enclosed mutations with a single write.
+
+        The mutations are written when the outermost batch exits. If it exits with an
+        exception they are discarded and the database is restored to its state on entry.
+        Other threads wait until the batch exits.
+        """
+        with self._lock, self.process_lock(exclusive=True):
+            if self._batch_depth:
+                self._batch_depth += 1
+                try:
+                    yield self
+                finally:
+                    self._batch_depth -= 1
+                return
+            self.flush()
+            self._batch_depth = 1
+            self._storage.suspended = True
+            if self.backend == 'tinydb':
+                # TinyDB mutates the cached documents in place, so they are restored by
+                # undoing each mutation rather than by reading the storage again
+                self._undo = []
+            try:
+                yield self
+            except BaseException:
+                self.rollback()
+                raise
+            finally:
+                self._storage.suspended = False
+                self._batch_depth = 0
+                self._undo = None
+            self.flush()
 
     def close_db(self):
-        """Closes the database."""
-        self.db.close()
+        """Flushes any buffered mutations and closes the database."""
+        with self._lock:
+            with self.process_lock(exclusive=True):
+                self.clear_identity_map()
+                self.db.close()
+                self.reset_buffered()
+            if self._file_lock is not None:
+                self._file_lock.close()
 
     def convert_patron_to_db_format(self, patron):
         """Converts the Patron object to a dictionary format.
@@ -0,0 +1,53 @@
+"""
+Filename: migrate.py
+Description: one-shot migration of a TinyDB db.json into the SQLite backend
+
+Usage: python -m library.migrate [db.json] [db.sqlite3]
+"""
+
+import argparse
+import json
+
+from library.sqlite_backend import SQLitePatronTable
+
+
+def migrate_json_to_sqlite(json_path, sqlite_path):
+    """Copies every Patron from a TinyDB JSON file into an empty SQLite database.
+
+    Document IDs are kept, so IDs handed out before the migration stay valid.
+
+    :param json_path: the path of the TinyDB JSON file
+    :param sqlite_path: the path of the SQLite database
+    :returns: the number of Patrons migrated
+    :raises ValueError: if the SQLite database already holds Patrons
+    """
+    with open(json_path) as json_file:
+        content = json_file.read()
+    table = json.loads(content).get('_default', {}) if content.strip() else {}
+    doc_ids = sorted(table, key=int)
+    target = SQLitePatronTable(sqlite_path)
+    try:
+        if len(target):
+            raise ValueError("%s already holds Patrons" % sqlite_path)
+        target.suspended = True
+        target.insert_multiple([table[doc_id] for doc_id in doc_ids], [int(doc_id) for doc_id in doc_ids])
+        target.flush()
+    except BaseException:
+        target.discard()
+        raise
+    finally:
+        target.close()
+    return len(doc_ids)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate a TinyDB db.json into SQLite.")
+    parser.add_argument('json_path', nargs='?', default='db.json')
+    parser.add_argument('sqlite_path', nargs='?', default='db.sqlite3')
+    args = parser.parse_args(argv)
+    count = migrate_json_to_sqlite(args.json_path, args.sqlite_path)
+    print("Migrated %d patrons from %s to %s" % (count, args.json_path, args.sqlite_path))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,13 +4,36 @@ Description: Patron class for SWEN-352 mocking activity.
 """
 
 import re
+import sys
 
 class InvalidNameException(Exception):
     """Custom Exception for an invalid name."""
     pass
 
+_DIGIT = re.compile(r'\d')
+
+def validate_name(name):
+    """Validates a first or last name for a Patron.
+
+    :param name: the name to validate
+    :returns: the name
+    :raises InvalidNameException: if the name contains numbers
+    """
+    if _DIGIT.search(name):
+        raise InvalidNameException("Name should not contain numbers")
+    return name
+
 class Patron:
-    """Patron class used to represent a user for a library."""
+    """Patron class used to represent a user for a library.
+
+    version counts the changes made to the borrowed books, and saved_version is the
+    version last written to the database, so unchanged Patrons need not be written.
+
+    Borrowed titles are interned, so Patrons holding the same book share one string;
+    this more than makes up for a dict taking more room than a list of the same titles.
+    """
+
+    __slots__ = ('fname', 'lname', 'age', 'memberID', 'borrowed_books', 'version', 'saved_version')
 
     def  __init__(self, fname, lname, age, memberID):
         """Constructor for the Patron class.
@@ -21,47 +44,106 @@ class Patron:
         :param memberID: the ID for the Patron in the library's system
         """
 
-        if re.search('\d', fname) or re.search('\d', lname):
-            raise InvalidNameException("Name should not contain numbers")
-        self.fname = fname
-        self.lname = lname
+        self.fname = validate_name(fname)
+        self.lname = validate_name(lname)
         self.age = age
         self.memberID = memberID
-        self.borrowed_books = []
+        # dictionary keys keep the borrowing order and give O(1) membership
+        self.borrowed_books = {}
+        self.version = 0
+        self.saved_version = 0
+
+    @classmethod
+    def from_db_record(cls, record):
+        """Creates a Patron from a trusted database record without validating it again.
+
+        :param record: a dictionary in the format of Library_DB.convert_patron_to_db_format
+        :returns: the Patron, including the books they have borrowed
+        """
+        patron = cls.__new__(cls)
+        patron.fname = record['fname']
+        patron.lname = record['lname']
+        patron.age = record['age']
+        patron.memberID = record['memberID']
+        patron.borrowed_books = dict.fromkeys(map(sys.intern, record.get('borrowed_books', ())))
+        patron.version = 0
+        patron.saved_version = 0
+        return patron
+
+    @classmethod
+    def from_records(cls, records):
+        """Creates Patrons from trusted database records without validating them again.
+
+        :param records: an iterable of database records
+        :returns: an iterator of Patrons
+        """
+        return map(cls.from_db_record, records)
 
     def add_borrowed_book(self, book):
         """Adds a book to the list of borrowed books for the Patron
         
         :param book: the title of the book
+        :returns: True if the book was added, False if it was already borrowed
         """
-        book = book.lower()
+        book = sys.intern(book.lower())
         if book in self.borrowed_books:
-            return
-        self.borrowed_books.append(book)
+            return False
+        self.borrowed_books[book] = None
+        self.version += 1
+        return True
 
     def get_borrowed_books(self):
         """Gets the list of borrowed books for the Patron.
         
-        :returns: the list of borrowed books
+        :returns: the list of borrowed books, in the order they were borrowed
+        """
+        return list(self.borrowed_books)
+
+    def has_borrowed_book(self, book):
+        """Determines if the Patron has borrowed a given book.
+
+        :param book: the title of the book
+        :returns: True if the book is checked out by the Patron, False if not
         """
-        return self.borrowed_books
+        return book.lower() in self.borrowed_books
 
     def return_borrowed_book(self, book):
         """Removes the borrowed book from the list of books currently checked out.
         
         :param book: the title of the book to remove
+        :returns: True if the book was removed, False if it was not borrowed
         """
         book = book.lower()
-        if book in self.borrowed_books:
-            self.borrowed_books.remove(book)
+        if book not in self.borrowed_books:
+            return False
+        del self.borrowed_books[book]
+        self.version += 1
+        return True
+
+    def is_dirty(self):
+        """Determines if the borrowed books changed since the Patron was last saved.
+
+        :returns: True if they changed, False if not
+        """
+        return self.version != self.saved_version
+
+    def mark_saved(self):
+        """Records that the Patron's current state was written to the database."""
+        self.saved_version = self.version
 
     def  __eq__(self, other):
         """Equals function for the Patron class."""
-        return self.__dict__ == other.__dict__
+        if not isinstance(other, Patron):
+            return NotImplemented
+        return (self.fname == other.fname and self.lname == other.lname and self.age == other.age
+                and self.memberID == other.memberID and self.borrowed_books == other.borrowed_books)
 
     def __ne__(self, other):
         """Not-equal function for the Patron class."""
-        return not self.__eq__(other)
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
 
     def get_fname(self):
         """Getter for the first name of the Patron.
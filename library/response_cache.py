@@ -0,0 +1,268 @@
+"""
+Filename: response_cache.py
+Description: module used for caching responses from the web service
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+
+def normalize_url(url):
+    """Normalizes a request URL so equivalent queries share a cache key.
+
+    The scheme and host are lowercased, query values are lowercased with their
+    whitespace collapsed, and the query parameters are sorted.
+
+    :param url: the url used for the HTTP request
+    :returns: the normalized url
+    """
+    parts = urlsplit(url)
+    query = sorted((key, ' '.join(value.lower().split()))
+                   for key, value in parse_qsl(parts.query, keep_blank_values=True))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ''))
+
+
+class MemoryCacheBackend:
+    """Cache backend keeping the entries in memory, in least recently used order."""
+
+    def __init__(self):
+        """Constructor for the MemoryCacheBackend class."""
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        """Gets an entry from the backend.
+
+        :param key: the cache key
+        :returns: a tuple of (expiry time, value), or None
+        """
+        return self.entries.get(key)
+
+    def set(self, key, expires, value):
+        """Stores an entry as the most recently used one.
+
+        :param key: the cache key
+        :param expires: the time at which the entry expires
+        :param value: the cached value
+        """
+        self.entries[key] = (expires, value)
+        self.entries.move_to_end(key)
+
+    def touch(self, key):
+        """Marks an entry as the most recently used one.
+
+        :param key: the cache key
+        """
+        self.entries.move_to_end(key)
+
+    def delete(self, key):
+        """Removes an entry from the backend.
+
+        :param key: the cache key
+        """
+        self.entries.pop(key, None)
+
+    def pop_oldest(self):
+        """Removes the least recently used entry."""
+        self.entries.popitem(last=False)
+
+    def clear(self):
+        """Removes every entry from the backend."""
+        self.entries.clear()
+
+    def close(self):
+        """Closes the backend."""
+        pass
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class DiskCacheBackend:
+    """Cache backend keeping the entries in a SQLite file so they survive restarts.
+
+    Values have to be JSON serializable. To spare a disk write on every hit, the
+    last access time of an entry is only updated once it is TOUCH_INTERVAL seconds
+    old, so entries used within that interval of each other count as equally recent.
+    """
+
+    TOUCH_INTERVAL = 60.0
+
+    def __init__(self, path, touch_interval=None):
+        """Constructor for the DiskCacheBackend class.
+
+        :param path: the path of the cache file
+        :param touch_interval: the age in seconds of an access time that gets updated
+        """
+        self.path = path
+        self.touch_interval = self.TOUCH_INTERVAL if touch_interval is None else touch_interval
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS responses '
+                          '(key TEXT PRIMARY KEY, expires REAL, accessed REAL, value TEXT)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self.conn.commit()
+        self._count = self.count()
+        self._last_read = None
+
+    def count(self):
+        """Counts the entries in the cache file.
+
+        :returns: the number of entries
+        """
+        return self.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def get(self, key):
+        """Gets an entry from the backend.
+
+        :param key: the cache key
+        :returns: a tuple of (expiry time, value), or None
+        """
+        row = self.conn.execute('SELECT expires, accessed, value FROM responses WHERE key = ?',
+                                (key,)).fetchone()
+        if row is None:
+            return None
+        self._last_read = (key, row[1])
+        return row[0], json.loads(row[2])
+
+    def set(self, key, expires, value):
+        """Stores an entry as the most recently used one.
+
+        :param key: the cache key
+        :param expires: the time at which the entry expires
+        :param value: the cached value
+        """
+        row = (expires, time.time(), json.dumps(value, separators=(',', ':')), key)
+        if not self.conn.execute('UPDATE responses SET expires = ?, accessed = ?, value = ? '
+                                 'WHERE key = ?', row).rowcount:
+            self.conn.execute('INSERT INTO responses (expires, accessed, value, key) VALUES (?, ?, ?, ?)', row)
+            self._count += 1
+        self.conn.commit()
+
+    def touch(self, key):
+        """Marks an entry as the most recently used one, if its access time is at
+        least touch_interval seconds old.
+
+        :param key: the cache key
+        """
+        now = time.time()
+        if self._last_read is not None and self._last_read[0] == key:
+            if now - self._last_read[1] < self.touch_interval:
+                return
+        self.conn.execute('UPDATE responses SET accessed = ? WHERE key = ? AND accessed <= ?',
+                          (now, key, now - self.touch_interval))
+        self.conn.commit()
+        self._last_read = None
+
+    def delete(self, key):
+        """Removes an entry from the backend.
+
+        :param key: the cache key
+        """
+        self._count -= self.conn.execute('DELETE FROM responses WHERE key = ?', (key,)).rowcount
+        self.conn.commit()
+
+    def pop_oldest(self):
+        """Removes the least recently used entry."""
+        deleted = self.conn.execute('DELETE FROM responses WHERE key = '
+                                    '(SELECT key FROM responses ORDER BY accessed LIMIT 1)').rowcount
+        self.conn.commit()
+        if deleted:
+            self._count -= deleted
+        else:
+            # another process sharing the file removed entries
+            self._count = self.count()
+
+    def clear(self):
+        """Removes every entry from the backend."""
+        self.conn.execute('DELETE FROM responses')
+        self.conn.commit()
+        self._count = 0
+
+    def close(self):
+        """Closes the cache file."""
+        self.conn.close()
+
+    def __len__(self):
+        return self._count
+
+
+class ResponseCache:
+    """Thread safe LRU cache with a time to live for web service responses."""
+
+    DEFAULT_TTL = 300
+    DEFAULT_MAX_ENTRIES = 1024
+
+    def __init__(self, backend=None, ttl=None, max_entries=None):
+        """Constructor for the ResponseCache class.
+
+        :param backend: where the entries are stored, in memory if not given
+        :param ttl: the number of seconds an entry stays valid
+        :param max_entries: the maximum number of entries kept before evicting
+        """
+        self.backend = backend if backend is not None else MemoryCacheBackend()
+        self.ttl = self.DEFAULT_TTL if ttl is None else ttl
+        self.max_entries = max_entries or self.DEFAULT_MAX_ENTRIES
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Gets a value from the cache.
+
+        :param key: the cache key
+        :param default: the value returned if the key is missing or expired
+        :returns: the cached value, or default
+        """
+        with self._lock:
+            entry = self.backend.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires, value = entry
+            if expires <= time.time():
+                self.backend.delete(key)
+                self.misses += 1
+                return default
+            self.backend.touch(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Stores a value in the cache, evicting the least recently used entries if full.
+
+        :param key: the cache key
+        :param value: the value to cache
+        :param ttl: the number of seconds the value stays valid, the cache's ttl if not given
+        """
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self.backend.set(key, expires, value)
+            while len(self.backend) > self.max_entries:
+                self.backend.pop_oldest()
+
+    def clear(self):
+        """Removes every entry and resets the counters."""
+        with self._lock:
+            self.backend.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def close(self):
+        """Closes the cache backend."""
+        with self._lock:
+            self.backend.close()
+
+    def stats(self):
+        """Gets the cache statistics.
+
+        :returns: a dictionary with the hits, misses and number of entries
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.backend)}
+
+    def __len__(self):
+        with self._lock:
+            return len(self.backend)
@@ -0,0 +1,245 @@
+"""
+Filename: sqlite_backend.py
+Description: SQLite storage engine for the local library database
+"""
+
+import sqlite3
+import time
+from contextlib import contextmanager
+
+
+class PatronDocument(dict):
+    """A stored Patron dictionary that also carries its document ID, like a TinyDB Document."""
+
+    def __init__(self, value, doc_id):
+        """Constructor for the PatronDocument class.
+
+        :param value: the Patron's data
+        :param doc_id: the document ID
+        """
+        super().__init__(value)
+        self.doc_id = doc_id
+
+
+class SQLitePatronTable:
+    """Patron table stored in SQLite, offering the parts of the TinyDB table interface
+    that Library_DB uses.
+
+    Patrons are rows keyed by an integer doc_id with a unique memberID, and their
+    borrowed books are rows of a loans table, so an update only touches that Patron.
+    Changes are committed once write_cache_size writes are pending or the oldest
+    pending write is flush_interval seconds old, and on flush() and close(); while
+    suspended they are only committed by flush().
+    """
+
+    WRITE_CACHE_SIZE = 1000
+    FLUSH_INTERVAL = 5.0
+    FETCH_SIZE = 1000
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS patrons (doc_id INTEGER PRIMARY KEY, '
+        'memberID UNIQUE NOT NULL, fname, lname, age)',
+        'CREATE TABLE IF NOT EXISTS loans (doc_id INTEGER NOT NULL '
+        'REFERENCES patrons (doc_id) ON DELETE CASCADE, position INTEGER NOT NULL, '
+        'title TEXT NOT NULL, PRIMARY KEY (doc_id, position))',
+        'CREATE INDEX IF NOT EXISTS loans_title ON loans (title)',
+    )
+    SELECT_PATRONS = 'SELECT doc_id, fname, lname, age, memberID FROM patrons ORDER BY doc_id'
+    SELECT_LOANS = 'SELECT doc_id, title FROM loans ORDER BY doc_id, position'
+    SELECT_PATRON = 'SELECT fname, lname, age, memberID FROM patrons WHERE doc_id = ?'
+    SELECT_PATRON_LOANS = 'SELECT title FROM loans WHERE doc_id = ? ORDER BY position'
+    INSERT_PATRON = 'INSERT INTO patrons (doc_id, fname, lname, age, memberID) VALUES (?, ?, ?, ?, ?)'
+    UPDATE_PATRON = 'UPDATE patrons SET fname = ?, lname = ?, age = ?, memberID = ? WHERE doc_id = ?'
+    INSERT_LOAN = 'INSERT INTO loans (doc_id, position, title) VALUES (?, ?, ?)'
+    DELETE_LOANS = 'DELETE FROM loans WHERE doc_id = ?'
+
+    def __init__(self, path, write_cache_size=None, flush_interval=None):
+        """Constructor for the SQLitePatronTable class.
+
+        :param path: the path of the database file
+        :param write_cache_size: the number of pending writes that triggers a commit
+        :param flush_interval: the age in seconds of pending writes that triggers a commit
+        """
+        self.path = path
+        self.write_cache_size = write_cache_size or self.WRITE_CACHE_SIZE
+        self.flush_interval = self.FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.suspended = False
+        self.pending_writes = 0
+        self._first_write = None
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        if path != ':memory:':
+            self.conn.execute('PRAGMA journal_mode = WAL')
+            self.conn.execute('PRAGMA synchronous = NORMAL')
+        for statement in self.SCHEMA:
+            self.conn.execute(statement)
+        self.conn.commit()
+        self._transaction_depth = 0
+        self.closed = False
+        self.mark_seen()
+
+    def data_version(self):
+        """Gets SQLite's counter of changes committed by other connections.
+
+        :returns: the data version
+        """
+        return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def changed(self):
+        """Determines if another connection committed changes since mark_seen() was called.
+
+        :returns: True if it did, False if not
+        """
+        return self.data_version() != self.seen_version
+
+    def mark_seen(self):
+        """Records that the changes committed so far have been read, to be called
+        before reading them so that a change committed meanwhile is still detected."""
+        self.seen_version = self.data_version()
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """Context manager running the block in a single transaction, so that what it
+        reads stays consistent with what it writes. Nested blocks join the outer one.
+
+        :param immediate: True to take the write lock at once, for a check followed by
+                          a write, False for reads
+        """
+        if self._transaction_depth or self.conn.in_transaction:
+            self._transaction_depth += 1
+            try:
+                yield
+            finally:
+                self._transaction_depth -= 1
+            return
+        self.conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        self._transaction_depth = 1
+        try:
+            yield
+        except BaseException:
+            if self.pending_writes == 0 and not self.closed:
+                self.conn.rollback()
+            raise
+        else:
+            if self.pending_writes == 0 and not self.closed:
+                self.conn.commit()
+        finally:
+            self._transaction_depth = 0
+
+    def __iter__(self):
+        patrons = self.conn.execute(self.SELECT_PATRONS)
+        loans = self.conn.cursor().execute(self.SELECT_LOANS)
+        loan = loans.fetchone()
+        while True:
+            rows = patrons.fetchmany(self.FETCH_SIZE)
+            if not rows:
+                return
+            for doc_id, fname, lname, age, memberID in rows:
+                borrowed_books = []
+                while loan is not None and loan[0] <= doc_id:
+                    if loan[0] == doc_id:
+                        borrowed_books.append(loan[1])
+                    loan = loans.fetchone()
+                yield PatronDocument({'fname': fname, 'lname': lname, 'age': age, 'memberID': memberID,
+                                      'borrowed_books': borrowed_books}, doc_id)
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM patrons').fetchone()[0]
+
+    def all(self):
+        """Gets every stored Patron.
+
+        :returns: a list of PatronDocuments
+        """
+        return list(self)
+
+    def get(self, doc_id):
+        """Gets a stored Patron by document ID.
+
+        :param doc_id: the document ID
+        :returns: the PatronDocument, or None
+        """
+        row = self.conn.execute(self.SELECT_PATRON, (doc_id,)).fetchone()
+        if row is None:
+            return None
+        borrowed_books = [title for title, in self.conn.execute(self.SELECT_PATRON_LOANS, (doc_id,))]
+        return PatronDocument({'fname': row[0], 'lname': row[1], 'age': row[2], 'memberID': row[3],
+                               'borrowed_books': borrowed_books}, doc_id)
+
+    def insert(self, document):
+        """Stores a new Patron.
+
+        :param document: the Patron's data in the Library_DB format
+        :returns: the new document ID
+        """
+        return self.insert_multiple([document])[0]
+
+    def insert_multiple(self, documents, doc_ids=None):
+        """Stores new Patrons.
+
+        :param documents: the Patrons' data in the Library_DB format
+        :param doc_ids: the document IDs to store them under, new ones if not given
+        :returns: the list of document IDs
+        """
+        ids = []
+        for position, document in enumerate(documents):
+            doc_id = doc_ids[position] if doc_ids else None
+            cursor = self.conn.execute(self.INSERT_PATRON, (doc_id, document['fname'], document['lname'],
+                                                            document['age'], document['memberID']))
+            doc_id = cursor.lastrowid if doc_id is None else doc_id
+            self.conn.executemany(self.INSERT_LOAN, [(doc_id, index, title) for index, title
+                                                     in enumerate(document.get('borrowed_books', ()))])
+            ids.append(doc_id)
+        self.written()
+        return ids
+
+    def update(self, fields, doc_ids):
+        """Replaces the data of stored Patrons.
+
+        :param fields: the Patron's data in the Library_DB format
+        :param doc_ids: the document IDs to update
+        :returns: the list of updated document IDs
+        """
+        for doc_id in doc_ids:
+            self.conn.execute(self.UPDATE_PATRON, (fields['fname'], fields['lname'], fields['age'],
+                                                   fields['memberID'], doc_id))
+            if 'borrowed_books' in fields:
+                self.conn.execute(self.DELETE_LOANS, (doc_id,))
+                self.conn.executemany(self.INSERT_LOAN, [(doc_id, index, title) for index, title
+                                                         in enumerate(fields['borrowed_books'])])
+        self.written()
+        return list(doc_ids)
+
+    def written(self):
+        """Counts a pending write, committing if a threshold is reached."""
+        self.pending_writes += 1
+        if self._first_write is None:
+            self._first_write = time.monotonic()
+        if self.suspended:
+            return
+        if (self.pending_writes >= self.write_cache_size
+                or time.monotonic() - self._first_write >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Commits the pending writes."""
+        if self.pending_writes:
+            self.conn.commit()
+        self.pending_writes = 0
+        self._first_write = None
+
+    def discard(self):
+        """Rolls back the pending writes."""
+        self.conn.rollback()
+        self.pending_writes = 0
+        self._first_write = None
+
+    def clear_cache(self):
+        """Nothing is cached outside SQLite; present for parity with TinyDB."""
+        pass
+
+    def close(self):
+        """Commits the pending writes and closes the database."""
+        self.flush()
+        self.conn.close()
+        self.closed = True
@@ -0,0 +1,253 @@
+"""
+Filename: storage.py
+Description: TinyDB storages and middlewares used by the local database
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from tinydb.middlewares import CachingMiddleware
+from tinydb.storages import Storage
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class JSONCodec:
+    """Compact JSON serializer working on UTF-8 bytes."""
+
+    def __init__(self, name, dumps, loads):
+        """Constructor for the JSONCodec class.
+
+        :param name: the name of the codec
+        :param dumps: function serializing an object to bytes
+        :param loads: function parsing bytes to an object
+        """
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def __repr__(self):
+        return '<JSONCodec %s>' % self.name
+
+
+def _stdlib_dumps(data):
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def _ujson_dumps(data):
+    return ujson.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+def _orjson_dumps(data):
+    # TinyDB 3 keys documents by integer IDs, which the other codecs turn into strings
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+
+
+CODECS = {'json': JSONCodec('json', _stdlib_dumps, json.loads)}
+if ujson is not None:
+    CODECS['ujson'] = JSONCodec('ujson', _ujson_dumps, ujson.loads)
+if orjson is not None:
+    CODECS['orjson'] = JSONCodec('orjson', _orjson_dumps, orjson.loads)
+
+
+def get_json_codec(name='auto'):
+    """Gets a JSON codec by name.
+
+    :param name: 'orjson', 'ujson', 'json', or 'auto' for the fastest one installed
+    :returns: the JSONCodec
+    :raises ValueError: if the codec is unknown or not installed
+    """
+    if name == 'auto':
+        for name in ('orjson', 'ujson', 'json'):
+            if name in CODECS:
+                return CODECS[name]
+    if name not in CODECS:
+        raise ValueError("JSON codec %r is not available" % (name,))
+    return CODECS[name]
+
+
+class CompactJSONStorage(Storage):
+    """TinyDB storage writing the database as compact JSON with a pluggable codec.
+
+    The file stays readable by TinyDB's JSONStorage. The storage remembers the
+    modification time, size and inode of the file as of its last read or write, so
+    changes made by other processes can be detected without reparsing it.
+    """
+
+    def __init__(self, path, codec='auto'):
+        """Constructor for the CompactJSONStorage class.
+
+        :param path: the path of the JSON file, created if missing
+        :param codec: a JSONCodec or the name of one
+        """
+        super().__init__()
+        self.path = path
+        self.codec = get_json_codec(codec) if isinstance(codec, str) else codec
+        with open(path, 'ab'):
+            pass
+        self._handle = open(path, 'r+b')
+        self.signature = None
+
+    def read(self):
+        """Reads the whole database from the file.
+
+        :returns: the database state, or None if the file is empty
+        """
+        self._handle.seek(0)
+        content = self._handle.read()
+        self.signature = self.file_signature(os.fstat(self._handle.fileno()))
+        if not content:
+            return None
+        return self.codec.loads(content)
+
+    def write(self, data):
+        """Replaces the file content with the database state.
+
+        :param data: the whole database state
+        """
+        self._handle.seek(0)
+        self._handle.write(self.codec.dumps(data))
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        self._handle.truncate()
+        self.signature = self.file_signature(os.fstat(self._handle.fileno()))
+
+    @staticmethod
+    def file_signature(stat):
+        """Summarizes the state of a file for change detection.
+
+        :param stat: the os.stat_result of the file
+        :returns: a tuple of the modification time, size and inode
+        """
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def changed(self):
+        """Determines if the file was modified since it was last read or written.
+
+        :returns: True if it was modified or replaced, False if not
+        """
+        try:
+            return self.file_signature(os.stat(self.path)) != self.signature
+        except FileNotFoundError:
+            return True
+
+    def close(self):
+        """Closes the file."""
+        self._handle.close()
+
+
+class WriteBehindMiddleware(CachingMiddleware):
+    """CachingMiddleware that also flushes once buffered writes reach a given age.
+
+    The age is checked whenever a write is buffered; close() always flushes. While
+    suspended, writes are only buffered until flush() is called.
+    """
+
+    WRITE_CACHE_SIZE = 1000
+    FLUSH_INTERVAL = 5.0
+
+    def __init__(self, storage_cls, write_cache_size=None, flush_interval=None):
+        """Constructor for the WriteBehindMiddleware class.
+
+        :param storage_cls: the TinyDB storage class written to when flushing
+        :param write_cache_size: the number of buffered writes that triggers a flush
+        :param flush_interval: the age in seconds of buffered writes that triggers a flush
+        """
+        super().__init__(storage_cls)
+        self.write_cache_size = write_cache_size or self.WRITE_CACHE_SIZE
+        self.flush_interval = self.FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.suspended = False
+        self._first_write = None
+
+    def write(self, data):
+        """Buffers the new database state, flushing if a threshold is reached.
+
+        :param data: the whole database state
+        """
+        self.cache = data
+        self._cache_modified_count += 1
+        if self._first_write is None:
+            self._first_write = time.monotonic()
+        if self.suspended:
+            return
+        if (self._cache_modified_count >= self.write_cache_size
+                or time.monotonic() - self._first_write >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered database state to the storage."""
+        super().flush()
+        self._first_write = None
+
+    def discard(self):
+        """Drops the buffered writes so the next read comes from the storage."""
+        self.cache = None
+        self._cache_modified_count = 0
+        self._first_write = None
+
+    @property
+    def pending_writes(self):
+        """The number of writes buffered since the last flush."""
+        return self._cache_modified_count
+
+
+class FileLock:
+    """Re-entrant advisory fcntl lock on a file, coordinating processes.
+
+    Holding the lock shared lets other processes read while excluding writers;
+    holding it exclusive excludes everyone. A shared hold is upgraded while an
+    exclusive one is nested inside it. Threads have to be serialized by the caller.
+    """
+
+    def __init__(self, path):
+        """Constructor for the FileLock class.
+
+        :param path: the path of the lock file, created if missing
+        :raises OSError: if fcntl is not available on this platform
+        """
+        if fcntl is None:
+            raise OSError("File locking requires fcntl")
+        self.path = path
+        self._handle = open(path, 'a')
+        self._modes = []
+
+    @contextmanager
+    def hold(self, exclusive=False):
+        """Context manager holding the lock.
+
+        :param exclusive: True to exclude other readers as well as writers
+        """
+        held = self._modes[-1] if self._modes else None
+        if held is None or (exclusive and held == fcntl.LOCK_SH):
+            mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+            fcntl.flock(self._handle.fileno(), mode)
+        else:
+            mode = held
+        self._modes.append(mode)
+        try:
+            yield self
+        finally:
+            self._modes.pop()
+            if not self._modes:
+                fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+            elif self._modes[-1] != mode:
+                fcntl.flock(self._handle.fileno(), self._modes[-1])
+
+    def close(self):
+        """Closes the lock file, releasing the lock."""
+        self._handle.close()
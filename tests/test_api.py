@@ -1,5 +1,10 @@
+import json
+import threading
+import time
 import unittest
+from urllib.parse import parse_qsl, urlsplit
 from unittest.mock import Mock, patch
+from library.circuit_breaker import CircuitBreaker
 from library.ext_api_interface import *
 import requests
 
@@ -10,23 +15,323 @@ class TestMakeRequest(unittest.TestCase):
         self.books = Books_API()
 
     def test_make_successful_request(self):
-        with patch('library.ext_api_interface.requests.get') as mock_get:
+        with patch('library.ext_api_interface.requests.Session.get') as mock_get:
             mock_get.return_value.status_code = 200
             response = Books_API.make_request(self.books, "http://openlibrary.org/search.json")
             self.assertIsNotNone(response)
 
     def test_make_failed_request(self):
-        with patch('library.ext_api_interface.requests.get') as mock_get:
+        with patch('library.ext_api_interface.requests.Session.get') as mock_get:
             mock_get.return_value.status_code = 205
             response = Books_API.make_request(self.books, "http://openlibrary.org/search.json")
             self.assertIsNone(response)
 
     def test_connection_error(self):
-        with patch('library.ext_api_interface.requests.get') as mock_get:
+        with patch('library.ext_api_interface.requests.Session.get') as mock_get:
             mock_get.side_effect = requests.ConnectionError
             response = Books_API.make_request(self.books, "http://openlibrary.org/search.json")
             self.assertIsNone(response)
 
+    def test_timeout(self):
+        with patch('library.ext_api_interface.requests.Session.get') as mock_get:
+            mock_get.side_effect = requests.Timeout
+            response = Books_API.make_request(self.books, "http://openlibrary.org/search.json")
+            self.assertIsNone(response)
+
+    def test_request_uses_timeouts(self):
+        books = Books_API(connect_timeout=1, read_timeout=2)
+        with patch('library.ext_api_interface.requests.Session.get') as mock_get:
+            mock_get.return_value.status_code = 200
+            books.make_request("http://openlibrary.org/search.json")
+            mock_get.assert_called_once_with("http://openlibrary.org/search.json", timeout=(1, 2))
+
+    def test_session_is_reused(self):
+        self.assertIs(self.books.session, self.books.session)
+
+    def test_session_is_pooled(self):
+        books = Books_API(pool_maxsize=32, max_retries=5)
+        adapter = books.session.get_adapter(Books_API.API_URL)
+        self.assertEqual(32, adapter._pool_maxsize)
+        self.assertEqual(5, adapter.max_retries.total)
+
+    def test_repeated_request_is_cached(self):
+        with patch('library.ext_api_interface.requests.Session.get') as mock_get:
+            mock_get.return_value.status_code = 200
+            mock_get.return_value.json.return_value = {'docs': []}
+            self.books.make_request("http://openlibrary.org/search.json?q=Redwall")
+            response = self.books.make_request("http://openlibrary.org/search.json?q=redwall")
+            self.assertEqual({'docs': []}, response)
+            mock_get.assert_called_once()
+
+    def test_failed_request_is_cached_briefly(self):
+        with patch('library.ext_api_interface.requests.Session.get') as mock_get:
+            mock_get.return_value.status_code = 500
+            self.assertIsNone(self.books.make_request("http://openlibrary.org/search.json?q=Redwall"))
+            self.assertIsNone(self.books.make_request("http://openlibrary.org/search.json?q=Redwall"))
+            self.assertEqual(1, mock_get.call_count)
+            self.assertEqual(Books_API.NEGATIVE_TTL, self.books.negative_ttl)
+
+    def test_failed_request_expires(self):
+        books = Books_API(negative_ttl=0)
+        with patch('library.ext_api_interface.requests.Session.get') as mock_get:
+            mock_get.return_value.status_code = 500
+            books.make_request("http://openlibrary.org/search.json?q=Redwall")
+            books.make_request("http://openlibrary.org/search.json?q=Redwall")
+            self.assertEqual(2, mock_get.call_count)
+
+    def test_empty_result_uses_negative_ttl(self):
+        cache = Mock()
+        cache.get.side_effect = lambda key, default: default
+        books = Books_API(cache=cache, negative_ttl=5)
+        with patch('library.ext_api_interface.requests.Session.get') as mock_get:
+            mock_get.return_value.status_code = 200
+            mock_get.return_value.json.return_value = {'docs': []}
+            books.make_request("http://openlibrary.org/search.json?q=Redwall")
+            mock_get.return_value.json.return_value = {'docs': [{'title': 'Redwall'}]}
+            books.make_request("http://openlibrary.org/search.json?q=Mossflower")
+        self.assertEqual(5, cache.set.call_args_list[0][0][2])
+        self.assertIsNone(cache.set.call_args_list[1][0][2])
+
+    def test_circuit_breaker_fails_fast(self):
+        books = Books_API(cache=False, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+        with patch('library.ext_api_interface.requests.Session.get') as mock_get:
+            mock_get.side_effect = requests.ConnectionError
+            for _ in range(5):
+                self.assertIsNone(books.make_request("http://openlibrary.org/search.json?q=Redwall"))
+            self.assertEqual(2, mock_get.call_count)
+            self.assertEqual(CircuitBreaker.OPEN, books.breaker.state)
+
+    def test_client_error_does_not_open_breaker(self):
+        books = Books_API(cache=False, breaker=CircuitBreaker(failure_threshold=1))
+        with patch('library.ext_api_interface.requests.Session.get') as mock_get:
+            mock_get.return_value.status_code = 404
+            books.make_request("http://openlibrary.org/search.json?q=Redwall")
+            self.assertEqual(CircuitBreaker.CLOSED, books.breaker.state)
+
+    def test_failed_trial_request_reopens_breaker(self):
+        books = Books_API(cache=False, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0))
+        with patch('library.ext_api_interface.requests.Session.get') as mock_get:
+            mock_get.side_effect = requests.ConnectionError
+            books.make_request("http://openlibrary.org/search.json?q=Redwall")
+            mock_get.side_effect = requests.exceptions.ChunkedEncodingError
+            self.assertIsNone(books.make_request("http://openlibrary.org/search.json?q=Redwall"))
+            mock_get.side_effect = None
+            mock_get.return_value.status_code = 200
+            mock_get.return_value.json.return_value = {'docs': [{'title': 'Redwall'}]}
+            self.assertEqual({'docs': [{'title': 'Redwall'}]},
+                             books.make_request("http://openlibrary.org/search.json?q=Redwall"))
+            self.assertEqual(3, mock_get.call_count)
+            self.assertEqual(CircuitBreaker.CLOSED, books.breaker.state)
+
+    def test_cache_disabled(self):
+        books = Books_API(cache=False)
+        with patch('library.ext_api_interface.requests.Session.get') as mock_get:
+            mock_get.return_value.status_code = 200
+            books.make_request("http://openlibrary.org/search.json?q=Redwall")
+            books.make_request("http://openlibrary.org/search.json?q=Redwall")
+            self.assertEqual(2, mock_get.call_count)
+
+    def test_close_discards_session(self):
+        session = self.books.session
+        self.books.close()
+        self.assertIsNot(session, self.books.session)
+
+
+class TestIterDocs(unittest.TestCase):
+
+    def setUp(self):
+        self.books = Books_API()
+
+    def test_search_url_projects_fields(self):
+        self.assertEqual("http://openlibrary.org/search.json?q=Redwall&fields=title,language&limit=100&page=2",
+                         self.books.search_url('q', 'Redwall', 'title,language', page=2))
+
+    def test_search_url_encodes_value(self):
+        for title in ('C# in Depth', 'Tom & Jerry', 'Redwall?page=9'):
+            url = self.books.search_url('q', title, 'title')
+            prepared = requests.Request('GET', url).prepare()
+            self.assertEqual([('q', title), ('fields', 'title'), ('limit', '100'), ('page', '1')],
+                             parse_qsl(urlsplit(prepared.url).query))
+
+    def test_pages_until_short_page(self):
+        with patch('library.ext_api_interface.Books_API.make_request') as mock_get:
+            mock_get.side_effect = [{'docs': [{'title': 'a'}, {'title': 'b'}]},
+                                    {'docs': [{'title': 'c'}]}]
+            docs = list(self.books.iter_docs('q', 'Redwall', 'title', limit=2, max_pages=5))
+            self.assertEqual(['a', 'b', 'c'], [doc['title'] for doc in docs])
+            self.assertEqual(2, mock_get.call_count)
+            self.assertTrue(mock_get.call_args[0][0].endswith('&limit=2&page=2'))
+
+    def test_stops_at_max_pages(self):
+        with patch('library.ext_api_interface.Books_API.make_request') as mock_get:
+            mock_get.return_value = {'docs': [{'title': 'a'}, {'title': 'b'}]}
+            docs = list(self.books.iter_docs('q', 'Redwall', 'title', limit=2, max_pages=3))
+            self.assertEqual(6, len(docs))
+            self.assertEqual(3, mock_get.call_count)
+
+    def test_stops_early_when_consumer_stops(self):
+        with patch('library.ext_api_interface.Books_API.make_request') as mock_get:
+            mock_get.return_value = {'docs': [{'title': 'a'}, {'title': 'b'}]}
+            docs = self.books.iter_docs('q', 'Redwall', 'title', limit=2, max_pages=3)
+            self.assertEqual('a', next(docs)['title'])
+            mock_get.assert_called_once()
+
+    def test_stops_on_failed_request(self):
+        with patch('library.ext_api_interface.Books_API.make_request') as mock_get:
+            mock_get.return_value = None
+            self.assertEqual([], list(self.books.iter_docs('q', 'Redwall', 'title')))
+
+    def test_is_book_available_asks_for_one_doc(self):
+        with patch('library.ext_api_interface.Books_API.make_request') as mock_get:
+            mock_get.return_value = {'docs': [{'key': '/works/1'}]}
+            self.assertTrue(self.books.is_book_available('Redwall'))
+            mock_get.assert_called_once_with(
+                "http://openlibrary.org/search.json?q=Redwall&fields=key&limit=1&page=1")
+
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.books = Books_API(streaming=True)
+        self.body = json.dumps({'numFound': 3, 'docs': [{'title': 'Redwall', 'ebook_count_i': 1},
+                                                        {'title': 'Mossflower', 'ebook_count_i': 0},
+                                                        {'title': 'Mattimeo', 'ebook_count_i': 2}]}).encode()
+        self.read = []
+
+    def chunks(self, size):
+        for start in range(0, len(self.body), size):
+            self.read.append(start)
+            yield self.body[start:start + size]
+
+    def test_get_ebooks(self):
+        with patch('library.ext_api_interface.requests.Session.get') as mock_get:
+            mock_get.return_value.status_code = 200
+            mock_get.return_value.iter_content.return_value = self.chunks(7)
+            self.assertEqual([{'title': 'Redwall', 'ebook_count': 1}, {'title': 'Mattimeo', 'ebook_count': 2}],
+                             self.books.get_ebooks('Redwall'))
+            self.assertTrue(mock_get.call_args[1]['stream'])
+            mock_get.return_value.close.assert_called_once()
+
+    def test_stops_reading_at_first_match(self):
+        with patch('library.ext_api_interface.requests.Session.get') as mock_get:
+            mock_get.return_value.status_code = 200
+            mock_get.return_value.iter_content.return_value = self.chunks(8)
+            ebooks = self.books.iter_ebooks('Redwall')
+            self.assertEqual('Redwall', next(ebooks)['title'])
+            ebooks.close()
+            self.assertLess(len(self.read) * 8, len(self.body))
+            mock_get.return_value.close.assert_called_once()
+
+    def test_failed_request(self):
+        with patch('library.ext_api_interface.requests.Session.get') as mock_get:
+            mock_get.return_value.status_code = 500
+            self.assertEqual([], self.books.get_ebooks('Redwall'))
+            mock_get.side_effect = requests.ConnectionError
+            self.assertEqual([], self.books.get_ebooks('Mossflower'))
+
+    def test_broken_stream_reopens_breaker(self):
+        self.books.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        with patch('library.ext_api_interface.requests.Session.get') as mock_get:
+            mock_get.return_value.status_code = 200
+            mock_get.return_value.iter_content.side_effect = requests.exceptions.ChunkedEncodingError
+            self.assertEqual([], self.books.get_ebooks('Redwall'))
+            self.assertEqual(CircuitBreaker.OPEN, self.books.breaker.state)
+
+    def test_uses_cached_response(self):
+        url = self.books.search_url('q', 'Redwall', 'title,ebook_count_i')
+        self.books.cache.set(normalize_url(url), {'docs': [{'title': 'Redwall', 'ebook_count_i': 1}]})
+        with patch('library.ext_api_interface.requests.Session.get') as mock_get:
+            self.assertEqual([{'title': 'Redwall', 'ebook_count': 1}], self.books.get_ebooks('Redwall'))
+            mock_get.assert_not_called()
+
+
+class TestTitleIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.books = Books_API()
+
+    def test_normalize_title(self):
+        self.assertEqual('redwall abbey', normalize_title('  Ｒｅｄｗａｌｌ\tABBEY '))
+        self.assertEqual('strasse', normalize_title('STRAßE'))
+
+    def test_ebook_titles_cached(self):
+        with patch('library.ext_api_interface.Books_API.make_request') as mock_get:
+            mock_get.return_value = {'docs': [{'title': 'Redwall', 'ebook_count_i': 1},
+                                              {'title': 'Mossflower', 'ebook_count_i': 0}]}
+            self.assertEqual({'redwall': None}, self.books.ebook_titles('Redwall'))
+            self.assertTrue(self.books.has_ebook('REDWALL'))
+            self.assertFalse(self.books.has_ebook('Mossflower'))
+            self.assertEqual(2, mock_get.call_count)
+
+    def test_index_reused_without_rebuilding(self):
+        with patch('library.ext_api_interface.Books_API.iter_books_by_author') as mock_iter:
+            mock_iter.return_value = iter(['Redwall', 'Mossflower'])
+            self.assertTrue(self.books.has_book_by_author('Brian Jacques', 'mossflower'))
+            self.assertFalse(self.books.has_book_by_author('brian  jacques', 'Mattimeo'))
+            mock_iter.assert_called_once()
+
+    def test_streaming_stops_at_match_without_caching(self):
+        books = Books_API(streaming=True, author_cache=False)
+        titles = iter(['Redwall', 'Mossflower', 'Mattimeo'])
+        with patch('library.ext_api_interface.Books_API.iter_books_by_author', return_value=titles):
+            self.assertTrue(books.has_book_by_author('Brian Jacques', 'Redwall'))
+        self.assertEqual(['Mossflower', 'Mattimeo'], list(titles))
+        self.assertEqual(0, len(books.cache))
+
+
+class TestAuthorCache(unittest.TestCase):
+
+    def setUp(self):
+        self.books = Books_API()
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def titles(self, author):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.02)
+        with self.lock:
+            self.active -= 1
+        return iter(['%s book' % author])
+
+    def test_prefetch_authors(self):
+        with patch.object(self.books, 'iter_books_by_author', side_effect=self.titles) as mock_iter:
+            self.assertEqual(3, self.books.prefetch_authors(['a', 'b', 'A ', 'c']))
+            self.assertEqual(3, mock_iter.call_count)
+            self.assertGreater(self.max_active, 1)
+            self.assertTrue(self.books.has_book_by_author('b', 'B Book'))
+            self.assertFalse(self.books.has_book_by_author('a', 'b book'))
+            self.assertEqual(0, self.books.prefetch_authors(['a', 'b']))
+            self.assertEqual(3, mock_iter.call_count)
+
+    def test_author_cache_expires(self):
+        books = Books_API(author_cache=ResponseCache(ttl=0))
+        with patch.object(books, 'iter_books_by_author', side_effect=self.titles) as mock_iter:
+            books.has_book_by_author('a', 'a book')
+            books.has_book_by_author('a', 'a book')
+            self.assertEqual(2, mock_iter.call_count)
+        self.assertEqual(Books_API.AUTHOR_TTL, self.books.author_cache.ttl)
+
+    def test_streaming_author_checks_are_cached(self):
+        books = Books_API(streaming=True)
+        body = json.dumps({'docs': [{'title_suggest': 'Redwall'}, {'title_suggest': 'Mossflower'}]}).encode()
+        with patch('library.ext_api_interface.requests.Session.get') as mock_get:
+            mock_get.return_value.status_code = 200
+            mock_get.return_value.iter_content.side_effect = lambda size: iter([body])
+            for _ in range(5):
+                self.assertTrue(books.has_book_by_author('Brian Jacques', 'Redwall'))
+            self.assertTrue(books.has_book_by_author('Brian Jacques', 'Mossflower'))
+            mock_get.assert_called_once()
+
+    def test_author_cache_disabled(self):
+        books = Books_API(author_cache=False)
+        with patch.object(books, 'iter_books_by_author', side_effect=self.titles) as mock_iter:
+            self.assertEqual(0, books.prefetch_authors(['a']))
+            self.assertTrue(books.has_book_by_author('a', 'a book'))
+            mock_iter.assert_called_once()
+
 
 class TestIsBookAvailable(unittest.TestCase):
 
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import threading
+import time
+import unittest
+from unittest.mock import Mock, patch
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs
+
+from library.async_ext_api_interface import AsyncBooks_API
+from library.ext_api_interface import Books_API
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.requests = 0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers search.json with one ebook titled after the query, slower for shorter titles."""
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        query = parse_qs(urlsplit(self.path).query)
+        title = (query.get('q') or query.get('author'))[0]
+        time.sleep(0.05 / len(title))
+        if title == 'missing':
+            docs = []
+        else:
+            docs = [{'title': title, 'title_suggest': title, 'ebook_count_i': len(title), 'language': ['eng']}]
+        body = json.dumps({'docs': docs}).encode()
+        with server.lock:
+            server.active -= 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestAsyncBooksAPI(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer()
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True)
+        self.thread.start()
+        api = Books_API(cache=False)
+        api.API_URL = 'http://127.0.0.1:%d/search.json' % self.server.server_address[1]
+        self.CuT = AsyncBooks_API(api, concurrency=3)
+
+    def tearDown(self):
+        self.CuT.close()
+        self.CuT.api.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get_ebooks(self):
+        response = asyncio.run(self.CuT.get_ebooks('Redwall'))
+        self.assertEqual([{'title': 'Redwall', 'ebook_count': 7}], response)
+
+    def test_is_book_available(self):
+        self.assertTrue(asyncio.run(self.CuT.is_book_available('Redwall')))
+        self.assertFalse(asyncio.run(self.CuT.is_book_available('missing')))
+
+    def test_books_by_author(self):
+        self.assertEqual(['Brian'], asyncio.run(self.CuT.books_by_author('Brian')))
+
+    def test_get_book_info(self):
+        response = asyncio.run(self.CuT.get_book_info('Redwall'))
+        self.assertEqual([{'title': 'Redwall', 'language': ['eng']}], response)
+
+    def test_get_ebooks_many_keeps_order(self):
+        titles = ['a', 'Redwall', 'missing', 'Mossflower', 'bb']
+        response = asyncio.run(self.CuT.get_ebooks_many(titles))
+        expected = [[{'title': title, 'ebook_count': len(title)}] if title != 'missing' else []
+                    for title in titles]
+        self.assertEqual(expected, response)
+
+    def test_many_respects_concurrency_limit(self):
+        titles = ['title%s' % chr(ord('a') + i) for i in range(12)]
+        asyncio.run(self.CuT.is_book_available_many(titles))
+        self.assertEqual(12, self.server.requests)
+        self.assertLessEqual(self.server.max_active, 3)
+
+    def test_many_runs_concurrently(self):
+        titles = ['x', 'y', 'z']
+        asyncio.run(self.CuT.books_by_author_many(titles))
+        self.assertGreater(self.server.max_active, 1)
+
+    def test_get_book_info_many(self):
+        response = asyncio.run(self.CuT.get_book_info_many(['Redwall', 'missing']))
+        self.assertEqual([[{'title': 'Redwall', 'language': ['eng']}], []], response)
+
+    def test_identical_lookups_share_one_request(self):
+        response = asyncio.run(self.CuT.get_ebooks_many(['a'] * 3))
+        self.assertEqual([[{'title': 'a', 'ebook_count': 1}]] * 3, response)
+        self.assertEqual(1, self.server.requests)
+
+    def test_close_leaves_given_api_open(self):
+        api = Mock(Books_API)
+        AsyncBooks_API(api).close()
+        api.close.assert_not_called()
+        with patch('library.async_ext_api_interface.Books_API') as mock_api:
+            AsyncBooks_API().close()
+            mock_api.return_value.close.assert_called_once()
@@ -0,0 +1,85 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from library.catalog import Catalog, build_catalog, main
+from library.ext_api_interface import Books_API
+from library.library import Library
+from library.library_db_interface import Library_DB
+
+SAMPLE_DUMP = os.path.join(os.path.dirname(__file__), os.pardir, 'tests_data', 'ol_dump_sample.txt')
+
+
+class TestCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dump_path = os.path.join(self.directory, 'ol_dump.txt.gz')
+        with open(SAMPLE_DUMP, 'rb') as sample, gzip.open(self.dump_path, 'wb') as dump:
+            shutil.copyfileobj(sample, dump)
+        self.catalog_path = os.path.join(self.directory, 'catalog.sqlite3')
+        self.count = build_catalog([self.dump_path], self.catalog_path, batch_size=2)
+        self.CuT = Catalog(self.catalog_path)
+
+    def tearDown(self):
+        self.CuT.close()
+        shutil.rmtree(self.directory)
+
+    def test_build(self):
+        self.assertEqual(3, self.count)
+        self.assertEqual(3, len(self.CuT))
+        self.assertFalse(os.path.exists(self.catalog_path + '.tmp'))
+
+    def test_search_title(self):
+        self.assertEqual([{'key': '/works/OL1W', 'title': 'Redwall', 'title_suggest': 'Redwall',
+                           'ebook_count_i': 1, 'language': ['eng', 'fre'],
+                           'publisher': ['Hutchinson', 'Philomel'], 'publish_year': [1986, 1987]}],
+                         self.CuT.search('q', 'redwall', 10))
+
+    def test_search_author(self):
+        docs = self.CuT.search('author', 'Brian Jacques', 10)
+        self.assertEqual(['Mossflower', 'Redwall'], sorted(doc['title'] for doc in docs))
+        self.assertEqual([], self.CuT.search('author', 'Earthsea', 10))
+        self.assertEqual(['A Wizard of Earthsea'], [doc['title'] for doc in self.CuT.search('q', 'le guin', 10)])
+
+    def test_search_pages(self):
+        first = self.CuT.search('author', 'jacques', 1)
+        second = self.CuT.search('author', 'jacques', 1, offset=1)
+        self.assertEqual(1, len(first))
+        self.assertNotEqual(first, second)
+        self.assertEqual([], self.CuT.search('author', 'jacques', 1, offset=2))
+
+    def test_search_quotes_and_empty_queries(self):
+        self.assertEqual([], self.CuT.search('q', '"redwall OR', 10))
+        self.assertEqual([], self.CuT.search('q', '   ', 10))
+
+    def test_missing_catalog(self):
+        with self.assertRaises(FileNotFoundError):
+            Catalog(os.path.join(self.directory, 'missing.sqlite3'))
+
+    def test_books_api_answers_locally(self):
+        books = Books_API(catalog=self.catalog_path)
+        with patch('library.ext_api_interface.requests.Session.get') as mock_get:
+            self.assertTrue(books.is_book_available('Redwall'))
+            self.assertFalse(books.is_book_available('Martin the Warrior'))
+            self.assertEqual(['Mossflower', 'Redwall'], sorted(books.books_by_author('Brian Jacques')))
+            self.assertEqual([{'title': 'Mossflower', 'ebook_count': 2}], books.get_ebooks('Mossflower'))
+            library = Library(Library_DB(Library_DB.MEMORY), books)
+            self.assertTrue(library.is_ebook('mossflower'))
+            self.assertFalse(library.is_ebook('A Wizard of Earthsea'))
+            self.assertTrue(library.is_book_by_author('Brian Jacques', 'REDWALL'))
+            self.assertEqual({'eng', 'fre'}, library.get_languages_for_book('Redwall'))
+            mock_get.assert_not_called()
+        books.close()
+
+    def test_main(self):
+        path = os.path.join(self.directory, 'cli.sqlite3')
+        with patch('builtins.print') as mock_print:
+            main([path, SAMPLE_DUMP])
+        mock_print.assert_called_once_with("Built a catalog of 3 books in %s" % path)
+        catalog = Catalog(path)
+        self.assertEqual(3, len(catalog))
+        catalog.close()
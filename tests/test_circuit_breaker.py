@@ -0,0 +1,60 @@
+import unittest
+from unittest.mock import patch
+
+from library.circuit_breaker import CircuitBreaker
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        patcher = patch('library.circuit_breaker.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.CuT = CircuitBreaker(failure_threshold=3, reset_timeout=10)
+
+    def test_closed_allows_requests(self):
+        self.CuT.record_failure()
+        self.CuT.record_failure()
+        self.assertTrue(self.CuT.allow_request())
+        self.assertEqual(CircuitBreaker.CLOSED, self.CuT.state)
+
+    def test_opens_after_threshold(self):
+        for _ in range(3):
+            self.CuT.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, self.CuT.state)
+        self.assertFalse(self.CuT.allow_request())
+
+    def test_success_resets_failures(self):
+        self.CuT.record_failure()
+        self.CuT.record_failure()
+        self.CuT.record_success()
+        self.CuT.record_failure()
+        self.assertEqual(CircuitBreaker.CLOSED, self.CuT.state)
+
+    def test_half_open_allows_one_trial(self):
+        for _ in range(3):
+            self.CuT.record_failure()
+        self.now += 10
+        self.assertEqual(CircuitBreaker.HALF_OPEN, self.CuT.state)
+        self.assertTrue(self.CuT.allow_request())
+        self.assertFalse(self.CuT.allow_request())
+
+    def test_trial_success_closes(self):
+        for _ in range(3):
+            self.CuT.record_failure()
+        self.now += 10
+        self.CuT.allow_request()
+        self.CuT.record_success()
+        self.assertEqual(CircuitBreaker.CLOSED, self.CuT.state)
+        self.assertTrue(self.CuT.allow_request())
+
+    def test_trial_failure_reopens(self):
+        for _ in range(3):
+            self.CuT.record_failure()
+        self.now += 10
+        self.CuT.allow_request()
+        self.CuT.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, self.CuT.state)
+        self.now += 9
+        self.assertFalse(self.CuT.allow_request())
@@ -0,0 +1,60 @@
+import json
+import unittest
+from unittest.mock import patch
+
+from library import json_stream
+from library.json_stream import ChunkReader, iter_array_items
+
+RESPONSE = {'numFound': 3, 'start': 0,
+            'docs': [{'title': 'Redwall \u00e9', 'ebook_count_i': 12345},
+                     {'title': 'Mossflower', 'language': ['eng', 'fre'], 'rating': 4.5},
+                     {'title': 'Mattimeo', 'publisher': None, 'has_fulltext': True}],
+            'q': 'redwall', 'offset': None}
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@patch.object(json_stream, 'ijson', None)
+class TestIterArrayItems(unittest.TestCase):
+
+    def setUp(self):
+        self.raw = json.dumps(RESPONSE, ensure_ascii=False).encode('utf-8')
+
+    def test_any_chunk_size(self):
+        for size in (1, 2, 5, 64, len(self.raw)):
+            self.assertEqual(RESPONSE['docs'], list(iter_array_items(chunked(self.raw, size))))
+
+    def test_key_after_other_members(self):
+        raw = b'{"a": {"docs": [0]}, "b": [1, 2], "docs" : [ 3 , 4 ] , "c": "]"}'
+        self.assertEqual([3, 4], list(iter_array_items(chunked(raw, 3))))
+
+    def test_empty_and_missing_array(self):
+        self.assertEqual([], list(iter_array_items([b'{"docs": []}'])))
+        self.assertEqual([], list(iter_array_items([b'{}'])))
+        self.assertEqual([], list(iter_array_items([b'{"numFound": 0}'])))
+
+    def test_stops_reading_when_caller_stops(self):
+        chunks = iter(chunked(self.raw, 8))
+        items = iter_array_items(chunks)
+        self.assertEqual(RESPONSE['docs'][0], next(items))
+        self.assertGreater(len(list(chunks)), 0)
+
+    def test_truncated_document(self):
+        with self.assertRaises(ValueError):
+            list(iter_array_items([b'{"docs": [{"title": "Redwall"}, {"tit']))
+
+    def test_not_an_object(self):
+        with self.assertRaises(ValueError):
+            list(iter_array_items([b'[1, 2]']))
+
+
+class TestChunkReader(unittest.TestCase):
+
+    def test_read(self):
+        CuT = ChunkReader([b'abc', b'de', b'f'])
+        self.assertEqual(b'ab', CuT.read(2))
+        self.assertEqual(b'cde', CuT.read(3))
+        self.assertEqual(b'f', CuT.read())
+        self.assertEqual(b'', CuT.read(4))
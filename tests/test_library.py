@@ -1,10 +1,9 @@
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from unittest import TestCase
-from unittest.mock import Mock
-import os.path
-from os import path
+from unittest.mock import Mock, patch
 from library.library import Library
-from library.library_db_interface import Library_DB
+from library.library_db_interface import ImportResult, Library_DB
 from library.ext_api_interface import Books_API
 from library.patron import Patron
 
@@ -74,8 +73,7 @@ book_language_list = [
 class TestLibrary(TestCase):
 
     def setUp(self) -> None:
-        self.CuT = Library()
-        self.CuT.db.close_db()
+        self.CuT = Library(Library_DB(Library_DB.MEMORY))
         self.patron = Mock()
         self.book_title_there = 'Adventures of Elvis'
         self.book_title_not_there = 'Adventures of Dino'
@@ -90,26 +88,62 @@ class TestLibrary(TestCase):
         # Assert
         self.assertIsInstance(self.CuT.db, Library_DB)
 
+    def test_library_db_injected(self):
+        # Assume
+        db = Library_DB(Library_DB.MEMORY)
+        api = Books_API()
+
+        # Action
+        library = Library(db, api)
+
+        # Assert
+        self.assertIs(db, library.db)
+        self.assertIs(api, library.api)
+
+    def test_library_db_path(self):
+        # Action
+        library = Library(Library_DB.MEMORY)
+
+        # Assert
+        self.assertEqual(Library_DB.MEMORY, library.db.path)
+
     def test_book_api_created(self):
         # Assert
         self.assertIsInstance(self.CuT.api, Books_API)
 
     def test_book_is_ebook(self):
         # Action
-        self.CuT.api = Mock()
-        self.CuT.api.get_ebooks.return_value = dummy_book_list_json
+        self.CuT.api.iter_ebooks = Mock(return_value=iter(dummy_book_list_json))
 
         # Assert
         self.assertTrue(self.CuT.is_ebook(self.book_title_there))
 
     def test_book_is_not_ebook(self):
         # Action
-        self.CuT.api = Mock()
-        self.CuT.api.get_ebooks.return_value = dummy_book_list_json
+        self.CuT.api.iter_ebooks = Mock(return_value=iter(dummy_book_list_json))
 
         # Assert
         self.assertFalse(self.CuT.is_ebook(self.book_title_not_there))
 
+    def test_is_ebook_stops_at_first_match(self):
+        # Action
+        self.CuT.api.streaming = True
+        ebooks = iter(dummy_book_list_json)
+        self.CuT.api.iter_ebooks = Mock(return_value=ebooks)
+
+        # Assert
+        self.assertTrue(self.CuT.is_ebook(dummy_book_list_json[0]['title']))
+        self.assertEqual(dummy_book_list_json[1:], list(ebooks))
+
+    def test_is_ebook_normalizes_titles(self):
+        # Action
+        self.CuT.api.iter_ebooks = Mock(return_value=iter([{'title': 'Ｒｅｄｗａｌｌ  Abbey', 'ebook_count': 1}]))
+
+        # Assert
+        self.assertTrue(self.CuT.is_ebook(' redwall abbey'))
+        self.assertTrue(self.CuT.is_ebook('REDWALL ABBEY'))
+        self.CuT.api.iter_ebooks.assert_called_once()
+
     def test_gets_book_count_for_more_than_zero(self):
 
         # Action
@@ -145,8 +179,7 @@ class TestLibrary(TestCase):
     def test_author_entered_for_book_is_true(self):
 
         # Action
-        self.CuT.api = Mock()
-        self.CuT.api.books_by_author.return_value = dummy_author_book_list_json
+        self.CuT.api.iter_books_by_author = Mock(return_value=iter(dummy_author_book_list_json))
 
         # Assert
         self.assertTrue(self.CuT.is_book_by_author(self.book_author, self.book_title_there))
@@ -154,8 +187,7 @@ class TestLibrary(TestCase):
     def test_author_entered_for_book_is_false(self):
 
         # Action
-        self.CuT.api = Mock()
-        self.CuT.api.books_by_author.return_value = dummy_author_book_list_json
+        self.CuT.api.iter_books_by_author = Mock(return_value=iter(dummy_author_book_list_json))
 
         # Assert
         self.assertFalse(self.CuT.is_book_by_author(self.book_author, self.book_title_not_there))
@@ -163,12 +195,21 @@ class TestLibrary(TestCase):
     def test_author_entered_for_book_has_no_book_in_library(self):
 
         # Action
-        self.CuT.api = Mock()
-        self.CuT.api.books_by_author.return_value = []
+        self.CuT.api.iter_books_by_author = Mock(return_value=iter([]))
 
         # Assert
         self.assertFalse(self.CuT.is_book_by_author(self.book_author, self.book_title_not_there))
 
+    def test_prefetch_authors(self):
+        # Action
+        self.CuT.api.iter_books_by_author = Mock(side_effect=lambda author: iter(dummy_author_book_list_json))
+        self.CuT.prefetch_authors([self.book_author])
+
+        # Assert
+        for _ in range(5):
+            self.assertTrue(self.CuT.is_book_by_author(self.book_author, 'adventures of elvis'))
+        self.CuT.api.iter_books_by_author.assert_called_once_with(self.book_author)
+
     def test_gets_languages_for_the_book(self):
 
         # Action
@@ -232,16 +273,11 @@ class TestLibrary(TestCase):
         self.CuT.db = Mock()
         self.CuT.db.insert_patron.return_value = 1
         self.CuT.db.retrieve_patron.return_value = True
-        patron = Patron(self.first_name, self.last_name, self.age, self.member_id)
-        patron.get_memberID = Mock(return_value=1)
+        patron = Patron(self.first_name, self.last_name, self.age, 1)
 
         # Action
         self.CuT.register_patron(self.first_name, self.last_name, self.age, self.member_id)
         is_patron_registered = self.CuT.is_patron_registered(patron)
-        # Removes the instance of the db.json created
-        if path.exists('db.json'):
-            os.remove('db.json')
-
         # Assert
         self.assertTrue(is_patron_registered)
 
@@ -251,19 +287,31 @@ class TestLibrary(TestCase):
         self.CuT.db = Mock()
         self.CuT.db.insert_patron.return_value = 1
         self.CuT.db.retrieve_patron.return_value = False
-        patron = Patron(self.first_name, self.last_name, self.age, self.member_id)
-        patron.get_memberID = Mock(return_value=1)
+        patron = Patron(self.first_name, self.last_name, self.age, 1)
 
         # Action
         self.CuT.register_patron(self.first_name, self.last_name, self.age, self.member_id)
         is_patron_registered = self.CuT.is_patron_registered(patron)
-        # Removes the instance of the db.json created
-        if path.exists('db.json'):
-            os.remove('db.json')
-
         # Assert
         self.assertFalse(is_patron_registered)
 
+    def test_register_patrons(self):
+
+        # Assume
+        self.CuT.db = Mock()
+        import_result = ImportResult([1, 2], 0.5)
+        self.CuT.db.insert_patrons.return_value = import_result
+        records = [(self.first_name, self.last_name, self.age, 1),
+                   (self.first_name, self.last_name, self.age, 2)]
+
+        # Action
+        result = self.CuT.register_patrons(records)
+
+        # Assert
+        self.CuT.db.insert_patrons.assert_called_once_with(records)
+        self.assertIs(import_result, result)
+        self.assertEqual(2, result.inserted)
+
     def test_has_patron_borrowed_book_true(self):
 
         # Assume
@@ -279,15 +327,12 @@ class TestLibrary(TestCase):
         self.patron.get_borrowed_books.return_value = [
             self.book_title_there.lower()
         ]
+        self.patron.has_borrowed_book.return_value = True
 
         # Action
         self.CuT.borrow_book(self.book_title_there, self.patron)
         is_book_borrowed = self.CuT.is_book_borrowed(self.book_title_there, self.patron)
 
-        # Removes the instance of the db.json created
-        if path.exists('db.json'):
-            os.remove('db.json')
-
         # Assert
         self.assertTrue(is_book_borrowed)
 
@@ -306,15 +351,12 @@ class TestLibrary(TestCase):
         self.patron.get_borrowed_books.return_value = [
             'Some other book title'
         ]
+        self.patron.has_borrowed_book.return_value = False
 
         # Action
         self.CuT.borrow_book(self.book_title_there, self.patron)
         is_book_borrowed = self.CuT.is_book_borrowed(self.book_title_there, self.patron)
 
-        # Removes the instance of the db.json created
-        if path.exists('db.json'):
-            os.remove('db.json')
-
         # Assert
         self.assertFalse(is_book_borrowed)
 
@@ -333,19 +375,161 @@ class TestLibrary(TestCase):
         self.CuT.db.update_patron.return_value = True
         self.patron.return_borrowed_book.return_value = True
         self.patron.get_borrowed_books.return_value = []
+        self.patron.has_borrowed_book.return_value = False
 
         # Action
         self.CuT.borrow_book(self.book_title_there, self.patron)
         self.CuT.return_borrowed_book(self.book_title_there, self.patron)
         is_book_borrowed = self.CuT.is_book_borrowed(self.book_title_there, self.patron)
 
-        # Removes the instance of the db.json created
-        if path.exists('db.json'):
-            os.remove('db.json')
-
         # Assert
         self.assertFalse(is_book_borrowed)
 
+    def test_borrow_books_updates_patron_once(self):
+
+        # Assume
+        self.CuT.db = Mock()
+        patron = Patron(self.first_name, self.last_name, self.age, self.member_id)
+
+        # Action
+        self.CuT.borrow_books([self.book_title_there, 'Mossflower'], patron)
+
+        # Assert
+        self.CuT.db.update_patron.assert_called_once_with(patron)
+        self.assertEqual([self.book_title_there.lower(), 'mossflower'], patron.get_borrowed_books())
+
+    def test_return_books_updates_patron_once(self):
+
+        # Assume
+        self.CuT.db = Mock()
+        patron = Patron(self.first_name, self.last_name, self.age, self.member_id)
+        patron.add_borrowed_book(self.book_title_there.lower())
+        patron.add_borrowed_book('mossflower')
+
+        # Action
+        self.CuT.return_books([self.book_title_there, 'Mossflower'], patron)
+
+        # Assert
+        self.CuT.db.update_patron.assert_called_once_with(patron)
+        self.assertEqual([], patron.get_borrowed_books())
+
+    def test_borrow_book_already_borrowed_skips_update(self):
+
+        # Assume
+        self.CuT.db = Mock()
+        patron = Patron(self.first_name, self.last_name, self.age, self.member_id)
+        patron.add_borrowed_book(self.book_title_there)
+
+        # Action
+        self.CuT.borrow_book(self.book_title_there, patron)
+        self.CuT.return_borrowed_book(self.book_title_not_there, patron)
+        self.CuT.return_books([self.book_title_not_there], patron)
+
+        # Assert
+        self.CuT.db.update_patron.assert_not_called()
+
+    def test_apply_loans(self):
+
+        # Assume
+        first = Patron(self.first_name, self.last_name, self.age, 1)
+        second = Patron(self.first_name, self.last_name, self.age, 2)
+        self.CuT.db.insert_patron(first)
+        self.CuT.db.insert_patron(second)
+        events = [(Library.BORROW, 'Redwall', first),
+                  (Library.BORROW, 'Mossflower', second),
+                  (Library.BORROW, 'Mattimeo', first),
+                  (Library.RETURN, 'Redwall', first)]
+
+        # Action
+        with patch.object(self.CuT.db, 'update_patron', wraps=self.CuT.db.update_patron) as update:
+            updated = self.CuT.apply_loans(events)
+
+        # Assert
+        self.assertEqual(2, updated)
+        self.assertEqual(2, update.call_count)
+        self.assertEqual(['mattimeo'], self.CuT.db.retrieve_patron(1).get_borrowed_books())
+        self.assertEqual(['mossflower'], self.CuT.db.retrieve_patron(2).get_borrowed_books())
+
+    def test_apply_loans_unknown_action(self):
+
+        # Assume
+        self.CuT.db = Mock()
+        patron = Patron(self.first_name, self.last_name, self.age, self.member_id)
+
+        # Assert
+        with self.assertRaises(ValueError):
+            self.CuT.apply_loans([(Library.BORROW, 'Redwall', patron), ('renew', 'Redwall', patron)])
+        self.assertEqual([], patron.get_borrowed_books())
+        self.CuT.db.update_patron.assert_not_called()
+
+    def test_is_book_borrowed_ignores_case(self):
+
+        # Assume
+        patron = Patron(self.first_name, self.last_name, self.age, self.member_id)
+        patron.add_borrowed_book(self.book_title_there)
+
+        # Assert
+        self.assertTrue(self.CuT.is_book_borrowed(self.book_title_there.upper(), patron))
+        self.assertFalse(self.CuT.is_book_borrowed(self.book_title_not_there, patron))
+
+
+    def test_get_holders_for_book(self):
+
+        # Assume
+        self.CuT.db = Mock()
+        self.CuT.db.holders_of.return_value = {self.member_id}
+
+        # Assert
+        self.assertEqual({self.member_id}, self.CuT.get_holders_for_book(self.book_title_there))
+        self.CuT.db.holders_of.assert_called_once_with(self.book_title_there)
+
+    def test_get_outstanding_count_for_book(self):
+
+        # Assume
+        self.CuT.db = Mock()
+        self.CuT.db.outstanding_count.return_value = 3
+
+        # Assert
+        self.assertEqual(3, self.CuT.get_outstanding_count_for_book(self.book_title_there))
+
+
+class TestLibraryConcurrency(TestCase):
+
+    THREADS = 8
+    PATRONS = 10
+    BOOKS_PER_THREAD = 20
+
+    def checkout_storm(self, db):
+        library = Library(db)
+        library.register_patrons(('first', 'last', 20, memberID) for memberID in range(self.PATRONS))
+        patrons = [db.retrieve_patron(memberID) for memberID in range(self.PATRONS)]
+
+        def work(thread):
+            for number in range(self.BOOKS_PER_THREAD):
+                for patron in patrons:
+                    library.borrow_book('book %d-%d' % (thread, number), patron)
+            for number in range(0, self.BOOKS_PER_THREAD, 2):
+                for patron in patrons:
+                    library.return_borrowed_book('book %d-%d' % (thread, number), patron)
+
+        with ThreadPoolExecutor(self.THREADS) as pool:
+            list(pool.map(work, range(self.THREADS)))
+
+        expected = {'book %d-%d' % (thread, number) for thread in range(self.THREADS)
+                    for number in range(1, self.BOOKS_PER_THREAD, 2)}
+        db.clear_identity_map()
+        for memberID in range(self.PATRONS):
+            self.assertEqual(expected, set(db.retrieve_patron(memberID).get_borrowed_books()))
+        self.assertEqual(self.PATRONS, library.get_outstanding_count_for_book('book 0-1'))
+        self.assertEqual(0, library.get_outstanding_count_for_book('book 0-0'))
+        db.close_db()
+
+    def test_no_lost_updates_tinydb(self):
+        self.checkout_storm(Library_DB(Library_DB.MEMORY, identity_map=True))
+
+    def test_no_lost_updates_sqlite(self):
+        self.checkout_storm(Library_DB(Library_DB.MEMORY, identity_map=True, backend='sqlite'))
+
 
 if __name__ == '__main__':
     unittest.main()
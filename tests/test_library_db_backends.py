@@ -0,0 +1,355 @@
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from library.journal_backend import JournalPatronTable
+from library.library import Library
+from library.library_db_interface import Library_DB, ImportResult
+from library.migrate import migrate_json_to_sqlite
+from library.patron import Patron
+from library.storage import CompactJSONStorage
+
+
+def insert_patrons_in_process(backend, path, first, count):
+    db = Library_DB(path, backend=backend, process_safe=True)
+    for memberID in range(first, first + count):
+        db.insert_patron(Patron('first', 'last', 20, memberID))
+    db.close_db()
+
+
+class LibraryDBBackendTests:
+    """Behaviour every Library_DB backend has to share, run once per backend."""
+
+    BACKEND = None
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        self.CuT = self.open_db()
+
+    def tearDown(self):
+        self.CuT.close_db()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def open_db(self, **kwargs):
+        return Library_DB(backend=self.BACKEND, **kwargs)
+
+    def reopen(self, **kwargs):
+        self.CuT.close_db()
+        self.CuT = self.open_db(**kwargs)
+
+    def test_insert_and_retrieve(self):
+        self.assertEqual(1, self.CuT.insert_patron(Patron('first', 'last', 20, 1)))
+        self.assertEqual(2, self.CuT.insert_patron(Patron('other', 'last', 30, 'a2')))
+        self.assertEqual(Patron('other', 'last', 30, 'a2'), self.CuT.retrieve_patron('a2'))
+        self.assertEqual(None, self.CuT.retrieve_patron(3))
+
+    def test_insert_duplicate(self):
+        self.CuT.insert_patron(Patron('first', 'last', 20, 1))
+        self.assertEqual(None, self.CuT.insert_patron(Patron('first', 'last', 20, 1)))
+        self.assertEqual(1, self.CuT.get_patron_count())
+
+    def test_insert_not_patron(self):
+        self.assertEqual(None, self.CuT.insert_patron(0))
+
+    def test_update_patron(self):
+        patron = Patron('first', 'last', 20, 1)
+        self.CuT.insert_patron(patron)
+        patron.add_borrowed_book('Redwall')
+        patron.add_borrowed_book('Mossflower')
+        self.CuT.update_patron(patron)
+        patron.return_borrowed_book('Redwall')
+        self.CuT.update_patron(patron)
+        self.reopen()
+        self.assertEqual(['mossflower'], self.CuT.retrieve_patron(1).get_borrowed_books())
+
+    def test_update_patron_not_in_db(self):
+        self.assertEqual(None, self.CuT.update_patron(Patron('first', 'last', 20, 1)))
+        self.assertEqual(0, self.CuT.get_patron_count())
+
+    def test_get_all_patrons(self):
+        self.CuT.insert_patron(Patron('first', 'last', 20, 1))
+        self.CuT.insert_patron(Patron('other', 'last', 30, 2))
+        self.assertEqual([{'fname': 'first', 'lname': 'last', 'age': 20, 'memberID': 1, 'borrowed_books': []},
+                          {'fname': 'other', 'lname': 'last', 'age': 30, 'memberID': 2, 'borrowed_books': []}],
+                         self.CuT.get_all_patrons())
+
+    def test_iter_patrons(self):
+        patron = Patron('first', 'last', 20, 1)
+        patron.add_borrowed_book('Redwall')
+        self.CuT.insert_patrons([patron] + [('other', 'last', 30, memberID) for memberID in range(2, 6)])
+        patrons = list(self.CuT.iter_patrons(batch_size=2))
+        self.assertEqual([1, 2, 3, 4, 5], [patron.get_memberID() for patron in patrons])
+        self.assertEqual(['redwall'], patrons[0].get_borrowed_books())
+
+    def test_insert_patrons(self):
+        result = self.CuT.insert_patrons([('first', 'last', 20, 1), ('f1rst', 'last', 20, 2),
+                                          ('again', 'last', 20, 1)])
+        self.assertEqual([1, ImportResult.INVALID, ImportResult.DUPLICATE], result.results)
+        self.reopen()
+        self.assertEqual(1, self.CuT.get_patron_count())
+
+    def test_holders_of(self):
+        patron = Patron('first', 'last', 20, 1)
+        self.CuT.insert_patron(patron)
+        patron.add_borrowed_book('Redwall')
+        self.CuT.update_patron(patron)
+        self.reopen()
+        self.assertEqual({1}, self.CuT.holders_of('Redwall'))
+        self.assertEqual(1, self.CuT.outstanding_count('Redwall'))
+
+    def test_write_behind(self):
+        self.reopen(write_behind=True)
+        self.CuT.insert_patron(Patron('first', 'last', 20, 1))
+        self.CuT.flush()
+        self.reopen()
+        self.assertTrue(self.CuT.has_patron(1))
+
+    def test_batch_rollback(self):
+        self.CuT.insert_patron(Patron('first', 'last', 20, 1))
+        with self.assertRaises(ValueError):
+            with self.CuT.batch():
+                self.CuT.insert_patron(Patron('other', 'last', 20, 2))
+                raise ValueError
+        self.assertFalse(self.CuT.has_patron(2))
+        self.reopen()
+        self.assertEqual(1, self.CuT.get_patron_count())
+
+    def test_batch_rollback_marks_patrons_unsaved(self):
+        patron = Patron('first', 'last', 20, 1)
+        self.CuT.insert_patron(patron)
+        patron.add_borrowed_book('Redwall')
+        with self.assertRaises(ValueError):
+            with self.CuT.batch():
+                self.CuT.update_patron(patron)
+                raise ValueError
+        self.assertTrue(patron.is_dirty())
+        self.assertEqual(1, self.CuT.update_patrons([patron]))
+        self.reopen()
+        self.assertEqual(['redwall'], self.CuT.retrieve_patron(1).get_borrowed_books())
+
+    def test_library_borrow_and_return(self):
+        library = Library(self.CuT)
+        library.register_patron('first', 'last', 20, 1)
+        patron = self.CuT.retrieve_patron(1)
+        library.borrow_book('Redwall', patron)
+        self.assertTrue(library.is_book_borrowed('Redwall', self.CuT.retrieve_patron(1)))
+        library.return_borrowed_book('Redwall', patron)
+        self.assertFalse(library.is_book_borrowed('Redwall', self.CuT.retrieve_patron(1)))
+
+    def test_process_safe_sees_other_writers(self):
+        self.reopen(process_safe=True)
+        other = self.open_db(process_safe=True)
+        other.insert_patron(Patron('first', 'last', 20, 1))
+        self.assertTrue(self.CuT.has_patron(1))
+        patron = self.CuT.retrieve_patron(1)
+        patron.add_borrowed_book('Redwall')
+        self.CuT.update_patron(patron)
+        self.assertEqual(['redwall'], other.retrieve_patron(1).get_borrowed_books())
+        self.assertEqual({1}, other.holders_of('Redwall'))
+        self.assertEqual(2, other.insert_patron(Patron('other', 'last', 30, 2)))
+        self.assertEqual(2, self.CuT.get_patron_count())
+        other.close_db()
+
+    def test_process_safe_no_lost_writes(self):
+        self.reopen(process_safe=True)
+        path = os.path.abspath(self.CuT.path)
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=insert_patrons_in_process, args=(self.BACKEND, path, first, 10))
+                   for first in (0, 100, 200, 300)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(40, self.CuT.get_patron_count())
+        self.assertEqual(40, len(self.CuT.get_all_patrons()))
+
+
+class TestTinyDBBackend(LibraryDBBackendTests, unittest.TestCase):
+    BACKEND = 'tinydb'
+
+
+    def test_process_safe_does_not_reread_unchanged_file(self):
+        self.reopen(process_safe=True)
+        self.CuT.insert_patron(Patron('first', 'last', 20, 1))
+        with patch.object(CompactJSONStorage, 'read') as mock_read:
+            self.CuT.retrieve_patron(1)
+            self.CuT.get_patron_count()
+            mock_read.assert_not_called()
+        self.assertTrue(os.path.exists('db.json.lock'))
+
+    def test_process_safe_requires_default_storage(self):
+        with self.assertRaises(ValueError):
+            self.open_db(process_safe=True, storage=CompactJSONStorage)
+
+
+class TestSQLiteBackend(LibraryDBBackendTests, unittest.TestCase):
+    BACKEND = 'sqlite'
+
+    def test_memory(self):
+        db = Library_DB(Library_DB.MEMORY, backend='sqlite')
+        db.insert_patron(Patron('first', 'last', 20, 1))
+        self.assertTrue(db.has_patron(1))
+        db.close_db()
+        self.assertFalse(os.path.exists(Library_DB.MEMORY))
+
+    def test_process_safe_index_survives_direct_reads(self):
+        self.reopen(process_safe=True)
+        other = self.open_db(process_safe=True)
+        other.insert_patron(Patron('first', 'last', 20, 1))
+        self.CuT.db.all()
+        self.assertTrue(self.CuT.has_patron(1))
+        other.close_db()
+
+    def test_process_safe_write_holds_write_lock(self):
+        self.reopen(process_safe=True)
+        conn = sqlite3.connect(self.CuT.path, timeout=0)
+        with self.CuT.batch():
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute("INSERT INTO patrons (memberID) VALUES (2)")
+            self.CuT.insert_patron(Patron('first', 'last', 20, 1))
+        conn.close()
+        self.assertTrue(self.CuT.has_patron(1))
+
+    def test_insert_duplicate_from_other_connection(self):
+        other = self.open_db()
+        other.insert_patron(Patron('first', 'last', 20, 1))
+        self.assertIsNone(self.CuT.insert_patron(Patron('other', 'last', 30, 1)))
+        other.close_db()
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            Library_DB(backend='csv')
+
+
+class TestJournalBackend(LibraryDBBackendTests, unittest.TestCase):
+    BACKEND = 'journal'
+
+    def journal(self):
+        with open(self.CuT.path, 'rb') as journal_file:
+            return [json.loads(line) for line in journal_file]
+
+    def test_checkout_appends_one_record(self):
+        patron = Patron('first', 'last', 20, 1)
+        self.CuT.insert_patron(patron)
+        self.CuT.insert_patron(Patron('other', 'last', 30, 2))
+        patron.add_borrowed_book('Redwall')
+        self.CuT.update_patron(patron)
+        patron.return_borrowed_book('Redwall')
+        self.CuT.update_patron(patron)
+        self.assertEqual([['borrow', 1, 'redwall'], ['return', 1, 'redwall']], self.journal()[2:])
+        patron.age = 21
+        self.CuT.update_patron(patron)
+        self.assertEqual('put', self.journal()[-1][0])
+        self.reopen()
+        self.assertEqual(21, self.CuT.retrieve_patron(1).age)
+
+    def test_compact(self):
+        patron = Patron('first', 'last', 20, 1)
+        self.CuT.insert_patron(patron)
+        for title in ('Redwall', 'Mossflower', 'Mattimeo'):
+            patron.add_borrowed_book(title)
+            self.CuT.update_patron(patron)
+        patron.return_borrowed_book('Mossflower')
+        self.CuT.update_patron(patron)
+        self.assertEqual(5, len(self.journal()))
+        self.CuT.compact()
+        self.assertEqual([['put', 1, {'fname': 'first', 'lname': 'last', 'age': 20, 'memberID': 1,
+                                      'borrowed_books': ['redwall', 'mattimeo']}]], self.journal())
+        self.reopen()
+        self.assertEqual(['redwall', 'mattimeo'], self.CuT.retrieve_patron(1).get_borrowed_books())
+
+    def test_compacts_when_journal_grows(self):
+        self.CuT.db.COMPACT_MIN_RECORDS = 10
+        patron = Patron('first', 'last', 20, 1)
+        self.CuT.insert_patron(patron)
+        for _ in range(10):
+            patron.add_borrowed_book('Redwall')
+            self.CuT.update_patron(patron)
+            patron.return_borrowed_book('Redwall')
+            self.CuT.update_patron(patron)
+        self.assertLess(len(self.journal()), 11)
+        self.reopen()
+        self.assertEqual([], self.CuT.retrieve_patron(1).get_borrowed_books())
+
+    def test_ignores_truncated_record(self):
+        self.CuT.insert_patron(Patron('first', 'last', 20, 1))
+        self.CuT.close_db()
+        with open('db.journal', 'ab') as journal_file:
+            journal_file.write(b'["put",2,{"fna')
+        size = os.path.getsize('db.journal')
+        self.CuT = self.open_db()
+        self.assertEqual(1, self.CuT.get_patron_count())
+        self.assertEqual(size, os.path.getsize('db.journal'))
+        self.assertEqual(2, self.CuT.insert_patron(Patron('other', 'last', 30, 2)))
+        self.reopen()
+        self.assertEqual(2, self.CuT.get_patron_count())
+
+    def test_process_safe_does_not_replay_unchanged_journal(self):
+        self.reopen(process_safe=True)
+        other = self.open_db(process_safe=True)
+        self.CuT.insert_patron(Patron('first', 'last', 20, 1))
+        with patch.object(JournalPatronTable, 'replay', autospec=True,
+                          side_effect=JournalPatronTable.replay) as mock_replay:
+            for _ in range(3):
+                self.CuT.get_patron_count()
+                other.get_patron_count()
+            self.assertEqual(1, mock_replay.call_count)
+        other.close_db()
+
+    def test_new_ids_follow_highest_id(self):
+        self.CuT.insert_patron(Patron('first', 'last', 20, 1))
+        self.CuT.insert_patron(Patron('other', 'last', 30, 2))
+        self.CuT.db.insert_multiple([{'memberID': 3}], doc_ids=[10])
+        self.assertEqual(11, self.CuT.insert_patron(Patron('third', 'last', 40, 4)))
+        self.reopen()
+        self.assertEqual(12, self.CuT.insert_patron(Patron('fourth', 'last', 50, 5)))
+
+    def test_memory_not_supported(self):
+        with self.assertRaises(ValueError):
+            self.open_db(path=Library_DB.MEMORY)
+
+
+class TestMigrate(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def test_migrate(self):
+        db = Library_DB()
+        patron = Patron('first', 'last', 20, 1)
+        db.insert_patron(patron)
+        db.insert_patron(Patron('other', 'last', 30, 2))
+        patron.add_borrowed_book('Redwall')
+        db.update_patron(patron)
+        expected = db.get_all_patrons()
+        db.close_db()
+
+        self.assertEqual(2, migrate_json_to_sqlite('db.json', 'db.sqlite3'))
+
+        db = Library_DB(backend='sqlite')
+        self.assertEqual(expected, db.get_all_patrons())
+        self.assertEqual(30, db.retrieve_patron(2).get_age())
+        self.assertEqual({1}, db.holders_of('Redwall'))
+        db.close_db()
+
+    def test_migrate_refuses_non_empty_target(self):
+        with open('db.json', 'w') as db_file:
+            json.dump({'_default': {'1': {'fname': 'first', 'lname': 'last', 'age': 20, 'memberID': 1,
+                                          'borrowed_books': []}}}, db_file)
+        migrate_json_to_sqlite('db.json', 'db.sqlite3')
+        with self.assertRaises(ValueError):
+            migrate_json_to_sqlite('db.json', 'db.sqlite3')
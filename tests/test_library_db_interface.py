@@ -1,18 +1,29 @@
 import unittest
 from unittest.mock import Mock, patch
 
+import csv
+import io
+import json
 import os
+import shutil
+import tempfile
 import library.library_db_interface
 from library.patron import Patron
-from library.library_db_interface import Library_DB
+from library.library_db_interface import Library_DB, ImportResult
+from library.storage import CompactJSONStorage
+from tinydb.storages import MemoryStorage
 
 
 class TestLibraryDBInterface(unittest.TestCase):
-    CuT = Library_DB()
+    CuT = Library_DB(Library_DB.MEMORY)
     CuT.close_db()
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
     def tearDown(self):
-        if os.path.exists('db.json'):
-            os.remove('db.json')
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
     def test_insert_patron_not_patron(self):
         self.assertEqual(None, self.CuT.insert_patron( 0))
 
@@ -20,7 +31,8 @@ class TestLibraryDBInterface(unittest.TestCase):
         mock_patron = Mock(Patron)
         mock_patron.get_memberid = Mock()
         mock_patron.get_memberid.return_value = ('1')
-        self.CuT = Library_DB()
+        mock_patron.get_borrowed_books.return_value = []
+        self.CuT = Library_DB(Library_DB.MEMORY)
         self.CuT.close_db()
         self.CuT.db = Mock()
         self.CuT.db.search = Mock()
@@ -41,9 +53,8 @@ class TestLibraryDBInterface(unittest.TestCase):
         self.CuT.db.insert = Mock()
         self.CuT.db.insert.return_value = 1
 
-        self.CuT.retrieve_patron = Mock()
-        self.CuT.retrieve_patron.return_value = mock_patron  # Can't subscript a mock so do this for now
-        # and test retrieve_patron method later
+        self.CuT.has_patron = Mock()
+        self.CuT.has_patron.return_value = True  # memberID is in the index
 
         self.CuT.insert_patron(mock_patron)
 
@@ -51,17 +62,15 @@ class TestLibraryDBInterface(unittest.TestCase):
 
     def test_get_patron_count(self):
         self.CuT.db = Mock()
-        self.CuT.db.all = Mock()
-        self.CuT.db.all.return_value = []  # list of patrons in db
+        self.CuT._member_index = {}  # index of patrons in db
         self.assertEqual(0, self.CuT.get_patron_count())
+        self.CuT.db.all.assert_not_called()
 
     def test_get_patron_count_multiple(self):
-        mock_patron = Mock(Patron)
-        mock_patron.get_memberid = Mock()
         self.CuT.db = Mock()
-        self.CuT.db.all = Mock()
-        self.CuT.db.all.return_value = [mock_patron, mock_patron]  # list of patrons in db
+        self.CuT._member_index = {'1': 1, '2': 2}  # index of patrons in db
         self.assertEqual(2, self.CuT.get_patron_count())
+        self.CuT.db.all.assert_not_called()
 
     def test_get_all_patrons(self):
         self.CuT.db = Mock()
@@ -78,6 +87,23 @@ class TestLibraryDBInterface(unittest.TestCase):
 
         self.assertEqual([mock_patron, mock_patron], self.CuT.get_all_patrons())
 
+    def test_iter_patrons(self):
+        self.CuT.db = [{'fname': 'first', 'lname': 'last', 'age': 20, 'memberID': 1, 'borrowed_books': []},
+                       {'fname': 'other', 'lname': 'last', 'age': 30, 'memberID': 2, 'borrowed_books': []}]
+        patrons = list(self.CuT.iter_patrons(batch_size=1))
+        self.assertEqual([Patron('first', 'last', 20, 1), Patron('other', 'last', 30, 2)], patrons)
+
+    def test_iter_patrons_raw(self):
+        self.CuT.db = [{'fname': 'first', 'lname': 'last', 'age': 20, 'memberID': 1, 'borrowed_books': []}]
+        self.assertEqual(self.CuT.db, list(self.CuT.iter_patrons(raw=True)))
+
+    def test_iter_patrons_is_lazy(self):
+        self.CuT.db = Mock()
+        self.CuT.db.__iter__ = Mock(return_value=iter([]))
+        patrons = self.CuT.iter_patrons()
+        self.CuT.db.all.assert_not_called()
+        self.assertEqual([], list(patrons))
+
     def test_update_patron_not_patron(self):
         self.assertEqual(None, self.CuT.update_patron(0))
 
@@ -88,12 +114,22 @@ class TestLibraryDBInterface(unittest.TestCase):
         self.CuT.convert_patron_to_db_format = Mock()
         self.CuT.convert_patron_to_db_format.return_value = mock_patron
         self.CuT.db.update = Mock()
+        self.CuT._member_index[mock_patron.get_memberID()] = 1
+        mock_patron.get_borrowed_books.return_value = []
 
         self.CuT.update_patron(mock_patron)
-        self.CuT.db.update.assert_called_once()
+        self.CuT.db.update.assert_called_once_with(mock_patron, doc_ids=[1])
+
+    def test_update_patron_not_in_db(self):
+        mock_patron = Mock(Patron)
+        self.CuT.db = Mock()
+        self.CuT.db.update = Mock()
+
+        self.assertEqual(None, self.CuT.update_patron(mock_patron))
+        self.CuT.db.update.assert_not_called()
 
     def test_retrieve_patron(self):
-        self.CuT = Library_DB()
+        self.CuT = Library_DB(Library_DB.MEMORY)
         self.CuT.close_db()
         self.CuT.db = Mock()
         self.CuT.db.search = Mock()
@@ -105,3 +141,406 @@ class TestLibraryDBInterface(unittest.TestCase):
         self.CuT.db.close = Mock()
         self.CuT.close_db()
         self.CuT.db.close.assert_called_once()
+
+
+class BackendTests:
+    """Tests run once per Library_DB backend, in a temporary directory."""
+
+    BACKEND = None
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def open_db(self, path=None, **kwargs):
+        if path == Library_DB.MEMORY and self.BACKEND == 'journal':
+            path = None  # the journal backend always keeps a file
+        return Library_DB(path, backend=self.BACKEND, **kwargs)
+
+
+class LibraryDBInterfaceBackendTests(BackendTests):
+    """Library_DB tests that do not depend on the storage engine."""
+
+    def test_index_built_on_open(self):
+        db = self.open_db()
+        db.insert_patron(Patron('first', 'last', 20, 1))
+        db.insert_patron(Patron('other', 'last', 30, 2))
+        db.close_db()
+
+        db = self.open_db()
+        self.assertTrue(db.has_patron(2))
+        self.assertEqual(30, db.retrieve_patron(2).get_age())
+        self.assertEqual(None, db.retrieve_patron(3))
+        db.close_db()
+
+    def test_insert_patron_duplicate(self):
+        db = self.open_db(Library_DB.MEMORY)
+        self.assertEqual(1, db.insert_patron(Patron('first', 'last', 20, 1)))
+        self.assertEqual(None, db.insert_patron(Patron('first', 'last', 20, 1)))
+        db.close_db()
+
+    def test_retrieve_patron_restores_borrowed_books(self):
+        db = self.open_db()
+        patron = Patron('first', 'last', 20, 1)
+        db.insert_patron(patron)
+        patron.add_borrowed_book('Redwall')
+        patron.add_borrowed_book('Mossflower')
+        db.update_patron(patron)
+        db.close_db()
+
+        db = self.open_db()
+        retrieved = db.retrieve_patron(1)
+        self.assertEqual(patron, retrieved)
+        self.assertEqual(['redwall', 'mossflower'], retrieved.get_borrowed_books())
+        db.close_db()
+
+    def test_retrieve_patron_without_identity_map(self):
+        db = self.open_db(Library_DB.MEMORY)
+        db.insert_patron(Patron('first', 'last', 20, 1))
+        self.assertIsNot(db.retrieve_patron(1), db.retrieve_patron(1))
+        db.close_db()
+
+    def test_retrieve_patron_with_identity_map(self):
+        db = self.open_db(Library_DB.MEMORY, identity_map=True)
+        patron = Patron('first', 'last', 20, 1)
+        db.insert_patron(patron)
+        db.insert_patron(Patron('other', 'last', 20, 2))
+        self.assertIs(patron, db.retrieve_patron(1))
+        self.assertIs(db.retrieve_patron(2), db.retrieve_patron(2))
+        db.clear_identity_map()
+        self.assertIsNot(patron, db.retrieve_patron(1))
+        db.close_db()
+
+    def test_identity_map_follows_updated_patron(self):
+        db = self.open_db(Library_DB.MEMORY, identity_map=True)
+        db.insert_patron(Patron('first', 'last', 20, 1))
+        db.clear_identity_map()
+        db.retrieve_patron(1)
+        other = Patron('first', 'last', 20, 1)
+        other.add_borrowed_book('Redwall')
+        db.update_patron(other)
+        self.assertIs(other, db.retrieve_patron(1))
+        db.retrieve_patron(1).add_borrowed_book('Mossflower')
+        db.flush_dirty()
+        self.assertEqual(['redwall', 'mossflower'], db.get_all_patrons()[0]['borrowed_books'])
+        db.close_db()
+
+    def test_holders_of(self):
+        db = self.open_db(Library_DB.MEMORY)
+        first = Patron('first', 'last', 20, 1)
+        second = Patron('other', 'last', 20, 2)
+        db.insert_patron(first)
+        db.insert_patron(second)
+        first.add_borrowed_book('Redwall')
+        db.update_patron(first)
+        second.add_borrowed_book('Redwall')
+        second.add_borrowed_book('Mossflower')
+        db.update_patron(second)
+        self.assertEqual({1, 2}, db.holders_of('REDWALL'))
+        self.assertEqual(2, db.outstanding_count('redwall'))
+        self.assertEqual({2}, db.holders_of('Mossflower'))
+
+        second.return_borrowed_book('Redwall')
+        db.update_patron(second)
+        self.assertEqual({1}, db.holders_of('Redwall'))
+        self.assertEqual(0, db.outstanding_count('Martin the Warrior'))
+        self.assertEqual(set(), db.holders_of('Martin the Warrior'))
+        db.close_db()
+
+    def test_holders_rebuilt_on_open(self):
+        db = self.open_db()
+        patron = Patron('first', 'last', 20, 1)
+        patron.add_borrowed_book('Redwall')
+        db.insert_patrons([patron])
+        db.close_db()
+
+        db = self.open_db()
+        self.assertEqual({1}, db.holders_of('Redwall'))
+        db.close_db()
+
+    def test_update_patron_by_index(self):
+        db = self.open_db(Library_DB.MEMORY)
+        patron = Patron('first', 'last', 20, 1)
+        db.insert_patron(patron)
+        patron.add_borrowed_book('Redwall')
+        db.update_patron(patron)
+        self.assertEqual(['redwall'], db.get_all_patrons()[0]['borrowed_books'])
+        db.close_db()
+
+    def test_update_patron_unchanged_skips_write(self):
+        db = self.open_db(Library_DB.MEMORY)
+        patron = Patron('first', 'last', 20, 1)
+        db.insert_patron(patron)
+        patron.add_borrowed_book('Redwall')
+        db.update_patron(patron)
+        self.assertFalse(patron.is_dirty())
+        with patch.object(db.db, 'update') as mock_update:
+            db.update_patron(patron)
+            db.update_patron(db.retrieve_patron(1))
+            mock_update.assert_not_called()
+        db.close_db()
+
+    def test_update_patrons_writes_dirty_only(self):
+        db = self.open_db(Library_DB.MEMORY)
+        patrons = [Patron('first', 'last', 20, memberID) for memberID in range(3)]
+        for patron in patrons:
+            db.insert_patron(patron)
+        patrons[0].add_borrowed_book('Redwall')
+        patrons[2].add_borrowed_book('Mossflower')
+        with patch.object(db, 'update_patron', wraps=db.update_patron) as update:
+            self.assertEqual(2, db.update_patrons(patrons))
+            self.assertEqual([patrons[0], patrons[2]], [call[0][0] for call in update.call_args_list])
+        self.assertEqual(0, db.update_patrons(patrons))
+        self.assertEqual({2}, db.holders_of('Mossflower'))
+        db.close_db()
+
+    def test_insert_patron_marks_saved(self):
+        db = self.open_db(Library_DB.MEMORY)
+        patron = Patron('first', 'last', 20, 1)
+        patron.add_borrowed_book('Redwall')
+        db.insert_patron(patron)
+        self.assertFalse(patron.is_dirty())
+        self.assertEqual(0, db.update_patrons([patron]))
+        db.close_db()
+
+    def test_flush_dirty(self):
+        db = self.open_db(Library_DB.MEMORY, identity_map=True)
+        db.insert_patron(Patron('first', 'last', 20, 1))
+        db.insert_patron(Patron('other', 'last', 30, 2))
+        db.retrieve_patron(1).add_borrowed_book('Redwall')
+        db.retrieve_patron(2)
+        self.assertEqual(1, db.flush_dirty())
+        db.clear_identity_map()
+        self.assertEqual(['redwall'], db.retrieve_patron(1).get_borrowed_books())
+        db.close_db()
+
+
+
+class TestLibraryDBInterfaceTinyDB(LibraryDBInterfaceBackendTests, unittest.TestCase):
+    BACKEND = 'tinydb'
+
+
+class TestLibraryDBInterfaceSQLite(LibraryDBInterfaceBackendTests, unittest.TestCase):
+    BACKEND = 'sqlite'
+
+
+class TestLibraryDBInterfaceJournal(LibraryDBInterfaceBackendTests, unittest.TestCase):
+    BACKEND = 'journal'
+
+
+class TestLibraryDBWriteBehind(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def stored_patrons(self):
+        if not os.path.exists('db.json') or not os.path.getsize('db.json'):
+            return []
+        with open('db.json') as db_file:
+            return list(json.load(db_file).get('_default', {}).values())
+
+    def test_write_through_by_default(self):
+        db = Library_DB()
+        db.insert_patron(Patron('first', 'last', 20, 1))
+        self.assertEqual(1, len(self.stored_patrons()))
+        db.close_db()
+
+    def test_writes_buffered_until_flush(self):
+        db = Library_DB(write_behind=True)
+        db.insert_patron(Patron('first', 'last', 20, 1))
+        self.assertEqual(0, len(self.stored_patrons()))
+        self.assertEqual(1, db.get_patron_count())
+        db.flush()
+        self.assertEqual(1, len(self.stored_patrons()))
+        db.close_db()
+
+    def test_close_db_flushes(self):
+        db = Library_DB(write_behind=True)
+        db.insert_patron(Patron('first', 'last', 20, 1))
+        db.close_db()
+        self.assertEqual(1, len(self.stored_patrons()))
+
+    def test_flush_on_write_count(self):
+        db = Library_DB(write_behind=True, write_cache_size=2)
+        db.insert_patron(Patron('first', 'last', 20, 1))
+        self.assertEqual(0, len(self.stored_patrons()))
+        db.insert_patron(Patron('first', 'last', 20, 2))
+        self.assertEqual(2, len(self.stored_patrons()))
+        db.close_db()
+
+    def test_flush_on_mutation_count(self):
+        db = Library_DB(write_behind=True, write_cache_size=3)
+        patron = Patron('first', 'last', 20, 1)
+        db.insert_patron(patron)
+        patron.add_borrowed_book('Redwall')
+        db.update_patron(patron)
+        db.update_patron(patron)
+        self.assertEqual(0, len(self.stored_patrons()))
+        patron.add_borrowed_book('Mossflower')
+        db.update_patron(patron)
+        self.assertEqual(['redwall', 'mossflower'], self.stored_patrons()[0]['borrowed_books'])
+        db.close_db()
+
+    def test_flush_on_interval(self):
+        db = Library_DB(write_behind=True, flush_interval=0)
+        db.insert_patron(Patron('first', 'last', 20, 1))
+        self.assertEqual(1, len(self.stored_patrons()))
+        db.close_db()
+
+    def test_timer_flushes_single_write(self):
+        db = Library_DB(write_behind=True, flush_interval=0.05)
+        db.insert_patron(Patron('first', 'last', 20, 1))
+        self.assertEqual(0, len(self.stored_patrons()))
+        db._flush_timer.join(5)
+        self.assertEqual(1, len(self.stored_patrons()))
+        self.assertIsNone(db._flush_timer)
+        db.close_db()
+
+    def test_close_db_cancels_timer(self):
+        db = Library_DB(write_behind=True, flush_interval=60)
+        db.insert_patron(Patron('first', 'last', 20, 1))
+        timer = db._flush_timer
+        db.close_db()
+        timer.join(1)
+        self.assertFalse(timer.is_alive())
+
+    def test_batch_writes_once(self):
+        db = Library_DB()
+        with patch.object(CompactJSONStorage, 'write', autospec=True, side_effect=CompactJSONStorage.write) as mock_write:
+            with db.batch():
+                for memberID in range(5):
+                    db.insert_patron(Patron('first', 'last', 20, memberID))
+            mock_write.assert_called_once()
+        self.assertEqual(5, len(self.stored_patrons()))
+        db.close_db()
+
+    def test_memory_database_does_not_touch_disk(self):
+        db = Library_DB(Library_DB.MEMORY)
+        db.insert_patron(Patron('first', 'last', 20, 1))
+        with db.batch():
+            db.insert_patron(Patron('first', 'last', 20, 2))
+        db.close_db()
+        self.assertFalse(os.path.exists('db.json'))
+        self.assertFalse(os.path.exists(Library_DB.MEMORY))
+
+    def test_batch_rolls_back_in_memory(self):
+        db = Library_DB(Library_DB.MEMORY)
+        patron = Patron('first', 'last', 20, 1)
+        db.insert_patron(patron)
+        with self.assertRaises(ValueError):
+            with db.batch():
+                db.insert_patron(Patron('other', 'last', 20, 2))
+                patron.add_borrowed_book('Redwall')
+                db.update_patron(patron)
+                raise ValueError
+        self.assertFalse(db.has_patron(2))
+        self.assertEqual([], db.retrieve_patron(1).get_borrowed_books())
+        self.assertEqual(set(), db.holders_of('Redwall'))
+        db.close_db()
+
+    def test_batch_rolls_back_on_error(self):
+        db = Library_DB()
+        db.insert_patron(Patron('first', 'last', 20, 1))
+        try:
+            with db.batch():
+                db.insert_patron(Patron('first', 'last', 20, 2))
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertFalse(db.has_patron(2))
+        self.assertEqual(1, db.get_patron_count())
+        self.assertEqual(1, len(self.stored_patrons()))
+        db.close_db()
+
+    def test_nested_batch(self):
+        db = Library_DB()
+        with db.batch():
+            db.insert_patron(Patron('first', 'last', 20, 1))
+            with db.batch():
+                db.insert_patron(Patron('first', 'last', 20, 2))
+            self.assertEqual(0, len(self.stored_patrons()))
+        self.assertEqual(2, len(self.stored_patrons()))
+        db.close_db()
+
+
+class LibraryDBInsertPatronsTests(BackendTests):
+
+    def setUp(self):
+        super().setUp()
+        self.CuT = self.open_db(Library_DB.MEMORY)
+
+    def tearDown(self):
+        self.CuT.close_db()
+        super().tearDown()
+
+    def test_insert_tuples_and_dicts(self):
+        result = self.CuT.insert_patrons([('first', 'last', 20, 1),
+                                          {'fname': 'other', 'lname': 'last', 'age': 30, 'memberID': 2},
+                                          Patron('third', 'last', 40, 3)])
+        self.assertEqual([1, 2, 3], result.results)
+        self.assertEqual(3, result.inserted)
+        self.assertEqual(30, self.CuT.retrieve_patron(2).get_age())
+        self.assertTrue(self.CuT.has_patron(3))
+
+    def test_insert_csv_rows(self):
+        rows = io.StringIO('fname,lname,age,memberID\nfirst,last,20,1\nother,last,30,2\n')
+        result = self.CuT.insert_patrons(csv.DictReader(rows))
+        self.assertEqual(2, result.inserted)
+        self.assertTrue(self.CuT.has_patron('2'))
+
+    def test_patrons_marked_saved(self):
+        patron = Patron('first', 'last', 20, 1)
+        patron.add_borrowed_book('Redwall')
+        self.CuT.insert_patrons([patron])
+        self.assertFalse(patron.is_dirty())
+        self.assertEqual(0, self.CuT.update_patrons([patron]))
+
+    def test_duplicates(self):
+        self.CuT.insert_patron(Patron('first', 'last', 20, 1))
+        result = self.CuT.insert_patrons([('first', 'last', 20, 1), ('other', 'last', 30, 2),
+                                          ('again', 'last', 30, 2)])
+        self.assertEqual([ImportResult.DUPLICATE, 2, ImportResult.DUPLICATE], result.results)
+        self.assertEqual(2, result.duplicates)
+        self.assertEqual(2, self.CuT.get_patron_count())
+
+    def test_invalid_records(self):
+        result = self.CuT.insert_patrons([('f1rst', 'last', 20, 1), ('first', 'last'), {'fname': 'x'},
+                                          ('first', 'last', 20, 2)])
+        self.assertEqual([ImportResult.INVALID] * 3 + [1], result.results)
+        self.assertEqual(3, result.invalid)
+
+    def test_empty(self):
+        result = self.CuT.insert_patrons([])
+        self.assertEqual([], result.results)
+        self.assertEqual(0, result.throughput)
+
+
+class TestLibraryDBInsertPatrons(LibraryDBInsertPatronsTests, unittest.TestCase):
+    BACKEND = 'tinydb'
+
+    def test_single_write(self):
+        records = (('first', 'last', 20, memberID) for memberID in range(100))
+        with patch.object(MemoryStorage, 'write', autospec=True, side_effect=MemoryStorage.write) as mock_write:
+            result = self.CuT.insert_patrons(records)
+            mock_write.assert_called_once()
+        self.assertEqual(100, result.inserted)
+        self.assertGreater(result.throughput, 0)
+
+
+class TestLibraryDBInsertPatronsSQLite(LibraryDBInsertPatronsTests, unittest.TestCase):
+    BACKEND = 'sqlite'
+
+
+class TestLibraryDBInsertPatronsJournal(LibraryDBInsertPatronsTests, unittest.TestCase):
+    BACKEND = 'journal'
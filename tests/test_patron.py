@@ -1,6 +1,6 @@
 import unittest
 
-from library.patron import Patron, InvalidNameException
+from library.patron import Patron, InvalidNameException, validate_name
 
 
 class TestPatron(unittest.TestCase):
@@ -13,6 +13,32 @@ class TestPatron(unittest.TestCase):
         else:
             self.fail('InvalidNameException not raised')
 
+    def test_create_patron_with_numbers_in_last_name(self):
+        with self.assertRaises(InvalidNameException):
+            Patron(fname="first", lname="l4st", age="15", memberID="1")
+
+    def test_validate_name(self):
+        self.assertEqual("first", validate_name("first"))
+        with self.assertRaises(InvalidNameException):
+            validate_name("f1rst")
+
+    def test_from_db_record(self):
+        CuT = Patron.from_db_record({'fname': 'first', 'lname': 'last', 'age': '15', 'memberID': '1',
+                                     'borrowed_books': ['cat in the hat']})
+        expected = Patron(fname="first", lname="last", age="15", memberID="1")
+        expected.add_borrowed_book("Cat in the Hat")
+        self.assertEqual(expected, CuT)
+
+    def test_from_db_record_is_not_validated(self):
+        CuT = Patron.from_db_record({'fname': 'f1rst', 'lname': 'last', 'age': '15', 'memberID': '1'})
+        self.assertEqual("f1rst", CuT.get_fname())
+        self.assertEqual([], CuT.get_borrowed_books())
+
+    def test_from_records(self):
+        records = [{'fname': 'first', 'lname': 'last', 'age': '15', 'memberID': str(i)} for i in range(3)]
+        CuT = list(Patron.from_records(records))
+        self.assertEqual(["0", "1", "2"], [patron.get_memberID() for patron in CuT])
+
     def test_add_borrowed_book(self):
         CuT = Patron(fname="first", lname="last", age="15", memberID="1")
         CuT.add_borrowed_book("Cat in the Hat")
@@ -36,6 +62,33 @@ class TestPatron(unittest.TestCase):
         CuT.return_borrowed_book("not borrowed book")
         self.assertEqual(0, len(CuT.get_borrowed_books()))
 
+    def test_borrowed_books_keep_order(self):
+        CuT = Patron(fname="first", lname="last", age="15", memberID="1")
+        for book in ["b", "a", "c"]:
+            CuT.add_borrowed_book(book)
+        CuT.return_borrowed_book("a")
+        self.assertEqual(["b", "c"], CuT.get_borrowed_books())
+
+    def test_has_borrowed_book(self):
+        CuT = Patron(fname="first", lname="last", age="15", memberID="1")
+        CuT.add_borrowed_book("Cat in the Hat")
+        self.assertTrue(CuT.has_borrowed_book("CAT IN THE HAT"))
+        self.assertFalse(CuT.has_borrowed_book("Green Eggs and Ham"))
+
+    def test_no_instance_dict(self):
+        CuT = Patron(fname="first", lname="last", age="15", memberID="1")
+        self.assertFalse(hasattr(CuT, '__dict__'))
+
+    def test_eq_different_books(self):
+        CuT = Patron(fname="first", lname="last", age="15", memberID="1")
+        other = Patron(fname="first", lname="last", age="15", memberID="1")
+        other.add_borrowed_book("Cat in the Hat")
+        self.assertEqual(False, CuT.__eq__(other))
+
+    def test_eq_not_patron(self):
+        CuT = Patron(fname="first", lname="last", age="15", memberID="1")
+        self.assertNotEqual(CuT, "first")
+
     def test_eq_equal(self):
         CuT = Patron(fname="first", lname="last", age="15", memberID="1")
         other = Patron(fname="first", lname="last", age="15", memberID="1")
@@ -74,3 +127,37 @@ class TestPatron(unittest.TestCase):
         CuT = Patron(fname="first", lname="last", age="15", memberID="1")
         self.assertEqual("1", CuT.get_memberID())
 
+    def test_add_borrowed_book_reports_change(self):
+        CuT = Patron(fname="first", lname="last", age="15", memberID="1")
+        self.assertTrue(CuT.add_borrowed_book("Redwall"))
+        self.assertFalse(CuT.add_borrowed_book("REDWALL"))
+        self.assertEqual(1, CuT.version)
+
+    def test_return_borrowed_book_reports_change(self):
+        CuT = Patron(fname="first", lname="last", age="15", memberID="1")
+        CuT.add_borrowed_book("Redwall")
+        self.assertTrue(CuT.return_borrowed_book("redwall"))
+        self.assertFalse(CuT.return_borrowed_book("redwall"))
+        self.assertEqual(2, CuT.version)
+
+    def test_dirty_until_saved(self):
+        CuT = Patron(fname="first", lname="last", age="15", memberID="1")
+        self.assertFalse(CuT.is_dirty())
+        CuT.add_borrowed_book("Redwall")
+        self.assertTrue(CuT.is_dirty())
+        CuT.mark_saved()
+        self.assertFalse(CuT.is_dirty())
+        CuT.add_borrowed_book("Redwall")
+        self.assertFalse(CuT.is_dirty())
+
+    def test_from_db_record_is_clean(self):
+        CuT = Patron.from_db_record({'fname': 'first', 'lname': 'last', 'age': 15, 'memberID': 1,
+                                     'borrowed_books': ['redwall']})
+        self.assertFalse(CuT.is_dirty())
+
+    def test_borrowed_titles_are_shared(self):
+        first = Patron(fname="first", lname="last", age="15", memberID="1")
+        second = Patron.from_db_record({'fname': 'other', 'lname': 'last', 'age': 15, 'memberID': 2,
+                                        'borrowed_books': [''.join(['red', 'wall'])]})
+        first.add_borrowed_book("Redwall")
+        self.assertIs(first.get_borrowed_books()[0], second.get_borrowed_books()[0])
@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from library.response_cache import ResponseCache, DiskCacheBackend, normalize_url
+
+
+class TestNormalizeUrl(unittest.TestCase):
+
+    def test_case_and_whitespace(self):
+        self.assertEqual(normalize_url("http://openlibrary.org/search.json?q=Red  wall"),
+                         normalize_url("HTTP://OpenLibrary.org/search.json?q=red wall"))
+
+    def test_parameter_order(self):
+        self.assertEqual(normalize_url("http://openlibrary.org/search.json?q=redwall&page=2"),
+                         normalize_url("http://openlibrary.org/search.json?page=2&q=redwall"))
+
+    def test_different_queries(self):
+        self.assertNotEqual(normalize_url("http://openlibrary.org/search.json?q=redwall"),
+                            normalize_url("http://openlibrary.org/search.json?author=redwall"))
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def test_miss_then_hit(self):
+        CuT = ResponseCache()
+        self.assertIsNone(CuT.get('key'))
+        CuT.set('key', {'docs': []})
+        self.assertEqual({'docs': []}, CuT.get('key'))
+        self.assertEqual({'hits': 1, 'misses': 1, 'entries': 1}, CuT.stats())
+
+    def test_expired_entry(self):
+        CuT = ResponseCache(ttl=10)
+        with patch('library.response_cache.time.time') as mock_time:
+            mock_time.return_value = 100
+            CuT.set('key', 'value')
+            mock_time.return_value = 111
+            self.assertIsNone(CuT.get('key'))
+        self.assertEqual(0, len(CuT))
+
+    def test_lru_eviction(self):
+        CuT = ResponseCache(max_entries=2)
+        CuT.set('a', 1)
+        CuT.set('b', 2)
+        CuT.get('a')
+        CuT.set('c', 3)
+        self.assertEqual(1, CuT.get('a'))
+        self.assertIsNone(CuT.get('b'))
+        self.assertEqual(3, CuT.get('c'))
+
+    def test_clear(self):
+        CuT = ResponseCache()
+        CuT.set('key', 'value')
+        CuT.get('key')
+        CuT.clear()
+        self.assertEqual({'hits': 0, 'misses': 0, 'entries': 0}, CuT.stats())
+
+
+class TestDiskCacheBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_survives_restart(self):
+        CuT = ResponseCache(DiskCacheBackend(self.path))
+        CuT.set('key', {'docs': [{'title': 'Redwall'}]})
+        CuT.close()
+        CuT = ResponseCache(DiskCacheBackend(self.path))
+        self.assertEqual({'docs': [{'title': 'Redwall'}]}, CuT.get('key'))
+        CuT.close()
+
+    def test_lru_eviction(self):
+        CuT = ResponseCache(DiskCacheBackend(self.path, touch_interval=0), max_entries=2)
+        with patch('library.response_cache.time.time') as mock_time:
+            mock_time.return_value = 1
+            CuT.set('a', 1)
+            mock_time.return_value = 2
+            CuT.set('b', 2)
+            mock_time.return_value = 3
+            CuT.get('a')
+            mock_time.return_value = 4
+            CuT.set('c', 3)
+            self.assertEqual(1, CuT.get('a'))
+            self.assertIsNone(CuT.get('b'))
+        CuT.close()
+
+    def test_hit_touches_entry_once_per_interval(self):
+        CuT = ResponseCache(DiskCacheBackend(self.path, touch_interval=60))
+        with patch('library.response_cache.time.time') as mock_time:
+            mock_time.return_value = 1
+            CuT.set('a', 1)
+            changes = CuT.backend.conn.total_changes
+            mock_time.return_value = 30
+            self.assertEqual(1, CuT.get('a'))
+            self.assertEqual(1, CuT.get('a'))
+            self.assertEqual(changes, CuT.backend.conn.total_changes)
+            mock_time.return_value = 61
+            self.assertEqual(1, CuT.get('a'))
+            self.assertEqual(changes + 1, CuT.backend.conn.total_changes)
+        CuT.close()
+
+    def test_entry_count(self):
+        CuT = ResponseCache(DiskCacheBackend(self.path), max_entries=3)
+        for key in ('a', 'b', 'a', 'c', 'd'):
+            CuT.set(key, key)
+        self.assertEqual(3, len(CuT))
+        CuT.close()
+        backend = DiskCacheBackend(self.path)
+        self.assertEqual(3, len(backend))
+        backend.delete('c')
+        backend.delete('c')
+        self.assertEqual(2, len(backend))
+        self.assertEqual(2, backend.count())
+        backend.close()
@@ -0,0 +1,175 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from tinydb import TinyDB
+from tinydb.storages import JSONStorage
+
+from library.library_db_interface import Library_DB
+from library.patron import Patron
+from library.storage import CompactJSONStorage, FileLock, WriteBehindMiddleware, get_json_codec, CODECS
+
+
+class TestJSONCodec(unittest.TestCase):
+
+    def test_auto_picks_installed_codec(self):
+        self.assertIn(get_json_codec('auto').name, CODECS)
+
+    def test_stdlib_codec_is_compact(self):
+        codec = get_json_codec('json')
+        self.assertEqual(b'{"a":[1,"\xc3\xa9"]}', codec.dumps({'a': [1, 'é']}))
+        self.assertEqual({'a': [1, 'é']}, codec.loads(codec.dumps({'a': [1, 'é']})))
+
+    def test_codecs_accept_integer_keys(self):
+        for name in CODECS:
+            self.assertEqual({'_default': {'1': {}}}, get_json_codec(name).loads(
+                get_json_codec(name).dumps({'_default': {1: {}}})), name)
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            get_json_codec('pickle')
+
+
+class TestCompactJSONStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'db.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_empty_file(self):
+        CuT = CompactJSONStorage(self.path)
+        self.assertIsNone(CuT.read())
+        CuT.close()
+
+    def test_round_trip(self):
+        CuT = CompactJSONStorage(self.path, codec='json')
+        CuT.write({'_default': {'1': {'fname': 'first'}}})
+        CuT.write({'_default': {}})
+        self.assertEqual({'_default': {}}, CuT.read())
+        CuT.close()
+        with open(self.path) as db_file:
+            self.assertEqual('{"_default":{}}', db_file.read())
+
+    def test_compatible_with_json_storage(self):
+        db = TinyDB(self.path, storage=CompactJSONStorage)
+        db.insert({'fname': 'first'})
+        db.close()
+        db = TinyDB(self.path, storage=JSONStorage)
+        self.assertEqual([{'fname': 'first'}], db.all())
+        db.insert({'fname': 'other'})
+        db.close()
+        db = TinyDB(self.path, storage=CompactJSONStorage)
+        self.assertEqual(2, len(db.all()))
+        db.close()
+
+    def test_changed(self):
+        CuT = CompactJSONStorage(self.path)
+        self.assertTrue(CuT.changed())
+        CuT.write({'_default': {}})
+        self.assertFalse(CuT.changed())
+        other = CompactJSONStorage(self.path)
+        other.write({'_default': {'1': {'fname': 'first'}}})
+        other.close()
+        self.assertTrue(CuT.changed())
+        CuT.read()
+        self.assertFalse(CuT.changed())
+        os.remove(self.path)
+        self.assertTrue(CuT.changed())
+        CuT.close()
+
+
+class TestFileLock(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'db.json.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @patch('library.storage.fcntl')
+    def test_nested_holds(self, mock_fcntl):
+        CuT = FileLock(self.path)
+        with CuT.hold():
+            with CuT.hold():
+                with CuT.hold(exclusive=True):
+                    pass
+        modes = [call[0][1] for call in mock_fcntl.flock.call_args_list]
+        self.assertEqual([mock_fcntl.LOCK_SH, mock_fcntl.LOCK_EX, mock_fcntl.LOCK_SH, mock_fcntl.LOCK_UN], modes)
+        CuT.close()
+
+    def test_exclusive_blocks_other_handles(self):
+        import fcntl
+        CuT = FileLock(self.path)
+        with open(self.path) as other:
+            with CuT.hold(exclusive=True):
+                with self.assertRaises(BlockingIOError):
+                    fcntl.flock(other.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+            fcntl.flock(other.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+        CuT.close()
+
+    @patch('library.storage.fcntl', None)
+    def test_requires_fcntl(self):
+        with self.assertRaises(OSError):
+            FileLock(self.path)
+
+
+class TestWriteBehindMiddleware(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'db.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_reads_are_cached(self):
+        CuT = WriteBehindMiddleware(CompactJSONStorage)
+        db = TinyDB(self.path, storage=CuT)
+        db.insert({'fname': 'first'})
+        with patch.object(CompactJSONStorage, 'read') as mock_read:
+            db.all()
+            db.all()
+            mock_read.assert_not_called()
+        db.close()
+
+    def test_suspended(self):
+        CuT = WriteBehindMiddleware(CompactJSONStorage, write_cache_size=1)
+        db = TinyDB(self.path, storage=CuT)
+        CuT.suspended = True
+        db.insert({'fname': 'first'})
+        self.assertEqual(1, CuT.pending_writes)
+        CuT.flush()
+        self.assertEqual(0, CuT.pending_writes)
+        db.close()
+
+
+class TestLibraryDBStorageOptions(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'patrons.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_path(self):
+        db = Library_DB(self.path)
+        db.insert_patron(Patron('first', 'last', 20, 1))
+        db.close_db()
+        with open(self.path) as db_file:
+            self.assertEqual(1, len(json.load(db_file)['_default']))
+
+    def test_custom_storage(self):
+        db = Library_DB(self.path, storage=JSONStorage)
+        db.insert_patron(Patron('first', 'last', 20, 1))
+        db.close_db()
+        db = Library_DB(self.path, json_codec='json')
+        self.assertTrue(db.has_patron(1))
+        db.close_db()